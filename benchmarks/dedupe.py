@@ -0,0 +1,133 @@
+"""
+Measure how duplicate detection scales with the number of names.
+
+    python -m benchmarks.dedupe --names 10000 --names 100000 --names 300000
+
+For each size, random peak names are generated across chapters, and a
+fraction are repeated in another chapter under a variant name ("Mt." for
+"Mount", a dropped accent, a typo) at a nearby elevation. Reports the time
+taken, the pairs found, and how many of the planted pairs were recovered.
+Time should grow roughly in line with the number of names, not its square.
+"""
+import random
+import time
+from dataclasses import dataclass, field
+
+import click  # type: ignore
+
+from climbers_guide_parser.dedupe import find_candidates
+
+# About 2,000 syllables, so that, as in the book, most names are not alike.
+SYLLABLES = [
+    onset + vowel + coda
+    for onset in [
+        "",
+        "b",
+        "c",
+        "d",
+        "f",
+        "g",
+        "h",
+        "k",
+        "l",
+        "m",
+        "n",
+        "p",
+        "r",
+        "s",
+        "t",
+        "w",
+        "br",
+        "ch",
+        "st",
+        "tr",
+    ]
+    for vowel in ["a", "e", "i", "o", "u"]
+    for coda in [
+        "",
+        "l",
+        "n",
+        "r",
+        "s",
+        "t",
+        "ck",
+        "ll",
+        "nd",
+        "rt",
+        "ss",
+        "x",
+        "m",
+        "ng",
+        "wn",
+        "rk",
+        "sh",
+        "th",
+        "y",
+        "z",
+    ]
+]
+PREFIXES = ["Mount", "Peak", "Tower", "Needle", "Dome", "Spire"]
+
+
+@dataclass
+class Record:
+    peak_id: str
+    name: str
+    region: str
+    elevation_feet: int
+    aka: list = field(default_factory=list)
+
+
+def variant(name: str, rng: random.Random) -> str:
+    if name.startswith("Mount ") and rng.random() < 0.5:
+        return "Mt. " + name[len("Mount ") :]
+    if "e" in name and rng.random() < 0.5:
+        return name.replace("e", "é", 1)
+    i = rng.randrange(len(name) - 1) + 1
+    return name[:i] + name[i + 1 :]
+
+
+def make_records(n: int, chapters: int, duplicates: float, seed: int = 0):
+    rng = random.Random(seed)
+    records = []
+    planted = set()
+    while len(records) < n:
+        word = "".join(rng.choice(SYLLABLES) for _ in range(rng.randrange(2, 5))).title()
+        name = f"{rng.choice(PREFIXES)} {word}"
+        region = rng.randrange(chapters)
+        feet = rng.randrange(8000, 14500)
+        records.append(Record(str(len(records)), name, f"Chapter {region}", feet))
+        if rng.random() < duplicates:
+            other = (region + rng.randrange(1, chapters)) % chapters
+            copy = Record(
+                str(len(records)),
+                variant(name, rng),
+                f"Chapter {other}",
+                feet + rng.randrange(-40, 41),
+            )
+            planted.add((records[-1].peak_id, copy.peak_id))
+            records.append(copy)
+    return records, planted
+
+
+@click.command()
+@click.option("--names", multiple=True, type=int, default=[10000, 100000], show_default=True)
+@click.option("--chapters", default=17, show_default=True)
+@click.option("--duplicates", default=0.05, show_default=True, help="Fraction repeated elsewhere")
+def main(names, chapters, duplicates):
+    for n in names:
+        records, planted = make_records(n, chapters, duplicates)
+        start = time.perf_counter()
+        candidates = find_candidates(records)
+        seconds = time.perf_counter() - start
+        found = {tuple(sorted((c.id, c.other_id), key=int)) for c in candidates}
+        recovered = len(found & planted)
+        click.echo(
+            f"{len(records):>7} names: {seconds:6.2f}s,"
+            f" {seconds / len(records) * 1e6:5.1f} µs/name, {len(candidates)} pairs,"
+            f" {recovered}/{len(planted)} planted pairs found"
+        )
+
+
+if __name__ == "__main__":
+    main()
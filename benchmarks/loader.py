@@ -0,0 +1,67 @@
+"""
+Compare get_soup() with the loader it replaced, which serialized the tree
+and parsed it a second time.
+
+    python -m benchmarks.loader --peaks 2000 --peaks 20000
+
+For each size a synthetic corpus is written and every chapter is loaded by
+both, taking the best of --runs for each. The two must produce the same
+markup; the report gives each loader's total time and the speedup.
+"""
+import os
+import tempfile
+import time
+
+import click  # type: ignore
+from bs4 import BeautifulSoup  # type: ignore
+
+from climbers_guide_parser import parser
+
+from .synthetic import write_corpus
+
+
+def reparse_soup(file: str) -> BeautifulSoup:
+    """get_soup() as it was before loading in a single parse."""
+    with open(file, encoding="windows-1252") as f:
+        soup = BeautifulSoup(f, "lxml")
+    for link in soup.find_all("a"):
+        link.decompose()
+    markup = str(soup)
+    markup = markup.replace("<p><i>", '<p class="peak"><i>')
+    markup = markup.replace("\n", " ")
+    return BeautifulSoup(markup, "lxml")
+
+
+def best_of(n: int, load, files: list[str]) -> float:
+    best = float("inf")
+    for _ in range(n):
+        start = time.perf_counter()
+        for file in files:
+            parser.free_soup(load(file))
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+@click.command()
+@click.option("--peaks", multiple=True, type=int, default=[2000, 20000], show_default=True)
+@click.option("--chapters", default=17, show_default=True)
+@click.option("--runs", default=5, show_default=True, help="Take the best of this many runs")
+def main(peaks, chapters, runs):
+    for n_peaks in peaks:
+        with tempfile.TemporaryDirectory() as workdir:
+            files = write_corpus(workdir, n_peaks, chapters)
+            for file in files:
+                if str(parser.get_soup(file)) != str(reparse_soup(file)):
+                    raise click.ClickException(f"The loaders disagree on {file}")
+            size = sum(os.path.getsize(f) for f in files)
+
+            old = best_of(runs, reparse_soup, files)
+            new = best_of(runs, parser.get_soup, files)
+        click.echo(
+            f"{n_peaks:>7} peaks, {size / 2**20:6.1f} MiB: reparse {old:7.3f} s,"
+            f" get_soup {new:7.3f} s, {old / new:.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
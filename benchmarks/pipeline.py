@@ -0,0 +1,159 @@
+"""
+Benchmark each stage of the parser pipeline on a synthetic corpus.
+
+    python -m benchmarks.pipeline --peaks 10000 --output bench.json
+    python -m benchmarks.pipeline --peaks 10000 --compare bench.json
+
+Stages run in order (load, region, peaks, passes, json, sqlite), each over
+every chapter, and report wall time, throughput and peak RSS. Results are
+saved as JSON, tagged with the git commit, so runs can be compared between
+commits with --compare.
+"""
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+
+import click  # type: ignore
+from sqlalchemy import create_engine  # type: ignore
+
+from climbers_guide_parser import parser
+from climbers_guide_parser.database import Base, set_sqlite_pragmas  # type: ignore
+from climbers_guide_parser.profiling import peak_rss, reset_peak_rss
+from climbers_guide_parser.sync import SqliteSync
+
+from .synthetic import write_corpus
+
+
+class Stage:
+    """Time a stage and record its item count, throughput and peak RSS."""
+
+    def __init__(self, results: dict, name: str, unit: str):
+        self.results = results
+        self.name = name
+        self.unit = unit
+        self.items = 0
+
+    def __enter__(self):
+        reset_peak_rss()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.start
+        self.results[self.name] = {
+            "seconds": seconds,
+            "items": self.items,
+            "unit": self.unit,
+            "per_second": self.items / seconds if seconds else 0.0,
+            "peak_rss_bytes": peak_rss(),
+        }
+
+
+def run(files: list[str], workdir: str) -> dict:
+    """Run every stage over files and return the results by stage."""
+    results: dict = {}
+
+    with Stage(results, "load", "bytes") as stage:
+        soups = [parser.get_soup(f) for f in files]
+        stage.items = sum(os.path.getsize(f) for f in files)
+
+    with Stage(results, "region", "regions") as stage:
+        regions = [parser.get_region(soup) for soup in soups]
+        stage.items = len(regions)
+
+    with Stage(results, "peaks", "peaks") as stage:
+        peaks = []
+        for soup, region in zip(soups, regions):
+            peaks += parser.get_peaks(soup, region)[0]
+        stage.items = len(peaks)
+
+    with Stage(results, "passes", "passes") as stage:
+        passes = []
+        for soup, region in zip(soups, regions):
+            passes += parser.get_passes(soup, region)
+        stage.items = len(passes)
+
+    del soups
+    records = len(peaks) + len(passes) + len(regions)
+
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        with Stage(results, "json", "records") as stage:
+            parser.write_json(peaks, "peaks")
+            parser.write_json(passes, "passes")
+            parser.write_json(regions, "regions")
+            stage.items = records
+    finally:
+        os.chdir(cwd)
+
+    with Stage(results, "sqlite", "records") as stage:
+        engine = create_engine(f"sqlite:///{os.path.join(workdir, 'bench.sqlite')}")
+        set_sqlite_pragmas(engine, parser.SQLITE_PRAGMAS)
+        Base.metadata.create_all(engine)
+        with engine.begin() as connection:
+            sync = SqliteSync(connection, parser.SQLITE_BATCH_SIZE)
+            for region in regions:
+                sync.sync_region(region)
+            sync.delete_stale()
+        engine.dispose()
+        stage.items = records
+
+    return results
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def report(stages: dict, baseline: dict):
+    for name, stage in stages.items():
+        line = (
+            f"{name:>7}: {stage['seconds']:8.3f}s {stage['per_second']:12.0f} {stage['unit']}/s"
+            f" {stage['peak_rss_bytes'] / 2**20:8.1f} MiB peak RSS"
+        )
+        if name in baseline:
+            line += f"  ({baseline[name]['seconds'] / stage['seconds']:.2f}x vs baseline)"
+        click.echo(line)
+
+
+@click.command()
+@click.option("--peaks", default=1000, show_default=True, help="Total peaks across all chapters")
+@click.option("--chapters", default=17, show_default=True)
+@click.option("--seed", default=0, show_default=True)
+@click.option("--output", type=click.Path(), help="Save results to this JSON file")
+@click.option("--compare", type=click.Path(exists=True), help="Compare with a saved result")
+def main(peaks, chapters, seed, output, compare):
+    with tempfile.TemporaryDirectory() as workdir:
+        files = write_corpus(os.path.join(workdir, "corpus"), peaks, chapters, seed)
+        stages = run(files, workdir)
+
+    results = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "peaks": peaks,
+        "chapters": chapters,
+        "seed": seed,
+        "stages": stages,
+    }
+    baseline = {}
+    if compare:
+        with open(compare) as f:
+            baseline = json.load(f)["stages"]
+    report(stages, baseline)
+
+    if output:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
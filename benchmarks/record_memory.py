@@ -0,0 +1,47 @@
+"""
+Measure the memory held by parsed records on a synthetic corpus.
+
+    python -m benchmarks.record_memory --peaks 20000
+
+Chapters are parsed with tracemalloc running, the soups are dropped, and
+what is still allocated is divided by the number of records (regions, peaks,
+routes and passes) kept alive.
+"""
+import gc
+import os
+import tempfile
+import tracemalloc
+
+import click  # type: ignore
+
+from climbers_guide_parser import parser
+
+from .synthetic import write_corpus
+
+
+@click.command()
+@click.option("--peaks", default=20000, show_default=True, help="Total peaks across all chapters")
+@click.option("--chapters", default=17, show_default=True)
+def main(peaks, chapters):
+    with tempfile.TemporaryDirectory() as workdir:
+        files = write_corpus(os.path.join(workdir, "corpus"), peaks, chapters)
+        parser.INPUT_FILES = files
+
+        gc.collect()
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        all_peaks, passes, regions = parser.do_peaks_passes_regions(use_cache=False)
+        gc.collect()
+        held = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+
+    routes = sum(len(p.routes) for p in all_peaks)
+    records = len(regions) + len(all_peaks) + routes + len(passes)
+    click.echo(
+        f"{len(regions)} regions, {len(all_peaks)} peaks, {routes} routes, {len(passes)} passes"
+    )
+    click.echo(f"{held / 2**20:.1f} MiB held, {held / records:.0f} bytes per record")
+
+
+if __name__ == "__main__":
+    main()
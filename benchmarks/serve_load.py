@@ -0,0 +1,209 @@
+"""
+Load test the HTTP service.
+
+    python -m benchmarks.serve_load --peaks 5000 --concurrency 8
+    python -m benchmarks.serve_load --url http://127.0.0.1:8000 --conditional
+
+Without --url, a database is built from a synthetic corpus and served from a
+separate process. Clients on keep-alive connections request a mix of list,
+page and detail URLs, and the requests per second and latency percentiles
+are reported. With --conditional, each client revalidates with the ETag it
+was last given for a URL, as a caching client would, so repeats are 304s.
+"""
+import http.client
+import json
+import multiprocessing
+import os
+import random
+import socket
+import tempfile
+import threading
+import time
+from collections import Counter
+from urllib.parse import quote, urlsplit
+
+import click  # type: ignore
+from sqlalchemy import create_engine  # type: ignore
+
+from climbers_guide_parser import parser
+from climbers_guide_parser.database import Base, set_sqlite_pragmas  # type: ignore
+from climbers_guide_parser.server import make_server
+from climbers_guide_parser.sync import SqliteSync
+
+from .synthetic import write_corpus
+
+
+def build_database(workdir: str, peaks: int, chapters: int) -> str:
+    """Parse a synthetic corpus into a database and return its path."""
+    files = write_corpus(os.path.join(workdir, "corpus"), peaks, chapters)
+    db = os.path.join(workdir, "serve.sqlite")
+    engine = create_engine(f"sqlite:///{db}")
+    set_sqlite_pragmas(engine, parser.SQLITE_PRAGMAS)
+    Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        sync = SqliteSync(connection, parser.SQLITE_BATCH_SIZE)
+        for file in files:
+            _, _, region = parser.parse_chapter(file)
+            sync.sync_region(region)
+        sync.delete_stale()
+    engine.dispose()
+
+    return db
+
+
+def run_server(db: str, port: int, pool_size: int):
+    server = make_server(db, port=port, pool_size=pool_size)
+    server.serve_forever()
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for(host: str, port: int, timeout: float = 10.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def get_json(host: str, port: int, path: str):
+    connection = http.client.HTTPConnection(host, port)
+    connection.request("GET", path)
+    data = json.loads(connection.getresponse().read())
+    connection.close()
+    return data
+
+
+def sample_paths(host: str, port: int, n: int) -> list[str]:
+    """Return n request paths, mixing lists, pages and single records."""
+    regions = get_json(host, port, "/regions")
+    peaks = get_json(host, port, "/peaks?limit=1000")["items"]
+    passes = get_json(host, port, "/passes?limit=1000")["items"]
+    routes = [route for peak in peaks for route in peak["routes"]]
+
+    rng = random.Random(0)
+    choices = [
+        lambda: "/regions",
+        lambda: f"/regions/{quote(rng.choice(regions)['slug'])}/peaks?limit=20",
+        lambda: f"/peaks?offset={rng.randrange(0, len(peaks), 20)}&limit=20",
+        lambda: f"/peaks/{quote(rng.choice(peaks)['slug'])}",
+        lambda: f"/peaks/{quote(rng.choice(peaks)['slug'])}/routes",
+        lambda: f"/routes/{quote(rng.choice(routes)['slug'])}",
+        lambda: f"/passes/{quote(rng.choice(passes)['slug'])}",
+    ]
+    return [rng.choice(choices)() for _ in range(n)]
+
+
+def client(host, port, paths, conditional, latencies, statuses, lock):
+    connection = http.client.HTTPConnection(host, port)
+    etags: dict = {}
+    mine = []
+    counts: Counter = Counter()
+    for path in paths:
+        headers = {"If-None-Match": etags[path]} if conditional and path in etags else {}
+        start = time.perf_counter()
+        connection.request("GET", path, headers=headers)
+        response = connection.getresponse()
+        response.read()
+        mine.append(time.perf_counter() - start)
+        counts[response.status] += 1
+        etag = response.getheader("ETag")
+        if etag:
+            etags[path] = etag
+    connection.close()
+    with lock:
+        latencies.extend(mine)
+        statuses.update(counts)
+
+
+def load(host: str, port: int, requests: int, concurrency: int, conditional: bool) -> dict:
+    # Draw from a pool smaller than the request count, so URLs repeat.
+    pool = sample_paths(host, port, max(requests // 4, 1))
+    rng = random.Random(1)
+    paths = [rng.choice(pool) for _ in range(requests)]
+    latencies: list[float] = []
+    statuses: Counter = Counter()
+    lock = threading.Lock()
+    threads = [
+        threading.Thread(
+            target=client,
+            args=(host, port, paths[i::concurrency], conditional, latencies, statuses, lock),
+        )
+        for i in range(concurrency)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - start
+
+    latencies.sort()
+
+    def percentile(p: float) -> float:
+        return latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))] * 1000
+
+    return dict(
+        requests=len(latencies),
+        seconds=seconds,
+        requests_per_second=len(latencies) / seconds,
+        p50_ms=percentile(50),
+        p90_ms=percentile(90),
+        p99_ms=percentile(99),
+        max_ms=latencies[-1] * 1000,
+        statuses=dict(sorted(statuses.items())),
+    )
+
+
+@click.command()
+@click.option("--url", help="Load an already running server instead of starting one")
+@click.option("--peaks", default=2000, show_default=True, help="Peaks in the synthetic corpus")
+@click.option("--chapters", default=17, show_default=True)
+@click.option("--requests", default=5000, show_default=True)
+@click.option("--concurrency", default=8, show_default=True)
+@click.option("--pool-size", default=8, show_default=True, help="Server's pooled connections")
+@click.option("--conditional", is_flag=True, help="Revalidate with If-None-Match")
+@click.option("--output", type=click.Path(), help="Save results to this JSON file")
+def main(url, peaks, chapters, requests, concurrency, pool_size, conditional, output):
+    with tempfile.TemporaryDirectory() as workdir:
+        process = None
+        if url:
+            parts = urlsplit(url)
+            host, port = parts.hostname, parts.port or 80
+        else:
+            db = build_database(workdir, peaks, chapters)
+            host, port = "127.0.0.1", free_port()
+            process = multiprocessing.Process(
+                target=run_server, args=(db, port, pool_size), daemon=True
+            )
+            process.start()
+        try:
+            wait_for(host, port)
+            results = load(host, port, requests, concurrency, conditional)
+        finally:
+            if process is not None:
+                process.terminate()
+                process.join()
+
+    click.echo(
+        f"{results['requests']} requests in {results['seconds']:.2f}s:"
+        f" {results['requests_per_second']:.0f} req/s,"
+        f" p50 {results['p50_ms']:.2f} ms, p90 {results['p90_ms']:.2f} ms,"
+        f" p99 {results['p99_ms']:.2f} ms, max {results['max_ms']:.2f} ms"
+    )
+    click.echo(f"statuses: {results['statuses']}")
+    if output:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
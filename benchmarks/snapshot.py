@@ -0,0 +1,61 @@
+"""
+Measure snapshot open time and lookup latency as the corpus grows.
+
+    python -m benchmarks.snapshot --peaks 1000 --peaks 20000
+
+For each size a synthetic corpus is parsed and written to a snapshot, then
+the snapshot is opened repeatedly and random slugs are looked up. Open time
+should stay flat as the corpus grows; lookups grow with log n.
+"""
+import os
+import random
+import tempfile
+import time
+
+import click  # type: ignore
+
+from climbers_guide_parser import parser
+from climbers_guide_parser.snapshot import Snapshot, write_snapshot
+
+from .synthetic import write_corpus
+
+
+def best_of(n: int, f) -> float:
+    best = float("inf")
+    for _ in range(n):
+        start = time.perf_counter()
+        f()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+@click.command()
+@click.option("--peaks", multiple=True, type=int, default=[1000, 20000], show_default=True)
+@click.option("--chapters", default=17, show_default=True)
+@click.option("--lookups", default=20000, show_default=True)
+def main(peaks, chapters, lookups):
+    for n_peaks in peaks:
+        with tempfile.TemporaryDirectory() as workdir:
+            files = write_corpus(os.path.join(workdir, "corpus"), n_peaks, chapters)
+            path = os.path.join(workdir, "guide.snapshot")
+            regions = (parser.parse_chapter(f)[2] for f in files)
+            count = write_snapshot(regions, path)
+
+            open_seconds = best_of(50, lambda: Snapshot(path).close())
+            with Snapshot(path) as snapshot:
+                slugs = list(snapshot.slugs())
+                sample = random.Random(0).choices(slugs, k=lookups)
+                start = time.perf_counter()
+                for slug in sample:
+                    snapshot.get(slug)
+                lookup_seconds = (time.perf_counter() - start) / lookups
+
+            size = os.path.getsize(path)
+        click.echo(
+            f"{count:>7} records, {size / 2**20:6.1f} MiB: open {open_seconds * 1e6:6.1f} µs,"
+            f" get {lookup_seconds * 1e6:6.1f} µs"
+        )
+
+
+if __name__ == "__main__":
+    main()
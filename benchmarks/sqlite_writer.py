@@ -0,0 +1,153 @@
+"""
+Compare the bulk SQLite writer with the old per-object ORM path.
+
+    python -m benchmarks.sqlite_writer --peaks 20000
+
+Both write the same synthetic regions into a fresh database file.
+"""
+import os
+import tempfile
+import time
+from datetime import datetime
+
+import click  # type: ignore
+from sqlalchemy import create_engine  # type: ignore
+from sqlalchemy.orm import sessionmaker  # type: ignore
+
+from climbers_guide_parser.database import Base, set_sqlite_pragmas  # type: ignore
+from climbers_guide_parser.models import (  # type: ignore
+    PassModel,
+    PeakModel,
+    RegionModel,
+    RouteModel,
+)
+from climbers_guide_parser.parser import (
+    SQLITE_BATCH_SIZE,
+    SQLITE_PRAGMAS,
+    Pass,
+    Peak,
+    Region,
+    Route,
+    stable_id,
+)
+from climbers_guide_parser.sync import SqliteSync
+
+
+def make_regions(n_regions: int, n_peaks: int) -> list[Region]:
+    """Build regions holding n_peaks peaks in total, each with two routes and a pass."""
+    now = datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ")
+    regions = []
+    for r in range(n_regions):
+        name = f"Region {r}"
+        region = Region(now, now, stable_id(set(), name), name, slug=f"region-{r}")
+        for i in range(n_peaks // n_regions):
+            peak = Peak(now, now, stable_id(region.issued_ids, name, "peaks", str(i)), f"Peak {i}")
+            peak.elevations = [f"13,{i % 1000:03d}"]
+            peak.description = "First ascent 1921 by someone. " * 4
+            for n in (1, 2):
+                route = Route(now, now, stable_id(set(), peak.peak_id, str(n)))
+                route.name = f"Route {n}. West slope"
+                route.class_rating = f"Class {n + 1}"
+                route.description = "Climb the slope to the summit. " * 4
+                peak.routes.append(route)
+            region.peaks.append(peak)
+            region.passes.append(
+                Pass(now, now, stable_id(region.issued_ids, name, "passes", str(i)), f"Pass {i}")
+            )
+        regions.append(region)
+
+    return regions
+
+
+def write_orm(engine, regions: list[Region]):
+    """The original output_sqlite() path: an ORM object and session.add() per record."""
+    session = sessionmaker(bind=engine)()
+    for region in regions:
+        r = RegionModel(
+            name=region.name,
+            slug=region.slug,
+            region_id=region.region_id,
+            created=datetime.now(),
+            last_modified=datetime.now(),
+        )
+        for peak in region.peaks:
+            p = PeakModel(
+                created=datetime.now(),
+                last_modified=datetime.now(),
+                peak_id=peak.peak_id,
+                name=peak.name,
+                aka=peak.aka,
+                elevations=peak.elevations,
+                description=peak.description,
+                location_description=peak.location_description,
+                gps_coordinates=peak.gps_coordinates,
+                utm_coordinates=peak.utm_coordinates,
+                slug=peak.slug,
+            )
+            r.peaks.append(p)
+            for route in peak.routes:
+                p.routes.append(
+                    RouteModel(
+                        name=route.name,
+                        aka=route.aka,
+                        class_rating=route.class_rating,
+                        description=route.description,
+                        route_id=route.route_id,
+                    )
+                )
+            session.add(p)
+        for mountain_pass in region.passes:
+            p = PassModel(
+                created=datetime.now(),
+                last_modified=datetime.now(),
+                pass_id=mountain_pass.pass_id,
+                class_rating=mountain_pass.class_rating,
+                description=mountain_pass.description,
+                name=mountain_pass.name,
+                slug=mountain_pass.slug,
+            )
+            r.passes.append(p)
+            session.add(p)
+        session.add(r)
+    session.commit()
+
+
+def write_bulk(engine, regions: list[Region], batch_size: int):
+    """The bulk Core writer used by output_sqlite()."""
+    with engine.begin() as connection:
+        sync = SqliteSync(connection, batch_size)
+        for region in regions:
+            sync.sync_region(region)
+        sync.delete_stale()
+
+
+def timed(label: str, rows: int, write, pragmas: bool):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        engine = create_engine(f"sqlite:///{os.path.join(tmpdir, 'bench.sqlite')}")
+        if pragmas:
+            set_sqlite_pragmas(engine, SQLITE_PRAGMAS)
+        Base.metadata.create_all(engine)
+        start = time.perf_counter()
+        write(engine)
+        seconds = time.perf_counter() - start
+        engine.dispose()
+    click.echo(f"{label:>8}: {seconds:7.3f}s  {rows / seconds:10.0f} rows/s")
+
+    return seconds
+
+
+@click.command()
+@click.option("--regions", default=17, show_default=True)
+@click.option("--peaks", default=20000, show_default=True, help="Total peaks across all regions")
+@click.option("--batch-size", default=SQLITE_BATCH_SIZE, show_default=True)
+def main(regions, peaks, batch_size):
+    data = make_regions(regions, peaks)
+    rows = sum(1 + len(r.peaks) + len(r.passes) + sum(len(p.routes) for p in r.peaks) for r in data)
+    click.echo(f"{rows} rows")
+    orm = timed("orm", rows, lambda e: write_orm(e, data), pragmas=False)
+    bulk = timed("bulk", rows, lambda e: write_bulk(e, data, batch_size), pragmas=True)
+    click.echo(f"speedup: {orm / bulk:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
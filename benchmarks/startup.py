@@ -0,0 +1,76 @@
+"""
+Track import time for the common entry points.
+
+    python -m benchmarks.startup --runs 5 --output startup.json
+
+Each entry point is run in a fresh interpreter under python -X importtime.
+The report gives the best total import time over the runs, the modules
+that cost the most themselves, and which heavy optional dependencies were
+imported, which should be none but the backend's own.
+"""
+import json
+import re
+import subprocess
+import sys
+
+import click  # type: ignore
+
+ENTRY_POINTS = {
+    "package": "import climbers_guide_parser",
+    "cli": "from climbers_guide_parser.parser import main",
+    "json": "from climbers_guide_parser.backends import load_backend; load_backend('json')",
+    "sqlite": "from climbers_guide_parser.backends import load_backend; load_backend('sqlite')",
+    "store": "from climbers_guide_parser import GuideStore",
+}
+HEAVY = ("sqlalchemy", "pyarrow", "numpy")
+
+LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)")
+
+
+def import_times(statement: str) -> tuple[int, list[tuple[int, str]]]:
+    """Return the total import time in µs, and each module's own time."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    total = 0
+    modules = []
+    for line in result.stderr.splitlines():
+        match = LINE.match(line)
+        if not match:
+            continue
+        own, cumulative, indent, module = match.groups()
+        modules.append((int(own), module))
+        if not indent:
+            total += int(cumulative)
+    return total, modules
+
+
+@click.command()
+@click.option("--runs", default=5, show_default=True, help="Take the best of this many runs")
+@click.option("--top", default=5, show_default=True, help="Show this many costliest modules")
+@click.option("--output", type=click.Path(), help="Save results to this JSON file")
+def main(runs, top, output):
+    results = {}
+    for name, statement in ENTRY_POINTS.items():
+        best, modules = min(import_times(statement) for _ in range(runs))
+        names = {module for _, module in modules}
+        heavy = sorted(h for h in HEAVY if h in names)
+        costliest = sorted(modules, reverse=True)[:top]
+        results[name] = dict(
+            statement=statement,
+            import_ms=best / 1000,
+            heavy=heavy,
+            costliest={module: own / 1000 for own, module in costliest},
+        )
+        click.echo(f"{name:>8}: {best / 1000:6.1f} ms  heavy: {', '.join(heavy) or '-'}")
+        click.echo("          " + ", ".join(f"{m} {own / 1000:.1f}" for own, m in costliest))
+    if output:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
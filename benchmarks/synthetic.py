@@ -0,0 +1,182 @@
+"""
+Generate synthetic chapters shaped like those of A Climber's Guide to the High
+Sierra, for benchmarks and tests that can't rely on the real book.
+
+    python -m benchmarks.synthetic --peaks 1000 --chapters 17 /tmp/corpus
+
+Chapters are windows-1252 and follow the markup get_soup() and friends
+expect: a title <i> mentioning the Sierra, an <h3> region name, a "Passes"
+<h4> section of <p><i>Name (elevation).</i> Class N. ...</p> paragraphs, and
+peaks as <p><i>Name (elevations)</i></p> followed by description and route
+paragraphs, ending with <br clear="all">. Routes come in the three styles the
+parser handles: enumerated ("Route 1. West slope."), a bare "Class 3."
+paragraph, and yosemite_valley.html style named routes ("Kat Walk.").
+Output is deterministic for a given seed.
+"""
+import os
+import random
+
+import click  # type: ignore
+
+REGIONS = [
+    "The Palisades",
+    "Kaweahs and Great Western Divide",
+    "Yosemite Valley",
+    "Cathedral Range",
+    "Mount Humphreys",
+    "Sawtooth Ridge",
+    "Kings-Kern Divide",
+    "Clark Range",
+]
+PREFIXES = ["Mount", "Peak", "Crag", "Tower", "Dome", "Needle", "Spire"]
+NAMES = ["Agassiz", "Sill", "Winchell", "Gayley", "Bolton Brown", "Clyde", "Norman", "Ritter"]
+ASPECTS = ["North", "South", "East", "West", "Northeast", "Northwest", "Southeast", "Southwest"]
+FEATURES = ["slope", "face", "ridge", "arête", "chute", "couloir", "chimney"]
+PARTIES = [
+    "Norman Clyde",
+    "F. P. Farquhar and A. F. Hall",
+    "David R. Brower, Hervey Voge, and Norman Clyde",
+    "Jules Eichorn and Glen Dawson",
+]
+SENTENCES = [
+    'From the <a href="#lake">lake</a> ascend the talus to the base of the {feature}.',
+    "Climb the {feature} to the summit; the rock is sound.",
+    "Traverse to the {aspect} side of the notch and follow the ledges.",
+    "This is the easiest route on the peak — a pleasant scramble.",
+    "Several variations are possible on the upper\npart of the {feature}.",
+]
+
+
+def elevation(rng: random.Random) -> int:
+    return rng.randrange(9000, 14500)
+
+
+def feet(value: int) -> str:
+    return f"{value:,}"
+
+
+def elevations(rng: random.Random, location: bool) -> str:
+    """Return a parenthesized elevation list in one of the book's forms."""
+    e = elevation(rng)
+    parts = [feet(e)]
+    style = rng.random()
+    if style < 0.3:
+        parts.append(f"{feet(e + rng.randrange(1, 40))}n")
+    elif style < 0.5:
+        parts = [f"{feet(e)}+"]
+    elif style < 0.6:
+        parts = [f"{feet(e)}n"]
+    if location:
+        parts.append(
+            f"{rng.choice(['0.5', '1', '1.5', '2'])} {rng.choice('NESW')} of Mount"
+            f" {rng.choice(NAMES)}"
+        )
+    return "(" + "; ".join(parts) + ")"
+
+
+def description(rng: random.Random) -> str:
+    sentences = rng.sample(SENTENCES, rng.randrange(1, 4))
+    return " ".join(
+        s.format(feature=rng.choice(FEATURES), aspect=rng.choice(ASPECTS).lower())
+        for s in sentences
+    )
+
+
+def first_ascent(rng: random.Random) -> str:
+    return (
+        f"First ascent July {rng.randrange(1, 31)}, {rng.randrange(1864, 1953)}, by"
+        f" {rng.choice(PARTIES)}."
+    )
+
+
+def make_peak(rng: random.Random, index: int) -> list[str]:
+    """Return the paragraphs for one peak and its routes."""
+    location = rng.random() < 0.1
+    if location:
+        name = f"Peak {feet(elevation(rng))}"
+    else:
+        name = f"{rng.choice(PREFIXES)} {rng.choice(NAMES)} {index}"
+    paragraphs = [f"<p><i>{name} {elevations(rng, location)}</i></p>"]
+
+    style = rng.random()
+    if style < 0.2:
+        # A single default route.
+        paragraphs.append(
+            f"<p>\nClass {rng.randrange(1, 5)}. {first_ascent(rng)} {description(rng)}\n</p>"
+        )
+        return paragraphs
+
+    paragraphs.append(f"<p>\n{first_ascent(rng)}\n</p>")
+    for n in range(1, rng.randrange(2, 6)):
+        if style < 0.35:
+            # yosemite_valley.html style, named without a "Route N." prefix.
+            route_name = f"{rng.choice(ASPECTS)} {rng.choice(FEATURES)}."
+        else:
+            route_name = f"Route {n}. {rng.choice(ASPECTS)} {rng.choice(FEATURES)}."
+        paragraphs.append(
+            f"<p>\n<i>{route_name}</i> Class {rng.randrange(1, 6)}. {description(rng)}\n</p>"
+        )
+    return paragraphs
+
+
+def make_pass(rng: random.Random, index: int) -> str:
+    name = f"{rng.choice(NAMES)} Pass {index}"
+    return (
+        f"<p>\n<i>{name} {elevations(rng, False)}.</i> Class {rng.randrange(1, 4)}. "
+        f"{description(rng)}\n</p>"
+    )
+
+
+def make_chapter(region: str, n_peaks: int, n_passes: int, seed: int = 0) -> str:
+    """Return the HTML for one chapter with the given number of peaks and passes."""
+    rng = random.Random(seed)
+    lines = [
+        "<html>\n<head><title>A Climber's Guide to the High Sierra</title></head>\n<body>",
+        '<p><a href="index.html">Contents</a></p>',
+        "<div><i>A Climber's Guide to the High Sierra</i> (1954)</div>",
+        f"<h3>{region}</h3>",
+        f"<p>\nThe {region} offer some of the finest climbing in the range.\n</p>",
+    ]
+    if n_passes:
+        lines.append("<h4>Passes</h4>")
+        lines.extend(make_pass(rng, i) for i in range(n_passes))
+        lines.append("<p>\n<i>References.</i> SCB, 1930, 12.\n</p>")
+    lines.append("<h4>Peaks</h4>")
+    for i in range(n_peaks):
+        lines.extend(make_peak(rng, i))
+    lines.append("<p><i>References.</i></p>")
+    lines.append("<p>\nSCB, 1922, 264.\n</p>")
+    lines.append('<br clear="all">\n</body>\n</html>\n')
+    return "\n".join(lines)
+
+
+def write_corpus(directory: str, n_peaks: int, n_chapters: int = 17, seed: int = 0) -> list[str]:
+    """
+    Write n_chapters chapters holding n_peaks peaks between them, plus about
+    one pass per ten peaks, and return their paths.
+    """
+    os.makedirs(directory, exist_ok=True)
+    files = []
+    for c in range(n_chapters):
+        peaks = n_peaks // n_chapters + (1 if c < n_peaks % n_chapters else 0)
+        region = f"{REGIONS[c % len(REGIONS)]} {c}"
+        path = os.path.join(directory, f"chapter_{c:03d}.html")
+        with open(path, "w", encoding="windows-1252") as f:
+            f.write(make_chapter(region, peaks, peaks // 10, seed=seed * 1000 + c))
+        files.append(path)
+
+    return files
+
+
+@click.command()
+@click.option("--peaks", default=1000, show_default=True, help="Total peaks across all chapters")
+@click.option("--chapters", default=17, show_default=True)
+@click.option("--seed", default=0, show_default=True)
+@click.argument("directory")
+def main(peaks, chapters, seed, directory):
+    for path in write_corpus(directory, peaks, chapters, seed):
+        click.echo(path)
+
+
+if __name__ == "__main__":
+    main()
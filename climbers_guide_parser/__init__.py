@@ -1,3 +1,20 @@
 __version__ = "0.2.0"
 
-from .parser import get_passes, get_peaks, get_region, get_soup
+from .parser import (
+    get_passes,
+    get_peaks,
+    get_region,
+    get_soup,
+    iter_passes,
+    iter_peaks,
+    iter_regions,
+)
+
+
+def __getattr__(name):
+    # GuideStore needs SQLAlchemy, so it's only imported when first used.
+    if name == "GuideStore":
+        from .store import GuideStore
+
+        return GuideStore
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
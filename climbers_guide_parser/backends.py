@@ -0,0 +1,54 @@
+"""
+Output backends, by name.
+
+Each backend is registered as the module and function that write it, and
+the module is imported only when the backend is loaded. A JSON run, or
+importing the package to call get_soup(), never imports SQLAlchemy or
+pyarrow. To add an output, write its function in its own module and
+register() it here.
+"""
+import importlib
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+import click  # type: ignore
+
+
+@dataclass(frozen=True)
+class Backend:
+    name: str
+    # "module:function", with module relative to this package.
+    target: str
+    # The optional dependency it needs, if any, named in the error if it's missing.
+    requires: Optional[str] = None
+
+    def load(self) -> Callable:
+        module_name, function = self.target.split(":")
+        try:
+            module = importlib.import_module(module_name, __package__)
+        except ImportError as e:
+            if self.requires is None or e.name != self.requires:
+                raise
+            raise click.ClickException(
+                f"Writing {self.name} needs {self.requires}: pip install {self.requires}"
+            )
+        return getattr(module, function)
+
+
+BACKENDS: dict[str, Backend] = {}
+
+
+def register(name: str, target: str, requires: Optional[str] = None):
+    BACKENDS[name] = Backend(name, target, requires)
+
+
+def load_backend(name: str) -> Callable:
+    """Import the backend called name and return its output function."""
+    return BACKENDS[name].load()
+
+
+register("json", ".parser:output_json")
+register("sqlite", ".sqlite_output:output_sqlite")
+register("parquet", ".columnar:output_columnar", requires="pyarrow")
+register("arrow", ".columnar:output_columnar", requires="pyarrow")
+register("snapshot", ".snapshot:output_snapshot")
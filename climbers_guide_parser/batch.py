@@ -0,0 +1,136 @@
+"""
+Checkpointed batch runs, and quarantined records.
+
+An ordinary run stops at the first record that fails to parse, such as a
+route with no "." after its class rating. A --batch run instead
+quarantines it: it's left out of its chapter and kept on the region with
+where it came from, then reported, and the run carries on. Each chapter is
+checkpointed as soon as it's parsed, keyed on its contents and the parser
+like the parse cache, but never evicted, and a chapter that fails outright
+is reported and skipped. A rerun loads the checkpointed chapters rather
+than parsing them again, so a failure late in the book, or while writing
+the outputs, costs only the chapters that failed or were edited since. The
+checkpoint is removed once a run completes with nothing to report.
+"""
+import json
+import os
+import shutil
+import sys
+from dataclasses import asdict, dataclass
+from typing import Any, Optional
+
+from .cache import ChapterCache
+
+
+def describe_error(error: BaseException) -> str:
+    """The error's type and message, e.g. "IndexError: list index out of range"."""
+    return f"{type(error).__name__}: {error}"
+
+
+@dataclass
+class QuarantinedRecord:
+    """A record left out of its chapter because it failed to parse."""
+
+    kind: str  # "peak", "route" or "pass"
+    region: str
+    # The route's peak, or "" for a peak or pass.
+    peak: str
+    # The position of the record's <p> in the chapter, counting from 1.
+    paragraph: int
+    # The start of the paragraph's text.
+    text: str
+    error: str
+    file: str = ""
+
+    def describe(self) -> str:
+        where = f"{self.file}, paragraph {self.paragraph}"
+        if self.peak:
+            where += f" (in {self.peak})"
+        return f"{where}: {self.kind} failed with {self.error}: {self.text!r}"
+
+
+@dataclass
+class ChapterFailure:
+    """A chapter skipped by a batch run because it failed to parse at all."""
+
+    file: str
+    error: str
+
+
+class Checkpoint:
+    """
+    Chapters parsed by a batch run, stored as each is parsed. Each is keyed
+    on the file and the source its IDs are scoped by; see parse_chapter().
+    """
+
+    def __init__(self, directory: str, fingerprint: str):
+        self.entries = ChapterCache(directory, sys.maxsize, fingerprint)
+        self.keys: dict[tuple[str, str], Optional[str]] = {}
+
+    def key(self, file: str, source: str) -> Optional[str]:
+        """The entry key for file, or None if it can't be read."""
+        if (file, source) not in self.keys:
+            try:
+                self.keys[file, source] = self.entries.key(file, source)
+            except OSError:
+                self.keys[file, source] = None
+        return self.keys[file, source]
+
+    def has(self, file: str, source: str) -> bool:
+        key = self.key(file, source)
+        return key is not None and os.path.exists(self.entries.path(key))
+
+    def load(self, file: str, source: str) -> Optional[Any]:
+        """Return the checkpointed chapter, or None if there's none to load."""
+        key = self.key(file, source)
+        return None if key is None else self.entries.get(key)
+
+    def save(self, file: str, source: str, chapter: Any):
+        key = self.key(file, source)
+        if key is not None:
+            self.entries.put(key, chapter)
+
+    def clear(self):
+        shutil.rmtree(self.entries.directory, ignore_errors=True)
+
+
+class BatchRun:
+    """A --batch run's checkpoint, and the chapters and records that failed."""
+
+    def __init__(self, checkpoint: Checkpoint):
+        self.checkpoint = checkpoint
+        self.parsed = 0
+        self.resumed = 0
+        self.failed: list[ChapterFailure] = []
+        self.quarantined: list[QuarantinedRecord] = []
+
+    def completed(self, file: str, source: str, chapter: Any, resumed: bool = False):
+        """Record a parsed chapter, checkpointing it unless it was loaded from there."""
+        if resumed:
+            self.resumed += 1
+        else:
+            self.checkpoint.save(file, source, chapter)
+            self.parsed += 1
+        self.quarantined += chapter[2].quarantined or ()
+
+    def fail(self, file: str, error: BaseException):
+        self.failed.append(ChapterFailure(file, describe_error(error)))
+
+    @property
+    def clean(self) -> bool:
+        return not self.failed and not self.quarantined
+
+    def summary(self) -> str:
+        return (
+            f"{self.parsed} chapters parsed and {self.resumed} resumed from the checkpoint;"
+            f" {len(self.failed)} failed, and {len(self.quarantined)} records were quarantined"
+        )
+
+    def write_report(self, path: str):
+        """Write the failed chapters and quarantined records to path as JSON."""
+        report = dict(
+            failed_chapters=[asdict(failure) for failure in self.failed],
+            quarantined=[asdict(record) for record in self.quarantined],
+        )
+        with open(path, "w") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
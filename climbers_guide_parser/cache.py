@@ -0,0 +1,123 @@
+import hashlib
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+from .json_writer import atomic_write
+
+
+class ChapterCache:
+    """
+    On-disk cache of parsed chapters. Entries are pickled and keyed on the
+    SHA-256 of the chapter's bytes plus a fingerprint of the parser, so any
+    change to either misses. The cache is capped at max_bytes, evicting the
+    least recently used entries first; an entry's mtime is its last use.
+    """
+
+    SUFFIX = ".pickle"
+
+    def __init__(self, directory: str, max_bytes: int, fingerprint: str):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.fingerprint = fingerprint
+
+    def key(self, file: str, scope: str = "") -> str:
+        """
+        Return the cache key for a chapter file, parsed with scope, e.g. the
+        source its IDs are derived from.
+        """
+        digest = hashlib.sha256(self.fingerprint.encode())
+        digest.update(b"\0" + scope.encode() + b"\0")
+        with open(file, "rb") as chapter:
+            digest.update(chapter.read())
+        return digest.hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key + self.SUFFIX)
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Return the cached object for key, or None on a miss. An entry that
+        can't be loaded, e.g. as a class it refers to has since been renamed,
+        is a miss too, and is replaced when the chapter is stored again.
+        """
+        path = self.path(key)
+        try:
+            with open(path, "rb") as entry:
+                obj = pickle.load(entry)
+        except Exception:
+            return None
+
+        os.utime(path)  # Mark as recently used.
+        return obj
+
+    def put(self, key: str, obj: Any):
+        """
+        Store obj under key. The entry is written to a temporary file and
+        renamed into place so concurrent workers never see a partial entry.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        with atomic_write(self.path(key), "wb") as entry:
+            pickle.dump(obj, entry, protocol=pickle.HIGHEST_PROTOCOL)
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries until under max_bytes."""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(self.SUFFIX):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass  # Already evicted by another worker.
+            total -= size
+
+
+class LRUCache:
+    """
+    In-memory cache holding at most maxsize entries, dropping the least
+    recently used first. Counts hits and misses. Safe to share between
+    threads; load() runs outside the lock, so two threads missing on the
+    same key may both load it.
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self.entries: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get_or_load(self, key: Hashable, load: Callable[[], Any]) -> Any:
+        """Return the entry for key, calling load() to fill it on a miss."""
+        with self.lock:
+            if key in self.entries:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return self.entries[key]
+            self.misses += 1
+
+        value = load()
+        if self.maxsize > 0:
+            with self.lock:
+                self.entries[key] = value
+                self.entries.move_to_end(key)
+                if len(self.entries) > self.maxsize:
+                    self.entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self) -> int:
+        return len(self.entries)
@@ -0,0 +1,354 @@
+"""
+Columnar export of parsed chapters to Parquet or Arrow IPC files.
+
+Regions, peaks, routes and passes are written as four flat tables, joined by
+their stable IDs: peaks.region_id, routes.peak_id and passes.region_id. Rows
+are buffered straight from the parsed dataclasses and written in record
+batches, so a book of any size is never held as one table. The region name
+and class rating columns are dictionary-encoded.
+
+Needs pyarrow, which is optional: pip install pyarrow.
+"""
+import os
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Any, Iterable
+
+import click  # type: ignore
+import pyarrow as pa  # type: ignore
+import pyarrow.ipc as ipc  # type: ignore
+import pyarrow.parquet as pq  # type: ignore
+
+from . import parser
+from .hashing import BuildHashes
+from .json_writer import replace_file, temporary_file
+from .parser import COLUMNAR_BATCH_ROWS, TIMESTAMP_FORMAT, Peak, Region
+from .profiling import PROFILER
+
+FORMATS = {"parquet": ".parquet", "arrow": ".arrow"}
+
+STRINGS = pa.list_(pa.string())
+DICTIONARY = pa.dictionary(pa.int32(), pa.string())
+TIMESTAMP = pa.timestamp("ms", tz="UTC")  # Parquet has no seconds unit.
+
+TIMESTAMPS = [("created", TIMESTAMP), ("last_modified", TIMESTAMP)]
+ELEVATIONS = [
+    ("elevations", STRINGS),
+    ("elevation_feet", pa.int32()),
+    ("elevation_lower_bound", pa.bool_()),
+    ("elevation_map_derived", pa.bool_()),
+]
+
+SCHEMAS = {
+    "regions": pa.schema(
+        [
+            ("region_id", pa.string()),
+            ("name", pa.string()),
+            ("slug", pa.string()),
+            ("content_hash", pa.string()),
+        ]
+        + TIMESTAMPS
+    ),
+    "peaks": pa.schema(
+        [
+            ("peak_id", pa.string()),
+            ("region_id", pa.string()),
+            ("region", DICTIONARY),
+            ("name", pa.string()),
+            ("aka", STRINGS),
+        ]
+        + ELEVATIONS
+        + [
+            ("description", pa.string()),
+            ("location_description", pa.string()),
+            ("gps_coordinates", pa.string()),
+            ("utm_coordinates", pa.string()),
+            ("slug", pa.string()),
+            ("content_hash", pa.string()),
+        ]
+        + TIMESTAMPS
+    ),
+    "routes": pa.schema(
+        [
+            ("route_id", pa.string()),
+            ("peak_id", pa.string()),
+            ("region", DICTIONARY),
+            ("name", pa.string()),
+            ("aka", STRINGS),
+            ("class_rating", DICTIONARY),
+            ("class_grade", pa.int8()),
+            ("description", pa.string()),
+            ("slug", pa.string()),
+            ("content_hash", pa.string()),
+        ]
+        + TIMESTAMPS
+    ),
+    "passes": pa.schema(
+        [
+            ("pass_id", pa.string()),
+            ("region_id", pa.string()),
+            ("region", DICTIONARY),
+            ("name", pa.string()),
+            ("aka", STRINGS),
+            ("class_rating", DICTIONARY),
+            ("class_grade", pa.int8()),
+        ]
+        + ELEVATIONS
+        + [
+            ("description", pa.string()),
+            ("location_description", pa.string()),
+            ("slug", pa.string()),
+            ("content_hash", pa.string()),
+        ]
+        + TIMESTAMPS
+    ),
+}
+
+
+@lru_cache(maxsize=64)
+def to_datetime(timestamp: str) -> datetime:
+    """Parse a record timestamp. Every record in a run shares a few, so this is cached."""
+    return datetime.strptime(timestamp, TIMESTAMP_FORMAT).replace(tzinfo=timezone.utc)
+
+
+class DictionaryColumn:
+    """
+    Buffers a dictionary-encoded column. The dictionary only ever grows, so
+    each batch's dictionary extends the last one's, which an Arrow IPC file
+    can record as a delta.
+    """
+
+    def __init__(self):
+        self.index: dict[str, int] = {}
+        self.values: list[str] = []
+        self.indices: list[int] = []
+
+    def append(self, value: str):
+        i = self.index.get(value)
+        if i is None:
+            i = self.index[value] = len(self.values)
+            self.values.append(value)
+        self.indices.append(i)
+
+    def to_array(self) -> pa.Array:
+        array = pa.DictionaryArray.from_arrays(
+            pa.array(self.indices, pa.int32()), pa.array(self.values, pa.string())
+        )
+        self.indices = []
+        return array
+
+
+class TableWriter:
+    """
+    Write rows of one table to path in record batches of batch_rows. As with
+    the JSON writers, output goes to a temporary file that replaces path only
+    when the writer closes cleanly.
+    """
+
+    def __init__(
+        self, path: str, schema: pa.Schema, fmt: str, batch_rows: int = COLUMNAR_BATCH_ROWS
+    ):
+        self.path = path
+        self.schema = schema
+        self.batch_rows = batch_rows
+        self.count = 0
+        self.columns: dict[str, Any] = {
+            f.name: DictionaryColumn() if f.type == DICTIONARY else [] for f in schema
+        }
+        self.pending = 0
+
+        fd, self.tmp_path = temporary_file(path)
+        os.close(fd)
+        if fmt == "parquet":
+            self.writer = pq.ParquetWriter(self.tmp_path, schema, compression="zstd")
+        else:
+            options = ipc.IpcWriteOptions(emit_dictionary_deltas=True)
+            self.writer = ipc.new_file(self.tmp_path, schema, options=options)
+
+    def append(self, row: dict):
+        for name, column in self.columns.items():
+            column.append(row[name])
+        self.pending += 1
+        self.count += 1
+        if self.pending >= self.batch_rows:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        arrays = []
+        for field in self.schema:
+            column = self.columns[field.name]
+            if isinstance(column, DictionaryColumn):
+                arrays.append(column.to_array())
+            else:
+                arrays.append(pa.array(column, field.type))
+                self.columns[field.name] = []
+        self.writer.write_batch(pa.record_batch(arrays, schema=self.schema))
+        self.pending = 0
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+        replace_file(self.tmp_path, self.path)
+
+    def abort(self):
+        self.writer.close()
+        os.remove(self.tmp_path)
+
+
+def timestamps(record) -> dict:
+    return dict(
+        created=to_datetime(record.created), last_modified=to_datetime(record.last_modified)
+    )
+
+
+def elevations(record) -> dict:
+    return dict(
+        elevations=record.elevations,
+        elevation_feet=record.elevation_feet,
+        elevation_lower_bound=record.elevation_lower_bound,
+        elevation_map_derived=record.elevation_map_derived,
+    )
+
+
+class ColumnarWriter:
+    """
+    Write regions, with their peaks, routes and passes, to
+    'output-[table].parquet' (or '.arrow') files in directory, with suffix
+    added to their names.
+    """
+
+    def __init__(
+        self,
+        directory: str = ".",
+        fmt: str = "parquet",
+        batch_rows: int = COLUMNAR_BATCH_ROWS,
+        suffix: str = "",
+    ):
+        self.tables: dict[str, TableWriter] = {}
+        try:
+            for table, schema in SCHEMAS.items():
+                path = os.path.join(directory, f"output-{table}{suffix}{FORMATS[fmt]}")
+                self.tables[table] = TableWriter(path, schema, fmt, batch_rows)
+        except BaseException:
+            self.abort()
+            raise
+
+    def write_region(self, region: Region):
+        region_id = region.region_id
+        self.tables["regions"].append(
+            dict(
+                region_id=region_id,
+                name=region.name,
+                slug=region.slug,
+                content_hash=region.content_hash,
+                **timestamps(region),
+            )
+        )
+        for peak in region.peaks:
+            self.write_peak(peak, region)
+        for mountain_pass in region.passes:
+            self.tables["passes"].append(
+                dict(
+                    pass_id=mountain_pass.pass_id,
+                    region_id=region_id,
+                    region=region.name,
+                    name=mountain_pass.name,
+                    aka=mountain_pass.aka,
+                    class_rating=mountain_pass.class_rating,
+                    class_grade=mountain_pass.class_grade,
+                    description=mountain_pass.description,
+                    location_description=mountain_pass.location_description,
+                    slug=mountain_pass.slug,
+                    content_hash=mountain_pass.content_hash,
+                    **elevations(mountain_pass),
+                    **timestamps(mountain_pass),
+                )
+            )
+
+    def write_peak(self, peak: Peak, region: Region):
+        self.tables["peaks"].append(
+            dict(
+                peak_id=peak.peak_id,
+                region_id=region.region_id,
+                region=region.name,
+                name=peak.name,
+                aka=peak.aka,
+                description=peak.description,
+                location_description=peak.location_description,
+                gps_coordinates=peak.gps_coordinates,
+                utm_coordinates=peak.utm_coordinates,
+                slug=peak.slug,
+                content_hash=peak.content_hash,
+                **elevations(peak),
+                **timestamps(peak),
+            )
+        )
+        for route in peak.routes:
+            self.tables["routes"].append(
+                dict(
+                    route_id=route.route_id,
+                    peak_id=peak.peak_id,
+                    region=region.name,
+                    name=route.name,
+                    aka=route.aka,
+                    class_rating=route.class_rating,
+                    class_grade=route.class_grade,
+                    description=route.description,
+                    slug=route.slug,
+                    content_hash=route.content_hash,
+                    **timestamps(route),
+                )
+            )
+
+    def counts(self) -> dict[str, int]:
+        return {table: writer.count for table, writer in self.tables.items()}
+
+    def close(self):
+        for writer in self.tables.values():
+            writer.close()
+
+    def abort(self):
+        for writer in self.tables.values():
+            writer.abort()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def write_columnar(
+    regions: Iterable[Region],
+    directory: str = ".",
+    fmt: str = "parquet",
+    batch_rows: int = COLUMNAR_BATCH_ROWS,
+) -> dict[str, int]:
+    """Write every region and return the row count of each table."""
+    with ColumnarWriter(directory, fmt, batch_rows) as writer:
+        for region in regions:
+            writer.write_region(region)
+    return writer.counts()
+
+
+def output_columnar(
+    workers: int = 1,
+    use_cache: bool = True,
+    fmt: str = "parquet",
+    engine: str = "tree",
+    dedupe: bool = False,
+):
+    """Parse and output regions, peaks, routes and passes as Parquet or Arrow tables."""
+    hashes, candidates = BuildHashes(), [] if dedupe else None
+    with ColumnarWriter(".", fmt, COLUMNAR_BATCH_ROWS, parser.OUTPUT_SUFFIX) as writer:
+        for region in parser.iter_regions(workers, use_cache, engine, dedupe, hashes, candidates):
+            with PROFILER.timer("columnar.write"):
+                writer.write_region(region)
+    parser.write_build_outputs(hashes, candidates)
+    counts = ", ".join(f"{n} {table}" for table, n in writer.counts().items())
+    click.echo(f"Wrote {counts} as {fmt} to the current directory.")
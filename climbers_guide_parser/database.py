@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, create_engine, DateTime # type:ignore
+from sqlalchemy import Column, Integer, String, ForeignKey, create_engine, DateTime, event, inspect # type:ignore
 from sqlalchemy.ext.declarative import declarative_base # type:ignore
 from sqlalchemy.orm import relationship, backref, sessionmaker, joinedload # type: ignore
 
@@ -28,4 +28,41 @@ class DB:
         return self.db_engine
 
 
+def set_sqlite_pragmas(engine, pragmas: dict):
+    """ Run the given PRAGMAs, e.g. {'journal_mode': 'WAL'}, on every new connection. """
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+
+def add_missing_columns(engine, metadata) -> list[str]:
+    """
+    Bring tables created by an older version up to date: add any column in
+    metadata that the table lacks, and create any missing index. create_all()
+    only creates whole tables. Returns the columns added, as "table.column".
+    """
+    added = []
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        for table in metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    connection.exec_driver_sql(
+                        f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"
+                    )
+                    added.append(f"{table.name}.{column.name}")
+            for index in table.indexes:
+                index.create(connection, checkfirst=True)
+
+    return added
+
+
 Base = declarative_base()
@@ -0,0 +1,251 @@
+"""
+Find the same peak or pass described in more than one chapter.
+
+Names are normalized (case, accents, punctuation, "Mt." for "Mount") and
+broken into character trigrams. Two records are candidates when the Jaccard
+similarity of their trigram sets is at least the threshold, their
+elevations are within tolerance feet of each other, and any numbers in their
+names match, since "Peak 12,135" and "Peak 12,150" are different peaks.
+
+Rather than compare every pair, candidates come from MinHash LSH: each
+name's trigrams get a MinHash signature, and names whose signatures agree
+on any one band share a bucket. Buckets are also split by elevation band,
+so a name is only compared with the few in its buckets at a nearby
+elevation, and the work grows about linearly with the number of names. The
+price is that a pair just above the threshold is missed now and then; see
+BANDS and ROWS.
+"""
+import random
+import re
+import unicodedata
+import zlib
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Iterable, List, Optional, Sequence
+
+# Jaccard similarity of trigram sets needed for a candidate.
+THRESHOLD = 0.6
+# Elevations further apart than this are taken to be different features.
+TOLERANCE_FEET = 150
+# MinHash LSH: records are candidates when all ROWS hashes of any one of
+# BANDS bands of their signatures agree. The chance of that is
+# 1 - (1 - J**ROWS)**BANDS for Jaccard similarity J: 0.999 at 0.7, 0.98 at
+# 0.6, 0.36 at 0.3.
+BANDS = 16
+ROWS = 3
+PRIME = (1 << 61) - 1
+
+ABBREVIATIONS = {"mt": "mount", "mtn": "mountain", "pk": "peak", "pt": "point"}
+NON_WORD = re.compile(r"[^\w\s]")
+NUMBER = re.compile(r"\d+")
+# Left out of the signatures, as so many unrelated names share them;
+# otherwise "Mount Stanford" and "Mount Morgan" would share buckets.
+GENERIC_WORDS = {
+    "mount",
+    "mountain",
+    "peak",
+    "pass",
+    "point",
+    "dome",
+    "tower",
+    "needle",
+    "spire",
+    "pinnacle",
+    "crag",
+    "col",
+    "notch",
+    "gap",
+    "saddle",
+    "ridge",
+    "lake",
+    "of",
+}
+
+
+@dataclass
+class MergeCandidate:
+    """Two records that look like the same feature."""
+
+    kind: str
+    # "duplicate" if the names are the same, "alias" if they differ.
+    match: str
+    similarity: float
+    elevation_delta: Optional[int]
+    id: str
+    name: str
+    region: str
+    other_id: str
+    other_name: str
+    other_region: str
+
+
+def normalize_name(name: str) -> str:
+    """Lower-case name, drop accents and punctuation, and expand abbreviations."""
+    text = unicodedata.normalize("NFKD", name)
+    text = "".join(c for c in text if not unicodedata.combining(c)).lower()
+    words = NON_WORD.sub(" ", text.replace(",", "")).split()
+    if words and words[0] == "the":
+        words = words[1:]
+    return " ".join(ABBREVIATIONS.get(w, w) for w in words)
+
+
+def trigrams(normalized: str) -> frozenset:
+    padded = f"  {normalized} "
+    return frozenset(padded[i : i + 3] for i in range(len(padded) - 2))
+
+
+def blocking_trigrams(normalized: str) -> frozenset:
+    """Trigrams of the distinctive words of a name, or all of it if it has none."""
+    words = [w for w in normalized.split() if w not in GENERIC_WORDS]
+    return trigrams(" ".join(words) if words else normalized)
+
+
+def jaccard(a: frozenset, b: frozenset) -> float:
+    shared = len(a & b)
+    return shared / (len(a) + len(b) - shared)
+
+
+def hash_functions(n: int, seed: int = 0) -> list[tuple[int, int]]:
+    rng = random.Random(seed)
+    return [(rng.randrange(1, PRIME), rng.randrange(PRIME)) for _ in range(n)]
+
+
+class MinHasher:
+    """
+    Computes MinHash signatures of trigram sets. Each distinct trigram is
+    hashed num_hashes ways once, so a signature is just the column minimums
+    of its trigrams' hashes. crc32 rather than hash() keeps the signatures
+    the same from one run to the next.
+    """
+
+    def __init__(self, num_hashes: int = BANDS * ROWS):
+        self.functions = hash_functions(num_hashes)
+        self.hashes: dict[str, tuple[int, ...]] = {}
+
+    def gram_hashes(self, gram: str) -> tuple[int, ...]:
+        h = self.hashes.get(gram)
+        if h is None:
+            x = zlib.crc32(gram.encode())
+            h = self.hashes[gram] = tuple((a * x + b) % PRIME for a, b in self.functions)
+        return h
+
+    def signature(self, grams: Iterable[str]) -> tuple[int, ...]:
+        return tuple(map(min, zip(*map(self.gram_hashes, grams))))
+
+
+def find_candidates(
+    records: Sequence,
+    kind: str = "peak",
+    threshold: float = THRESHOLD,
+    tolerance: int = TOLERANCE_FEET,
+    cross_region_only: bool = True,
+) -> List[MergeCandidate]:
+    """
+    Return the pairs of records (peaks or passes) whose names and elevations
+    suggest they are the same feature, most similar first. With
+    cross_region_only, pairs within one chapter are left out.
+    """
+    normalized = [normalize_name(r.name) for r in records]
+    grams = [trigrams(n) for n in normalized]
+    numbers = [NUMBER.findall(n) for n in normalized]
+
+    # Bucket each record by every band of its signature, within its
+    # elevation band. Elevations within tolerance are in the same or
+    # adjacent bands, so each record looks in its own band and the one
+    # below, and finds each pair in adjacent bands from the upper side
+    # only. A record with no elevation goes in band None, which every
+    # record looks in as well.
+    hasher = MinHasher()
+    elevation_bands = [
+        r.elevation_feet // tolerance if r.elevation_feet is not None else None for r in records
+    ]
+    unknown = None in elevation_bands
+    buckets: dict = defaultdict(list)
+    keys = []
+    for i, name in enumerate(normalized):
+        signature = hasher.signature(blocking_trigrams(name))
+        record_keys = [
+            hash((band, *signature[band * ROWS : (band + 1) * ROWS])) for band in range(BANDS)
+        ]
+        for key in record_keys:
+            buckets[key, elevation_bands[i]].append(i)
+        keys.append(record_keys)
+
+    candidates = []
+    for i, record_keys in enumerate(keys):
+        a = records[i]
+        e = elevation_bands[i]
+        probe = (None,) if e is None else (e - 1, e, None) if unknown else (e - 1, e)
+        seen = set()
+        for key in record_keys:
+            for elevation_band in probe:
+                same_band = elevation_band == e
+                for j in buckets.get((key, elevation_band), ()):
+                    if (same_band and j <= i) or j in seen:
+                        continue
+                    seen.add(j)
+                    b = records[j]
+                    if cross_region_only and a.region == b.region:
+                        continue
+                    delta = None
+                    if a.elevation_feet is not None and b.elevation_feet is not None:
+                        delta = abs(a.elevation_feet - b.elevation_feet)
+                        if delta > tolerance:
+                            continue
+                    if numbers[i] != numbers[j]:
+                        continue
+                    similarity = jaccard(grams[i], grams[j])
+                    if similarity < threshold:
+                        continue
+                    candidates.append(
+                        MergeCandidate(
+                            kind=kind,
+                            match="duplicate" if a.name == b.name else "alias",
+                            similarity=round(similarity, 3),
+                            elevation_delta=delta,
+                            id=getattr(a, f"{kind}_id"),
+                            name=a.name,
+                            region=a.region,
+                            other_id=getattr(b, f"{kind}_id"),
+                            other_name=b.name,
+                            other_region=b.region,
+                        )
+                    )
+
+    candidates.sort(key=lambda c: (-c.similarity, c.id, c.other_id))
+    return candidates
+
+
+def link_aliases(
+    records: Iterable, candidates: Iterable[MergeCandidate], kind: str = "peak"
+) -> int:
+    """
+    Add each alias candidate's other name to the aka of both records, and
+    return how many names were added. Duplicates already share a name.
+    """
+    by_id = {getattr(r, f"{kind}_id"): r for r in records}
+    added = 0
+    for c in candidates:
+        if c.match != "alias":
+            continue
+        for record_id, other_name in ((c.id, c.other_name), (c.other_id, c.name)):
+            record = by_id[record_id]
+            if other_name != record.name and other_name not in record.aka:
+                record.aka.append(other_name)
+                added += 1
+
+    return added
+
+
+def link_duplicates(peaks: Sequence, passes: Sequence, **options) -> List[MergeCandidate]:
+    """
+    Find duplicate and alias candidates among peaks and among passes, link
+    the aliases through aka, and return every candidate.
+    """
+    candidates = []
+    for kind, records in (("peak", peaks), ("pass", passes)):
+        found = find_candidates(records, kind, **options)
+        link_aliases(records, found, kind)
+        candidates += found
+
+    return candidates
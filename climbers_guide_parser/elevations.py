@@ -0,0 +1,93 @@
+from typing import Any, Iterable, List, Optional
+
+from sqlalchemy import select  # type: ignore
+
+from .models import PassModel, PeakModel  # type: ignore
+
+# Tables with numeric elevation columns, and the column holding each row's stable ID.
+ELEVATION_TABLES = {
+    "peak": (PeakModel.__table__, "peak_id"),
+    "pass": (PassModel.__table__, "pass_id"),
+}
+
+# Width of the bands elevation_stats() counts elevations in.
+BAND_FEET = 1000
+
+
+def in_elevation_range(
+    connection,
+    low: Optional[int] = None,
+    high: Optional[int] = None,
+    kind: str = "peak",
+    include_lower_bounds: bool = True,
+    limit: Optional[int] = None,
+) -> List[dict]:
+    """
+    Return the peaks (or passes, with kind="pass") whose elevation is between
+    low and high feet inclusive, lowest first, with their name, slug, stable
+    ID and elevation fields. The query is answered from the elevation_feet
+    index rather than by reading every row. A "13,900+" elevation is only a
+    lower bound; leave those out with include_lower_bounds=False.
+    """
+    table, key = ELEVATION_TABLES[kind]
+    feet = table.c.elevation_feet
+    statement = select(
+        table.c[key].label("key"),
+        table.c.name,
+        table.c.slug,
+        feet,
+        table.c.elevation_lower_bound,
+        table.c.elevation_map_derived,
+    ).where(feet.is_not(None))
+    if low is not None:
+        statement = statement.where(feet >= low)
+    if high is not None:
+        statement = statement.where(feet <= high)
+    if not include_lower_bounds:
+        statement = statement.where(table.c.elevation_lower_bound.is_not(True))
+    statement = statement.order_by(feet, table.c[key])
+    if limit is not None:
+        statement = statement.limit(limit)
+
+    return [dict(row) for row in connection.execute(statement).mappings()]
+
+
+def elevation_stats(records: Iterable[Any]) -> dict:
+    """
+    Summarize the numeric elevations of peaks or passes, parsed records or
+    rows alike, with NumPy: counts, range, mean, quartiles and the number in
+    each BAND_FEET band. Records without an elevation are counted as missing.
+    """
+    try:
+        import numpy as np  # type: ignore
+    except ImportError as e:
+        raise ImportError("elevation_stats() needs NumPy: pip install numpy") from e
+
+    rows = [
+        (r.elevation_feet, bool(r.elevation_lower_bound), bool(r.elevation_map_derived))
+        for r in records
+    ]
+    present = [row for row in rows if row[0] is not None]
+    data = np.array(
+        present, dtype=[("feet", np.int32), ("lower_bound", np.bool_), ("map_derived", np.bool_)]
+    )
+    feet = data["feet"]
+    stats: dict = dict(count=int(feet.size), missing=len(rows) - len(present))
+    if not feet.size:
+        return stats
+
+    q1, median, q3 = np.percentile(feet, [25, 50, 75])
+    bands, counts = np.unique(feet // BAND_FEET * BAND_FEET, return_counts=True)
+    stats.update(
+        min=int(feet.min()),
+        max=int(feet.max()),
+        mean=float(feet.mean()),
+        q1=float(q1),
+        median=float(median),
+        q3=float(q3),
+        lower_bound=int(data["lower_bound"].sum()),
+        map_derived=int(data["map_derived"].sum()),
+        bands={int(band): int(n) for band, n in zip(bands, counts)},
+    )
+
+    return stats
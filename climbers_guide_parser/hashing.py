@@ -0,0 +1,186 @@
+"""
+Content hashes of records, and diffs between builds.
+
+A record's content_hash covers its fields, leaving out the timestamps that
+change on every build, and the hashes of its children: a peak's covers its
+routes, a region's its peaks and passes. An unchanged subtree keeps its
+hash, and the book gets one hash rolled up from its regions'. Each build
+writes a manifest of every record's hash and name, and diff_manifests()
+compares two of them, descending only into the subtrees whose hashes
+differ, so its cost grows with the changes rather than the book.
+"""
+import hashlib
+import json
+from dataclasses import MISSING, dataclass, fields
+from functools import cache
+from typing import Any, Optional
+
+from .json_writer import atomic_write
+
+VERSION = 1
+
+# Left out of a record's hash: they change on every build.
+VOLATILE_FIELDS = frozenset(("created", "last_modified", "content_hash"))
+# Fields holding child records, which are covered by the children's hashes.
+CHILD_FIELDS = frozenset(("routes", "peaks", "passes"))
+
+# Each kind of manifest entry's children: their kind, and the entry's field.
+CHILDREN = {
+    "region": (("peak", "peaks"), ("pass", "passes")),
+    "peak": (("route", "routes"),),
+}
+
+
+@cache
+def hashed_fields(cls) -> tuple[tuple[str, Any], ...]:
+    """The name and default of each field of record class cls that is hashed."""
+    hashed = []
+    for f in fields(cls):
+        if f.name in VOLATILE_FIELDS or f.name in CHILD_FIELDS:
+            continue
+        if f.default is not MISSING:
+            default = f.default
+        elif f.default_factory is not MISSING:
+            default = f.default_factory()
+        else:
+            default = MISSING
+        hashed.append((f.name, default))
+    return tuple(hashed)
+
+
+def digest(text: str) -> str:
+    return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+
+def own_hash(record) -> str:
+    """
+    Hash a record's own fields. Fields at their default are left out, so
+    adding a field to a record type doesn't change every existing hash.
+    """
+    content = {}
+    for name, default in hashed_fields(type(record)):
+        value = getattr(record, name)
+        if value != default:
+            content[name] = value
+    return digest(json.dumps(content, sort_keys=True, ensure_ascii=False, default=str))
+
+
+def rollup(own: str, **children: dict) -> str:
+    """
+    Combine an own hash with the hashes of each group of children, given as
+    manifest entries by key. Children are taken in key order, so the hash
+    doesn't depend on the order they were parsed or merged in.
+    """
+    parts = [own]
+    for group, entries in sorted(children.items()):
+        parts.append(group + ":" + ",".join(f"{k}={entries[k]['hash']}" for k in sorted(entries)))
+    return digest("|".join(parts))
+
+
+def hash_region(region) -> dict:
+    """
+    Set content_hash on a region and all its peaks, routes and passes, and
+    return its manifest entry.
+    """
+    peaks = {}
+    for peak in region.peaks:
+        routes = {}
+        for route in peak.routes:
+            route.content_hash = own_hash(route)
+            routes[route.route_id] = dict(name=route.name, hash=route.content_hash)
+        own = own_hash(peak)
+        peak.content_hash = rollup(own, routes=routes)
+        peaks[peak.peak_id] = dict(name=peak.name, hash=peak.content_hash, own=own, routes=routes)
+
+    passes = {}
+    for mountain_pass in region.passes:
+        mountain_pass.content_hash = own_hash(mountain_pass)
+        passes[mountain_pass.pass_id] = dict(
+            name=mountain_pass.name, hash=mountain_pass.content_hash
+        )
+
+    own = own_hash(region)
+    region.content_hash = rollup(own, peaks=peaks, passes=passes)
+    return dict(name=region.name, hash=region.content_hash, own=own, peaks=peaks, passes=passes)
+
+
+class BuildHashes:
+    """The manifest entries of a build's regions, by region_id."""
+
+    def __init__(self, regions: Optional[dict] = None):
+        self.regions: dict = regions if regions is not None else {}
+
+    def add(self, region):
+        """Hash region, replacing any entry it had."""
+        self.regions[region.region_id] = hash_region(region)
+
+    def remove(self, region_id: str):
+        self.regions.pop(region_id, None)
+
+    def update(self, other: "BuildHashes"):
+        self.regions.update(other.regions)
+
+    @property
+    def book_hash(self) -> str:
+        return rollup("", regions=self.regions)
+
+    def to_dict(self) -> dict:
+        return dict(version=VERSION, hash=self.book_hash, regions=self.regions)
+
+    def write(self, path: str):
+        """Write the manifest to path, replacing it only once it's complete."""
+        with atomic_write(path) as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, separators=(",", ":"))
+
+    @classmethod
+    def read(cls, path: str) -> "BuildHashes":
+        """Read a manifest written by write(), raising ValueError if it isn't one."""
+        with open(path) as f:
+            manifest = json.load(f)
+        if not isinstance(manifest, dict) or manifest.get("version") != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} hash manifest")
+        return cls(manifest["regions"])
+
+
+@dataclass
+class Change:
+    """A record added, removed or changed between two builds."""
+
+    action: str  # "added", "removed" or "changed"
+    kind: str  # "region", "peak", "route" or "pass"
+    key: str
+    name: str
+    region: str
+
+
+def diff_entries(
+    changes: list[Change], kind: str, old: dict, new: dict, region: Optional[str] = None
+):
+    """
+    Add the changes between two sets of manifest entries of one kind to
+    changes. A record whose own fields changed is reported as changed, and
+    only subtrees whose hashes differ are compared further. An added or
+    removed record is reported alone, not with each of its children.
+    """
+    for key, entry in new.items():
+        before = old.get(key)
+        if before is None:
+            changes.append(Change("added", kind, key, entry["name"], region or entry["name"]))
+            continue
+        if before["hash"] == entry["hash"]:
+            continue
+        if before.get("own", before["hash"]) != entry.get("own", entry["hash"]):
+            changes.append(Change("changed", kind, key, entry["name"], region or entry["name"]))
+        for child_kind, group in CHILDREN.get(kind, ()):
+            diff_entries(changes, child_kind, before[group], entry[group], region or entry["name"])
+    for key in sorted(old.keys() - new.keys()):
+        name = old[key]["name"]
+        changes.append(Change("removed", kind, key, name, region or name))
+
+
+def diff_manifests(old: BuildHashes, new: BuildHashes) -> list[Change]:
+    """Return what was added, removed and changed from build old to new."""
+    changes: list[Change] = []
+    if old.book_hash != new.book_hash:
+        diff_entries(changes, "region", old.regions, new.regions)
+    return changes
@@ -0,0 +1,160 @@
+import gzip
+import json
+import os
+import tempfile
+import textwrap
+from contextlib import contextmanager
+from dataclasses import fields, is_dataclass
+from typing import IO, Iterator
+
+FLUSH_BYTES = 1024 * 1024
+
+
+def encode_default(obj):
+    """
+    JSONEncoder hook that turns a dataclass into a shallow dict of its fields,
+    leaving the encoder to recurse, and anything else into a string. This
+    avoids the deep copy asdict() makes of every record.
+    """
+    if is_dataclass(obj):
+        return {f.name: getattr(obj, f.name) for f in fields(obj)}
+    return str(obj)
+
+
+def temporary_file(path: str) -> tuple[int, str]:
+    """
+    Create a temporary file beside path, returning its descriptor and path,
+    for replace_file() to move over path once it's complete.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    return tempfile.mkstemp(dir=directory, prefix=".", suffix=".tmp")
+
+
+def replace_file(tmp_path: str, path: str):
+    """
+    Rename tmp_path over path, first giving it the permissions open() would
+    have, as mkstemp() creates the file private.
+    """
+    umask = os.umask(0)
+    os.umask(umask)
+    os.chmod(tmp_path, 0o666 & ~umask)
+    os.replace(tmp_path, path)
+
+
+@contextmanager
+def atomic_write(path: str, mode: str = "w") -> Iterator[IO]:
+    """
+    Open a temporary file beside path for writing, and move it over path
+    only if the block completes, so readers never see a partial file.
+    """
+    fd, tmp_path = temporary_file(path)
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+        replace_file(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+class RecordWriter:
+    """
+    Base for writers that stream records to a file. Output goes to a
+    temporary file beside path, in chunks of about flush_bytes, and is
+    renamed over path only when the writer closes cleanly, so readers never
+    see a partial file and a rerun replaces rather than appends. With
+    compress, the output is gzipped and '.gz' is added to path.
+    """
+
+    def __init__(self, path: str, compress: bool = False, flush_bytes: int = FLUSH_BYTES):
+        self.path = path + ".gz" if compress else path
+        self.flush_bytes = flush_bytes
+        self.count = 0
+        self.buffer: list[str] = []
+        self.buffered = 0
+
+        fd, self.tmp_path = temporary_file(self.path)
+        self.raw = os.fdopen(fd, "wb")
+        self.outfile = gzip.GzipFile(fileobj=self.raw, mode="wb") if compress else self.raw
+
+    def write_text(self, text: str):
+        self.buffer.append(text)
+        self.buffered += len(text)
+        if self.buffered >= self.flush_bytes:
+            self.flush()
+
+    def flush(self):
+        self.outfile.write("".join(self.buffer).encode())
+        self.buffer = []
+        self.buffered = 0
+
+    def close(self):
+        """Flush the remaining output and move the file into place."""
+        self.flush()
+        self.outfile.close()
+        self.raw.close()
+        replace_file(self.tmp_path, self.path)
+
+    def abort(self):
+        """Discard the output, leaving any existing file at path alone."""
+        self.outfile.close()
+        self.raw.close()
+        os.remove(self.tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class JsonArrayWriter(RecordWriter):
+    """
+    Write records to path as one indented JSON array, one record at a time,
+    so the whole list never has to be held in memory.
+    """
+
+    encoder = json.JSONEncoder(indent=4, default=encode_default, sort_keys=True)
+
+    @classmethod
+    def encode(cls, record) -> str:
+        return textwrap.indent(cls.encoder.encode(record), "    ")
+
+    def write(self, record):
+        """Append a dataclass record to the array."""
+        self.write_encoded(self.encode(record))
+
+    def write_encoded(self, text: str):
+        """Append a record already encoded by encode()."""
+        self.write_text("[\n" if self.count == 0 else ",\n")
+        self.write_text(text)
+        self.count += 1
+
+    def close(self):
+        self.write_text("\n]" if self.count else "[]")
+        super().close()
+
+
+class NdjsonWriter(RecordWriter):
+    """
+    Write records to path as newline-delimited JSON, one compact record per
+    line.
+    """
+
+    encoder = json.JSONEncoder(default=encode_default, sort_keys=True, separators=(",", ":"))
+
+    @classmethod
+    def encode(cls, record) -> str:
+        return cls.encoder.encode(record) + "\n"
+
+    def write(self, record):
+        """Append a dataclass record as one line."""
+        self.write_encoded(self.encode(record))
+
+    def write_encoded(self, text: str):
+        """Append a record already encoded by encode()."""
+        self.write_text(text)
+        self.count += 1
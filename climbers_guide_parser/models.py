@@ -1,5 +1,7 @@
 from .database import Base # type: ignore
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, JSON # type:ignore
+from sqlalchemy import ( # type:ignore
+    Boolean, Column, Index, Integer, String, ForeignKey, DateTime, JSON
+)
 from sqlalchemy.orm import relationship # type: ignore
 
 
@@ -7,19 +9,23 @@ class PeakModel(Base):
     __tablename__ = 'peaks'
     id = Column(Integer, primary_key=True)
     aka = Column(JSON)
+    content_hash = Column(String)
     created = Column(DateTime)
     description = Column(String)
     elevations = Column(JSON)
+    elevation_feet = Column(Integer, index=True)
+    elevation_lower_bound = Column(Boolean)
+    elevation_map_derived = Column(Boolean)
     gps_coordinates = Column(String)
     last_modified = Column(DateTime)
     location_description = Column(String)
-    name = Column(String)
-    peak_id = Column(String)
+    name = Column(String, index=True)
+    peak_id = Column(String, index=True)
     region_slug = Column(String)
-    slug = Column(String)
+    slug = Column(String, index=True)
     utm_coordinates = Column(String)
     routes = relationship("RouteModel", backref="peaks")
-    region_id = Column(Integer, ForeignKey('regions.id'))
+    region_id = Column(Integer, ForeignKey('regions.id'), index=True)
 
     def __repr__(self):
         return f"<Peak(name={self.name}, routes={self.routes})>"
@@ -30,12 +36,15 @@ class RouteModel(Base):
     id = Column(Integer, primary_key=True)
     aka = Column(JSON)
     class_rating = Column(String)
+    class_grade = Column(Integer, index=True)
+    content_hash = Column(String)
     created = Column(DateTime)
     description = Column(String)
     last_modified = Column(DateTime)
-    name = Column(String)
-    peak_id = Column(Integer, ForeignKey('peaks.id'))
-    route_id = Column(String)
+    name = Column(String, index=True)
+    peak_id = Column(Integer, ForeignKey('peaks.id'), index=True)
+    route_id = Column(String, index=True)
+    slug = Column(String, index=True)
 
     def __repr__(self):
         return f"<Route(name={self.name}, peak={self.peaks.name})>"
@@ -46,15 +55,20 @@ class PassModel(Base):
     id = Column(Integer, primary_key=True)
     aka = Column(JSON)
     class_rating = Column(String)
+    class_grade = Column(Integer, index=True)
+    content_hash = Column(String)
     created = Column(DateTime)
     description = Column(String)
     elevations = Column(JSON)
+    elevation_feet = Column(Integer, index=True)
+    elevation_lower_bound = Column(Boolean)
+    elevation_map_derived = Column(Boolean)
     last_modified = Column(DateTime)
-    name = Column(String)
-    pass_id = Column(String)
+    name = Column(String, index=True)
+    pass_id = Column(String, index=True)
     region_slug = Column(String)
-    slug = Column(String)
-    region_id = Column(Integer, ForeignKey('regions.id'))
+    slug = Column(String, index=True)
+    region_id = Column(Integer, ForeignKey('regions.id'), index=True)
 
     def __repr__(self):
         return f"<Pass(name={self.name})>"
@@ -63,13 +77,36 @@ class PassModel(Base):
 class RegionModel(Base):
     __tablename__ = 'regions'
     id = Column(Integer, primary_key=True)
+    content_hash = Column(String)
     created = Column(DateTime)
     last_modified = Column(DateTime)
-    name = Column(String)
-    region_id = Column(String)
-    slug = Column(String)
+    name = Column(String, index=True)
+    region_id = Column(String, index=True)
+    slug = Column(String, index=True)
     peaks = relationship("PeakModel", backref="region")
     passes = relationship("PassModel", backref="region")
 
     def __repr__(self):
         return f"<Region(name={self.name})>"
+
+
+class RegionStatModel(Base):
+    """
+    Aggregates over a region's peaks, routes and passes, rebuilt by
+    stats.refresh_region_stats() whenever they change. Each row is one stat:
+    a count (peaks, passes, routes, or routes with one class_grade), or a
+    peak's hardest or easiest rated route.
+    """
+    __tablename__ = 'region_stats'
+    id = Column(Integer, primary_key=True)
+    region_id = Column(Integer, ForeignKey('regions.id'))
+    stat = Column(String)
+    class_grade = Column(Integer)
+    count = Column(Integer)
+    peak_id = Column(Integer, ForeignKey('peaks.id'))
+    route_id = Column(Integer, ForeignKey('routes.id'))
+
+    __table_args__ = (Index('ix_region_stats_region_id_stat', 'region_id', 'stat'),)
+
+    def __repr__(self):
+        return f"<RegionStat(stat={self.stat}, class_grade={self.class_grade}, count={self.count})>"
@@ -1,18 +1,47 @@
+import cProfile
+import hashlib
 import json
+import os
 import re
-# import sys
+import sys
+import time
+import tracemalloc
 import uuid
-from datetime import datetime
+from contextlib import ExitStack, contextmanager
 from dataclasses import asdict, dataclass, field
-from typing import List
-
-from bs4 import BeautifulSoup, Tag # type: ignore
-from slugify import slugify # type: ignore
-import click # type: ignore
-from sqlalchemy.orm import sessionmaker # type: ignore
-
-from .database import Base, DB # type: ignore
-from .models import PeakModel, RouteModel, RegionModel, PassModel # type: ignore
+from datetime import datetime
+from functools import cache, partial
+from itertools import repeat
+from typing import Callable, Iterable, Iterator, List, Optional, Union
+
+import click  # type: ignore
+from bs4 import BeautifulSoup, Tag  # type: ignore
+from bs4 import __version__ as bs4_version  # type: ignore
+from slugify import slugify  # type: ignore
+
+from .backends import load_backend
+from .batch import BatchRun, Checkpoint, QuarantinedRecord, describe_error
+from .cache import ChapterCache
+from .dedupe import MergeCandidate, link_duplicates
+from .hashing import BuildHashes, diff_manifests
+from .json_writer import FLUSH_BYTES, JsonArrayWriter, NdjsonWriter, RecordWriter
+from .profiling import PROFILER, gc_tuning
+from .shards import (
+    chapter_source,
+    discover_inputs,
+    input_root,
+    merge_hashes,
+    merge_json,
+    parse_shard,
+    select_shard,
+    shard_paths,
+    shard_suffix,
+    with_suffix,
+)
+
+# SQLAlchemy, the models and the other output backends are imported only
+# where they're used, so the parser and JSON output start quickly; see
+# backends.py.
 
 ### Config ###
 
@@ -45,6 +74,46 @@ INPUT_FILES = [
     "/home/scott/Documents/A_Climbers_Guide/whitney.html",
 ]
 
+# Parsed chapters are cached here, keyed on their contents and the parser.
+CACHE_DIR = '.parse-cache'
+CACHE_MAX_BYTES = 256 * 1024 * 1024
+# The modules that parse chapters or define what's cached of them, including
+# QuarantinedRecord in batch.py, which parser_fingerprint() hashes.
+FINGERPRINT_MODULES = ("parser.py", "stream.py", "batch.py")
+
+# SQLite tuning for the bulk writer, run on every connection. --pragma
+# NAME=VALUE overrides or adds to these.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -64000,  # Negative is KiB, so 64 MiB.
+}
+PRAGMA_PATTERN = re.compile(r"^(\w+)=(-?[\w.]+)$")
+SQLITE_BATCH_SIZE = 1000  # Rows per executemany.
+
+COLUMNAR_BATCH_ROWS = 64 * 1024  # Rows per Parquet/Arrow record batch.
+
+SNAPSHOT_NAME = 'output-guide.snapshot'
+
+# Likely duplicate peaks and passes found across chapters by --dedupe.
+MERGE_CANDIDATES_NAME = 'output-merge-candidates.json'
+
+# Every record's content hash, written by each build and compared by diff.
+HASHES_NAME = 'output-hashes.json'
+
+# Added to the name of every output file, e.g. '.shard-1-of-4' with --shard.
+OUTPUT_SUFFIX = ''
+
+# The directory chapters' sources are relative to, set from --input; None
+# for the deepest one holding every input. See chapter_sources().
+INPUT_ROOT: Optional[str] = None
+
+# With --batch, each chapter is checkpointed here as it's parsed, so a rerun
+# resumes, and what failed to parse is reported in ERRORS_NAME.
+CHECKPOINT_DIR = '.batch-checkpoint'
+ERRORS_NAME = 'output-errors.json'
+QUARANTINE_TEXT_CHARS = 200  # Of a quarantined record's paragraph, in the report.
+
 ### End config ###
 
 ## Manual adjustments and notes
@@ -59,8 +128,68 @@ INPUT_FILES = [
 
 # placeholder = Region("Pending", "Pending", "Pending")
 
+# The --batch run in progress, if any; see batch_run().
+BATCH: Optional[BatchRun] = None
 
-@dataclass
+# Narrative locations in an elevation list, e.g. "0.6 NE of Mount Morgan".
+LOCATION_PATTERN = re.compile("\\d\\s[NEWS]")
+# yosemite_valley.html style route names without a "Route X" prefix, e.g. "Kat Walk."
+UNPREFIXED_ROUTE_PATTERN = re.compile("^[A-Z].+[^\\.\\)][\\.]")
+# An elevation in feet, e.g. "13,882", "13,000+" (at least) or "12,205n" (from the map).
+ELEVATION_PATTERN = re.compile("(\\d{1,2},\\d{3}|\\d{3,5})\\s*(\\+)?\\s*(n)?")
+# A class rating, e.g. "Class 3", or a range such as "Class 3-4", "Class 2 or 3" or
+# "Classes 3 and 4", anywhere in the text, as in "Maximum class 5" or "Easy class 3".
+CLASS_PATTERN = re.compile(
+    "\\bClass(?:es)?\\s+(\\d)(?:\\s*(?:-|–|to|or|and)\\s*(\\d))?", re.IGNORECASE
+)
+
+# Format of the created and last_modified timestamps.
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+# IDs are uuid5s in this namespace, derived from record names, so they are
+# the same from one run to the next.
+ID_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, "climbers-guide-parser")
+
+
+def stable_id(issued: set[str], *parts: str) -> str:
+    """
+    Return a uuid5 string derived from parts, e.g. the region and peak names.
+    issued holds the IDs already handed out under the same parent; a
+    repeated name gets an occurrence suffix so its ID is still unique.
+    """
+    key = "/".join(parts)
+    uid = str(uuid.uuid5(ID_NAMESPACE, key))
+    occurrence = 1
+    while uid in issued:
+        occurrence += 1
+        uid = str(uuid.uuid5(ID_NAMESPACE, f"{key}#{occurrence}"))
+    issued.add(uid)
+
+    return uid
+
+
+@cache
+def run_timestamp() -> str:
+    """
+    Return the created/last_modified timestamp for this run. Every record
+    shares the one string rather than formatting its own.
+    """
+    return datetime.now().strftime(TIMESTAMP_FORMAT)
+
+
+# The record types are slotted to keep them compact. Bookkeeping that isn't
+# part of a record lives in a slot declared on a base class, so it stays out
+# of fields(), asdict() and the JSON output. Records only point down to
+# their children, and a route names its peak by peak_id, so a chapter's
+# records form a tree that is freed as soon as it's dropped, without
+# waiting for the cyclic garbage collector.
+
+
+class RegionBookkeeping:
+    __slots__ = ("issued_ids", "quarantined")
+
+
+@dataclass(slots=True)
 class Pass:
     """Climbing/hiking pass. Will be own document in DB."""
 
@@ -70,15 +199,20 @@ class Pass:
     name: str = "Pending"
     aka: list[str] = field(default_factory=list)
     class_rating: str = "Pending"
+    class_grade: Optional[int] = None
     elevations: list[str] = field(default_factory=list)
+    elevation_feet: Optional[int] = None
+    elevation_lower_bound: bool = False
+    elevation_map_derived: bool = False
     description: str = "Pending"
     location_description: str = ""
     slug: str = ""
     region: str = ""
     region_slug: str = ""
+    content_hash: str = ""
 
 
-@dataclass
+@dataclass(slots=True)
 class Route:
     """Route. Will be own documennt in DB."""
 
@@ -87,13 +221,18 @@ class Route:
     route_id: str
     name: str = ""
     aka: list[str] = field(default_factory=list)
-    # peak: Peak = placeholder_peak  # Circular dependency; set after creation.
+    # The peak_id of the route's peak, rather than the Peak, which lists
+    # its routes, so the two don't form a reference cycle.
+    peak_id: str = ""
     class_rating: str = ""
+    # The hardest class class_rating names, e.g. 4 for "Class 3-4", or None.
+    class_grade: Optional[int] = None
     description: str = ""
     slug: str = ""
+    content_hash: str = ""
 
 
-@dataclass
+@dataclass(slots=True)
 class Peak:
     """Peak. Will be own document in DB."""
 
@@ -103,6 +242,9 @@ class Peak:
     name: str = ""
     aka: list[str] = field(default_factory=list)
     elevations: list[str] = field(default_factory=list)
+    elevation_feet: Optional[int] = None
+    elevation_lower_bound: bool = False
+    elevation_map_derived: bool = False
     routes: list[Route] = field(default_factory=list)
     # region: Region =  placeholder
     description: str = ""
@@ -112,10 +254,12 @@ class Peak:
     slug: str = ""
     region: str = ""
     region_slug: str = ""
+    # Covers the peak and its routes, but not the timestamps; see hashing.py.
+    content_hash: str = ""
 
 
-@dataclass
-class Region:
+@dataclass(slots=True)
+class Region(RegionBookkeeping):
     """Climbing region. Will be own document in DB."""
 
     created: str
@@ -126,29 +270,139 @@ class Region:
     peaks: list[Peak] = field(default_factory=list)
     passes: list[Pass] = field(default_factory=list)
     slug: str = ""
+    content_hash: str = ""
+
+    def __post_init__(self):
+        # IDs handed out to this region's peaks and passes.
+        self.issued_ids = set()
+        # A list to quarantine records that fail to parse in rather than
+        # raising, as with --batch; see quarantine().
+        self.quarantined: Optional[list[QuarantinedRecord]] = None
+
+
+class ParseError(ValueError):
+    """A chapter has records that failed to parse."""
+
+
+# The errors malformed input raises from the record parsers, e.g. IndexError
+# from a route with no "." after its class rating. ParseError is a
+# ValueError. Anything else is a bug, and is never quarantined.
+PARSE_ERRORS = (IndexError, ValueError)
+
+
+def quarantine(region: Region, kind: str, tag: Tag, error: Exception, peak: str = ""):
+    """
+    Record that the <p> tag holding a record of kind failed to parse with
+    error, so the record is left out rather than failing its chapter, if
+    region is quarantining records. Otherwise re-raise error.
+    """
+    if region.quarantined is None:
+        raise error
+    PROFILER.count("quarantined")
+    region.quarantined.append(
+        QuarantinedRecord(
+            kind=kind,
+            region=region.name,
+            peak=peak,
+            paragraph=len(tag.find_all_previous("p")) + 1,
+            text=" ".join(tag.text.split())[:QUARANTINE_TEXT_CHARS],
+            error=describe_error(error),
+        )
+    )
+
+
+def make_slug(text: str) -> str:
+    """
+    Slugify text, timed under the "slugify" stage when profiling.
+    """
+    with PROFILER.timer("slugify"):
+        return slugify(text)
 
 
 def get_soup(INPUT_FILE) -> BeautifulSoup:
     """
-    Parse the book chapter and return it as an object, after parsing it as
-    a string to make navigation easier later.
+    Parse the book chapter and return it as an object, with links removed,
+    newlines flattened to spaces, and peak paragraphs tagged with class="peak"
+    to make navigation easier later.
+
+    The chapter is read and parsed once; the clean-up happens on the tree
+    itself rather than by serializing it to a string and parsing it again.
     """
     with open(INPUT_FILE, encoding="windows-1252") as file:  # encoding is not ISO.
-        soup = BeautifulSoup(file, "lxml")
-
-    # Remove all links
-    links = soup.find_all("a")
-    for link in links:
-        # link.extract()
+        markup = file.read()
+    soup = BeautifulSoup(markup.replace("\n", " "), "lxml")
+
+    # Remove all links, then merge the strings on either side of them, as a
+    # reparse would. Keyed on id() as hashing a Tag serializes it.
+    parents = {}
+    for link in soup.find_all("a"):
+        parents[id(link.parent)] = link.parent
         link.decompose()
-    soup = str(soup)
-    soup = soup.replace("<p><i>", '<p class="peak"><i>')  # <p><i> is only peaks to <p><i>References
-    soup = soup.replace("\n", " ")  # The string process adds a lot of "\n".
-    soup = BeautifulSoup(soup, "lxml")
+    for parent in parents.values():
+        parent.smooth()
+
+    # <p><i> is only peaks to <p><i>References
+    for paragraph in soup.find_all("p"):
+        if is_peak_paragraph(paragraph):
+            paragraph["class"] = ["peak"]
 
     return soup
 
 
+def free_soup(soup: BeautifulSoup):
+    """
+    Take a soup apart, so it's freed by reference counting rather than
+    waiting for the cyclic collector, as every tag links to its parent and
+    siblings. decompose() on the soup itself only clears the root, whose
+    next_element isn't set, so each top-level element is decomposed first.
+    """
+    for element in list(soup.contents):
+        element.decompose()
+    soup.decompose()
+
+
+def is_peak_paragraph(tag: Tag) -> bool:
+    """
+    Returns true if the tag is a bare <p> whose first child is a bare <i>, i.e.
+    it would have serialized as '<p><i>'.
+    """
+    if tag.attrs:
+        return False
+    first = next(iter(tag.children), None)
+    return isinstance(first, Tag) and first.name == "i" and not first.attrs
+
+
+@dataclass
+class LoadStats:
+    """Time and peak traced memory for loading one chapter."""
+
+    file: str
+    seconds: float
+    peak_bytes: int
+
+
+def get_load_stats(files: List[str]) -> List[LoadStats]:
+    """
+    Load each chapter with get_soup() and return its parse time and peak
+    memory. Timing and memory are measured in separate runs, as tracemalloc
+    slows parsing considerably.
+    """
+    stats = []
+    for file in files:
+        start = time.perf_counter()
+        free_soup(get_soup(file))
+        seconds = time.perf_counter() - start
+
+        tracemalloc.start()
+        free_soup(get_soup(file))
+        _, peak_bytes = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        stats.append(LoadStats(file=file, seconds=seconds, peak_bytes=peak_bytes))
+
+    return stats
+
+
 def pass_parser(tag: Tag, region: Region) -> Pass:
     """
     Take the bs4 <p> tag holding the pass information, parse it, and return a
@@ -157,9 +411,7 @@ def pass_parser(tag: Tag, region: Region) -> Pass:
     Then use regex and string replacement to extract and remove the class rating,
     leaving only the description text.
     """
-    uid = str(uuid.uuid4())
-    mountain_pass = Pass(pass_id=uid, created=datetime.now().strftime('%Y-%m-%dT%H:%M:%SZ'),
-                         last_modified=datetime.now().strftime('%Y-%m-%dT%H:%M:%SZ'))
+    mountain_pass = Pass(pass_id="", created=run_timestamp(), last_modified=run_timestamp())
     # elevations = List[str]
     name = ""
     location_description = ""
@@ -169,12 +421,18 @@ def pass_parser(tag: Tag, region: Region) -> Pass:
         tag.i.decompose()  # Clear out the <i> tag with the name and elevation.
 
         mountain_pass.elevations = elevations
+        set_numeric_elevation(mountain_pass, elevations)
         mountain_pass.name = name
 
-    mountain_pass.class_rating = tag.text.split(".")[0].strip()  # Returns "Class 1", above.
+    # Returns "Class 1", above. Interned as the same few ratings repeat.
+    mountain_pass.class_rating = sys.intern(tag.text.split(".")[0].strip())
+    mountain_pass.class_grade = parse_class_rating(mountain_pass.class_rating)
     mountain_pass.description = tag.text.split(".", 1)[1].strip()
     mountain_pass.location_description = location_description
-    mountain_pass.slug = slugify(f'{mountain_pass.name} {mountain_pass.pass_id.split("-")[-1]}')
+    mountain_pass.pass_id = stable_id(
+        region.issued_ids, region.region_id, "passes", mountain_pass.name
+    )
+    mountain_pass.slug = make_slug(f'{mountain_pass.name} {mountain_pass.pass_id.split("-")[-1]}')
     mountain_pass.region = region.name
     mountain_pass.region_slug = region.slug
 
@@ -188,27 +446,35 @@ def get_passes(soup: BeautifulSoup, region: Region) -> List[Pass]:
     """
     Parse the soup and return a list of pass dataclasses.
     """
-    passes: List[Pass] = []
+    return list(iter_passes(soup, region))
+
+
+def iter_passes(soup: BeautifulSoup, region: Region) -> Iterator[Pass]:
+    """
+    Parse the soup and yield each pass dataclass as it is parsed.
+    """
     pass_section_start = soup.find("h4", string=re.compile(r"passes", re.IGNORECASE))
 
     # All the <p> tags (after the start) contain passes, and <h4> ends the section.
     # When the <h4> tag is found, we're done.
     if not isinstance(pass_section_start, Tag):
-        return passes  # Some regions have no passes, so bail out.
+        return  # Some regions have no passes, so bail out.
 
     for sibling in pass_section_start.next_siblings:
         # if sibling.name == "p":
         if isinstance(sibling, Tag) and sibling.name == "p":
-            p = pass_parser(sibling, region)
+            try:
+                p = pass_parser(sibling, region)
+            except PARSE_ERRORS as e:
+                quarantine(region, "pass", sibling, e)
+                continue
             # Don't add non-passes.
             if "References" in p.name or "Photographs" in p.name:
                 continue
-            passes.append(p)
+            yield p
         elif isinstance(sibling, Tag) and sibling.name == "h4":
             break
 
-    return passes
-
 
 def get_name_elevation_and_description(tag: Tag) -> tuple[str, List[str], str]:
     """
@@ -218,20 +484,71 @@ def get_name_elevation_and_description(tag: Tag) -> tuple[str, List[str], str]:
     <i>Peak 12,135 (12,205n; 1 NW of Recess Peak)</i>
     """
     # name, _, elevations = tag.string.partition("(")
+    return split_name_elevation_and_description(tag.text)
+
+
+def split_name_elevation_and_description(text: str) -> tuple[str, List[str], str]:
+    """
+    The text half of get_name_elevation_and_description(), for callers that
+    already have the tag's text.
+    """
     location_description = ""
-    name, _, elevations = tag.text.partition("(")
+    name, _, elevations = text.partition("(")
     name = name.strip(" ,.")
     elevations = [e.strip(".,)( ") for e in elevations.split(";")]  # split on ";" and strip each.
     # Get narrative location descriptions (e.g 0.6 NE of Mount Morgan) and remove it from
     # the list of elevations.
-    p = re.compile("\\d\\s[NEWS]")
     for i, e in enumerate(elevations):
-        if p.search(e):
+        if LOCATION_PATTERN.search(e):
             location_description = elevations.pop(i)
 
     return (name, elevations, location_description)
 
 
+def parse_elevation(text: str) -> Optional[tuple[int, bool, bool]]:
+    """
+    Parse an elevation string into (feet, lower_bound, map_derived), e.g.
+    "13,900+" gives (13900, True, False) and "13,917n" (13917, False, True).
+    Returns None if text doesn't start with an elevation.
+    """
+    match = ELEVATION_PATTERN.match(text.strip())
+    if match is None:
+        return None
+    feet, plus, n = match.groups()
+
+    return int(feet.replace(",", "")), plus is not None, n is not None
+
+
+@cache
+def parse_class_rating(text: str) -> Optional[int]:
+    """
+    Return the hardest class in a class rating, e.g. 3 for "Class 3" and 4
+    for "Class 3-4" or "Classes 3 and 4". The class may follow other words,
+    as in "Maximum class 5". Returns None if text has no class.
+    """
+    match = CLASS_PATTERN.search(text)
+    if match is None:
+        return None
+
+    return max(int(grade) for grade in match.groups() if grade)
+
+
+def set_numeric_elevation(record: Union["Peak", "Pass"], elevations: List[str]):
+    """
+    Set a peak or pass's numeric elevation fields from the first of its
+    elevations that parses, which is the surveyed figure where there is one.
+    """
+    for e in elevations:
+        parsed = parse_elevation(e)
+        if parsed is not None:
+            (
+                record.elevation_feet,
+                record.elevation_lower_bound,
+                record.elevation_map_derived,
+            ) = parsed
+            return
+
+
 def parse_route(tag: Tag, peak: Peak, kind: str) -> Route:
     """
     Parses a tag containing a route and returns a route dataclass. Tag has the
@@ -247,28 +564,27 @@ def parse_route(tag: Tag, peak: Peak, kind: str) -> Route:
     Clyde on June 25, 1934. From the northeast follow the arête from Crag
     5 to the 5-6 notch, and ascend the west side of the northwest arête.
     </p>
-
-    TODO: Circular dependency here with peak referencing the route, and the
-    route referecing the peak.
     """
-    uid = str(uuid.uuid4())
-    route = Route(route_id=uid, created=datetime.now().strftime('%Y-%m-%dT%H:%M:%SZ'),
-                  last_modified=datetime.now().strftime('%Y-%m-%dT%H:%M:%SZ'))
+    route = Route(route_id="", created=run_timestamp(), last_modified=run_timestamp())
 
     # If wanting to remove "Route X" prefix, could do it here by splitting on "." after extraction.
     if kind == "Route" and tag.i:
-        parsed_route_name = tag.i.extract().string
+        name_tag = tag.i.extract()
+        parsed_route_name = name_tag.string
         if parsed_route_name:
             route.name = parsed_route_name.strip(" .,") # Removes <i></i> and returns contents.
+        name_tag.decompose()  # Extracted, so free_soup() won't reach it.
     elif kind == "Class":
         route.name = "Route 1"  # This is the only included route for the peak.
 
-    route.class_rating = tag.text.split(".")[0].strip()  # Returns "Class 1", above.
+    # Returns "Class 1", above. Interned as the same few ratings repeat.
+    route.class_rating = sys.intern(tag.text.split(".")[0].strip())
+    route.class_grade = parse_class_rating(route.class_rating)
     route.description = tag.text.split(".", 1)[1].strip()
-    route.slug = slugify(f'{route.name} {route.route_id.split("-")[-1]}')
-    # This can't be typed on the class because of circular dependencies with
-    # Peak and Route when defining them.
-    route.peak: Peak = peak # type: ignore
+    # A peak has few routes, so the IDs already issued are gathered as needed.
+    route.route_id = stable_id({r.route_id for r in peak.routes}, peak.peak_id, route.name)
+    route.slug = make_slug(f'{route.name} {route.route_id.split("-")[-1]}')
+    route.peak_id = peak.peak_id
 
     return route
 
@@ -290,10 +606,9 @@ def parse_peak(tag: Tag, region: Region) -> Peak:
 
     Finally, if it's a 'yosemite.html' route description, that's parsed also.
     """
-    uid = str(uuid.uuid4())
-    peak = Peak(peak_id=uid, created=datetime.now().strftime('%Y-%m-%dT%H:%M:%SZ'),
-                last_modified=datetime.now().strftime('%Y-%m-%dT%H:%M:%SZ'))
     name, elevations, location_description = get_name_elevation_and_description(tag)
+    uid = stable_id(region.issued_ids, region.region_id, "peaks", name)
+    peak = Peak(peak_id=uid, created=run_timestamp(), last_modified=run_timestamp())
 
     # For each peak, go through and process the peak name, elevation(s),
     # route(s), and description.
@@ -314,16 +629,22 @@ def parse_peak(tag: Tag, region: Region) -> Peak:
         # and just add anything else to the peak's description.
         first_word = sibling.text.strip().split(" ")[0].strip()
         if first_word in ["Route", "Class"]:
-            peak.routes.append(parse_route(sibling, peak, first_word))
+            kind = first_word
         elif is_route_has_no_route_prefix(sibling):
-            peak.routes.append(parse_route(sibling, peak, "Route"))
+            kind = "Route"
         else:
             peak.description += sibling.text.strip() + "\n"
+            continue
+        try:
+            peak.routes.append(parse_route(sibling, peak, kind))
+        except PARSE_ERRORS as e:
+            quarantine(region, "route", sibling, e, name)
 
     peak.name = name
     peak.elevations = elevations
+    set_numeric_elevation(peak, elevations)
     peak.location_description = location_description
-    peak.slug = slugify(f'{peak.name} {peak.peak_id.split("-")[-1]}')
+    peak.slug = make_slug(f'{peak.name} {peak.peak_id.split("-")[-1]}')
     peak.region = region.name
     peak.region_slug = region.slug
 
@@ -338,8 +659,7 @@ def is_route_has_no_route_prefix(tag):
     # There may be no <i> tag sibling, so catch the AttributeError if it's not
     # there.
     try:
-        p = re.compile("^[A-Z].+[^\\.\\)][\\.]")
-        return p.match(tag.i.string) is not None
+        return UNPREFIXED_ROUTE_PATTERN.match(tag.i.string) is not None
 
     except AttributeError:
         return False
@@ -350,20 +670,30 @@ def get_peaks(soup: BeautifulSoup, region: Region) -> tuple[List[Peak], Region]:
     Parse the soup and return a list of peak datacasses and an updated region
     that includes the peak..
     """
+    parsed_peaks = list(iter_peaks(soup, region))
+
+    return parsed_peaks, region
+
+
+def iter_peaks(soup: BeautifulSoup, region: Region) -> Iterator[Peak]:
+    """
+    Parse the soup and yield each peak dataclass, with its routes, as it is
+    parsed. Each peak is also added to the region.
+    """
     peaks = soup.find_all(class_="peak")
-    # parsed_peaks = List[Peak]
-    parsed_peaks = []
     for peak in peaks:
-        p = parse_peak(peak, region)
+        try:
+            p = parse_peak(peak, region)
+        except PARSE_ERRORS as e:
+            quarantine(region, "peak", peak, e)
+            continue
         # Don't add non-peaks.
         if "References" in p.name or "Photographs" in p.name:
             continue
 
-        # Add the peak to the parsed peaks and region.
-        parsed_peaks.append(p)
+        # Add the peak to the region.
         region.peaks.append(p)
-
-    return parsed_peaks, region
+        yield p
 
 
 def parse_region(soup: BeautifulSoup) -> str:
@@ -382,175 +712,765 @@ def parse_region(soup: BeautifulSoup) -> str:
     return title_string
 
 
-def get_region(soup: BeautifulSoup) -> Region:
+def get_region(soup: BeautifulSoup, source: str = "") -> Region:
     """
-    Get the region and return it.
+    Get the region and return it. Its ID is derived from the title and
+    source, the chapter's path (see chapter_sources()), so chapters with the
+    same title, such as two editions of one chapter, get their own region,
+    and so their own peaks, routes and passes, whose IDs are derived from it.
     """
 
     title_string = parse_region(soup)
 
     # return "no region"
-    uid = str(uuid.uuid4())
-    region = Region(name=title_string, region_id=uid, created=datetime.now().strftime('%Y-%m-%dT%H:%M:%SZ'),
-                    last_modified=datetime.now().strftime('%Y-%m-%dT%H:%M:%SZ'))
-    region.slug = slugify(f'{region.name} {region.region_id.split("-")[-1]}')
+    uid = stable_id(set(), source, title_string) if source else stable_id(set(), title_string)
+    region = Region(name=sys.intern(title_string), region_id=uid, created=run_timestamp(),
+                    last_modified=run_timestamp())
+    region.slug = sys.intern(make_slug(f'{region.name} {region.region_id.split("-")[-1]}'))
 
     return region
 
 
-def do_peaks_passes_regions() -> tuple[list[Peak], list[Pass], list[Region]]:
+@cache
+def parser_fingerprint() -> str:
+    """
+    Return a fingerprint of the parser, so cached chapters are reparsed
+    whenever the parsing code changes: every module in FINGERPRINT_MODULES,
+    and the version of Beautiful Soup.
+    """
+    digest = hashlib.sha256(bs4_version.encode())
+    for name in FINGERPRINT_MODULES:
+        with open(os.path.join(os.path.dirname(__file__), name), "rb") as source:
+            digest.update(source.read())
+    return digest.hexdigest()
+
+
+def parse_chapter(
+    file: str, use_cache: bool = False, engine: str = "tree", quarantine: bool = False,
+    source: Optional[str] = None,
+) -> tuple[list[Peak], list[Pass], Region]:
+    """
+    Parse one chapter and return its peaks, passes and region. The three are
+    returned together so they pickle as one object graph when run in a
+    worker process or stored in the cache.
+
+    With use_cache, an unchanged chapter is loaded from CACHE_DIR instead of
+    being parsed again. Both engines give the same records, so they share
+    the cache.
+
+    A record that fails to parse raises its error, as ever. With quarantine,
+    as in a --batch run, it's left out and listed in the region's
+    quarantined instead. A chapter cached with quarantined records raises
+    ParseError unless quarantine is set.
+
+    source scopes the records' IDs; see get_region(). It defaults to the
+    file's name.
+    """
+    if source is None:
+        source = os.path.basename(file)
+    start = time.perf_counter()
+    cached = False
+    if not use_cache:
+        chapter = parse_chapter_uncached(file, engine, source, quarantine)
+    else:
+        cache = ChapterCache(CACHE_DIR, CACHE_MAX_BYTES, parser_fingerprint())
+        with PROFILER.timer("cache.get"):
+            key = cache.key(file, source)
+            chapter = cache.get(key)
+        cached = chapter is not None
+        if chapter is None:
+            chapter = parse_chapter_uncached(file, engine, source, quarantine)
+            with PROFILER.timer("cache.put"):
+                cache.put(key, chapter)
+        PROFILER.count("cache.hits" if cached else "cache.misses")
+
+    quarantined = chapter[2].quarantined
+    if quarantined:
+        # In document order, as the engines find them in different orders.
+        quarantined.sort(key=lambda record: record.paragraph)
+        for record in quarantined:
+            record.file = file  # The cached chapter may have been read from another path.
+        if not quarantine:
+            more = f" (and {len(quarantined) - 1} more)" if len(quarantined) > 1 else ""
+            raise ParseError(quarantined[0].describe() + more)
+
+    if PROFILER.enabled:
+        peaks, passes, _ = chapter
+        PROFILER.chapter(
+            file,
+            time.perf_counter() - start,
+            cached=cached,
+            peaks=len(peaks),
+            routes=sum(len(peak.routes) for peak in peaks),
+            passes=len(passes),
+        )
+
+    return chapter
+
+
+def parse_chapter_uncached(
+    file: str, engine: str = "tree", source: str = "", quarantine: bool = False
+) -> tuple[list[Peak], list[Pass], Region]:
+    """
+    Parse one chapter from its HTML, with the tree functions or, with
+    engine="stream", in a single traversal. With quarantine, records that
+    fail to parse are listed in the region's quarantined.
+    """
+    with PROFILER.timer("load"):
+        soup = get_soup(file)
+    try:
+        if engine == "stream":
+            from .stream import parse_soup
+
+            with PROFILER.timer("stream"):
+                return parse_soup(soup, source, quarantine)
+        with PROFILER.timer("region"):
+            region = get_region(soup, source)  # Get the current region.
+            if quarantine:
+                region.quarantined = []
+        with PROFILER.timer("peaks"):
+            peaks, region = get_peaks(soup, region)  # Get the peaks and updated region.
+        with PROFILER.timer("passes"):
+            passes = get_passes(soup, region)
+
+        return peaks, passes, region
+    finally:
+        with PROFILER.timer("free"):
+            free_soup(soup)
+
+
+def profiled_parse_chapter(
+    file: str, use_cache: bool, engine: str, quarantine: bool = False,
+    source: Optional[str] = None,
+) -> tuple[tuple[list[Peak], list[Pass], Region], dict]:
+    """
+    Run parse_chapter() with profiling on in a worker process, returning the
+    chapter and the worker's profile for the parent to merge.
+    """
+    PROFILER.enabled = True
+    PROFILER.reset()
+    chapter = parse_chapter(file, use_cache, engine, quarantine, source)
+
+    return chapter, PROFILER.snapshot()
+
+
+def iter_chapters(
+    workers: int = 1, use_cache: bool = True, engine: str = "tree", dedupe: bool = False,
+    hashes: Optional[BuildHashes] = None, candidates: Optional[List[MergeCandidate]] = None,
+) -> Iterator[tuple[list[Peak], list[Pass], Region]]:
+    """
+    Parse the book one chapter at a time, yielding each chapter's peaks,
+    passes and region in INPUT_FILES order. With more than one worker, the
+    chapters are parsed in a process pool.
+
+    With dedupe, the whole book is parsed before anything is yielded, so
+    the same peak or pass in different chapters can be linked through aka,
+    and the merge candidates found are added to candidates, if given.
+
+    Each record's content_hash is set as it's yielded, and its region's
+    manifest entry added to hashes, if given. Nothing is written to disk;
+    the CLI's outputs do that with write_build_outputs().
+    """
+    chapters = iter_parsed_chapters(workers, use_cache, engine)
+    if dedupe:
+        chapters, found = dedupe_chapters(chapters)
+        if candidates is not None:
+            candidates += found
+    hashes = hashes if hashes is not None else BuildHashes()
+    for chapter in chapters:
+        with PROFILER.timer("hash"):
+            hashes.add(chapter[2])
+        yield chapter
+
+
+def write_build_outputs(hashes: BuildHashes, candidates: Optional[List[MergeCandidate]] = None):
+    """
+    Write what a build collected beside its outputs: hashes to HASHES_NAME
+    and, with --dedupe, candidates to MERGE_CANDIDATES_NAME.
+    """
+    hashes.write(output_path(HASHES_NAME))
+    if candidates is not None:
+        write_merge_candidates(candidates)
+
+
+def chapter_sources(files: List[str]) -> List[str]:
+    """
+    Return the source of each of files, its path relative to INPUT_ROOT, or
+    to the deepest directory holding them all, which scopes its IDs.
+    """
+    root = INPUT_ROOT if INPUT_ROOT is not None else input_root(files)
+    return [chapter_source(file, root) for file in files]
+
+
+def iter_parsed_chapters(
+    workers: int = 1, use_cache: bool = True, engine: str = "tree"
+) -> Iterator[tuple[list[Peak], list[Pass], Region]]:
+    if BATCH is not None:
+        yield from iter_batch_chapters(BATCH, INPUT_FILES, workers, use_cache, engine)
+        return
+    sources = chapter_sources(INPUT_FILES)
+    if workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+
+        args = (INPUT_FILES, repeat(use_cache), repeat(engine), repeat(False), sources)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            if not PROFILER.enabled:
+                yield from executor.map(parse_chapter, *args)
+                return
+            for chapter, profile in executor.map(profiled_parse_chapter, *args):
+                PROFILER.merge(profile)
+                yield chapter
+    else:
+        for file, source in zip(INPUT_FILES, sources):
+            yield parse_chapter(file, use_cache, engine, source=source)
+
+
+def iter_batch_chapters(
+    batch: BatchRun, files: List[str], workers: int = 1, use_cache: bool = True,
+    engine: str = "tree"
+) -> Iterator[tuple[list[Peak], list[Pass], Region]]:
+    """
+    iter_parsed_chapters() over files, for a --batch run. Checkpointed
+    chapters are loaded rather than parsed, the rest are checkpointed as
+    they're parsed, with any records that fail quarantined, and a chapter
+    that fails outright is recorded in batch and skipped.
+    """
+    sources = dict(zip(files, chapter_sources(files)))
+    resuming = [file for file in files if batch.checkpoint.has(file, sources[file])]
+    if resuming:
+        click.echo(f"Resuming: {len(resuming)} of {len(files)} chapters are checkpointed.")
+    pending_files = [file for file in files if file not in resuming]
+    parse = partial(parse_chapter, use_cache=use_cache, engine=engine, quarantine=True)
+    pending = {}
+    with ExitStack() as stack:
+        if workers > 1 and pending_files:
+            from concurrent.futures import ProcessPoolExecutor
+
+            executor = stack.enter_context(ProcessPoolExecutor(max_workers=workers))
+            worker_parse = profiled_parse_chapter if PROFILER.enabled else parse_chapter
+            for file in pending_files:
+                pending[file] = executor.submit(
+                    worker_parse, file, use_cache, engine, True, sources[file]
+                )
+
+        for file in files:
+            chapter = None
+            if file in resuming:
+                with PROFILER.timer("checkpoint.load"):
+                    chapter = batch.checkpoint.load(file, sources[file])
+            resumed = chapter is not None
+            if chapter is None:
+                try:
+                    if file not in pending:
+                        chapter = parse(file, source=sources[file])
+                    elif PROFILER.enabled:
+                        chapter, profile = pending.pop(file).result()
+                        PROFILER.merge(profile)
+                    else:
+                        chapter = pending.pop(file).result()
+                except Exception as e:
+                    batch.fail(file, e)
+                    click.echo(f"Skipped {file}: {describe_error(e)}")
+                    continue
+            with PROFILER.timer("checkpoint.save"):
+                batch.completed(file, sources[file], chapter, resumed)
+            yield chapter
+
+
+@contextmanager
+def batch_run(enabled: bool):
+    """
+    Run the block as a --batch run, if enabled: setting BATCH, then writing
+    ERRORS_NAME and removing the checkpoint if the block completed with
+    nothing to report.
+    """
+    global BATCH
+    if not enabled:
+        yield None
+        return
+    BATCH = BatchRun(Checkpoint(output_path(CHECKPOINT_DIR), parser_fingerprint()))
+    completed = False
+    try:
+        yield BATCH
+        completed = True
+    finally:
+        batch, BATCH = BATCH, None
+        path = output_path(ERRORS_NAME)
+        batch.write_report(path)
+        click.echo(f"Batch: {batch.summary()}; see {path}.")
+        if completed and batch.clean:
+            batch.checkpoint.clear()
+        else:
+            click.echo("Rerun with --batch to resume from the checkpoint.")
+
+
+def dedupe_chapters(
+    chapters: Iterable[tuple[list[Peak], list[Pass], Region]]
+) -> tuple[list[tuple[list[Peak], list[Pass], Region]], List[MergeCandidate]]:
+    """
+    Find peaks and passes that appear in more than one chapter and add their
+    other names to aka. Returns the chapters and the merge candidates.
+    """
+    chapters = list(chapters)
+    with PROFILER.timer("dedupe"):
+        candidates = link_duplicates(
+            [peak for peaks, _, _ in chapters for peak in peaks],
+            [mountain_pass for _, passes, _ in chapters for mountain_pass in passes],
+        )
+    PROFILER.count("dedupe.candidates", len(candidates))
+
+    return chapters, candidates
+
+
+def write_merge_candidates(candidates: List[MergeCandidate]):
+    aliases = sum(c.match == "alias" for c in candidates)
+    path = output_path(MERGE_CANDIDATES_NAME)
+    with JsonArrayWriter(path) as writer:
+        for candidate in candidates:
+            writer.write(candidate)
+    click.echo(
+        f"Found {len(candidates) - aliases} duplicates and {aliases} aliases across chapters;"
+        f" see {path}."
+    )
+
+
+def iter_regions(
+    workers: int = 1, use_cache: bool = True, engine: str = "tree", dedupe: bool = False,
+    hashes: Optional[BuildHashes] = None, candidates: Optional[List[MergeCandidate]] = None,
+) -> Iterator[Region]:
     """
-    Iterate through the book and run the scripts on each input.
+    Parse the book one chapter at a time, yielding each region with its
+    peaks and passes. No files are written: the regions' manifest entries
+    are added to hashes and, with dedupe, the merge candidates to
+    candidates, if given, for the caller to write; see iter_chapters().
+    """
+    for _, _, region in iter_chapters(workers, use_cache, engine, dedupe, hashes, candidates):
+        yield region
+
+
+def do_peaks_passes_regions(
+    workers: int = 1, use_cache: bool = True, engine: str = "tree", dedupe: bool = False,
+    hashes: Optional[BuildHashes] = None, candidates: Optional[List[MergeCandidate]] = None,
+) -> tuple[list[Peak], list[Pass], list[Region]]:
+    """
+    Iterate through the book and run the scripts on each input, skipping
+    chapters that are unchanged since they were cached. With dedupe, link
+    the same peak or pass in different chapters through aka. hashes and
+    candidates collect as for iter_chapters().
     """
     peaks = []
     passes = []
     regions = []
 
-    for file in INPUT_FILES:
-        soup = get_soup(file)
-        region = get_region(soup)  # Get the current region.
-        p, r = get_peaks(soup, region)  # Get the peaks and updated region.
+    for p, ps, r in iter_chapters(workers, use_cache, engine, dedupe, hashes, candidates):
         peaks += p
+        passes += ps
         regions.append(r)
-        passes += get_passes(soup, region)
 
     return peaks, passes, regions
 
 
-def write_json(i: list, kind: str):
-    """Write out json to a set of files."""
-    output = []
-    for e in i:
-        output.append(asdict(e))
+def output_path(name: str) -> str:
+    """Return the file name to write output name to, with OUTPUT_SUFFIX."""
+    return with_suffix(name, OUTPUT_SUFFIX)
 
-    with open(f"output-{kind}.json", "a") as outfile:
-        json.dump(output, outfile, indent=4, default=str, sort_keys=True)
+
+def json_writer(kind: str, ndjson: bool = False, compress: bool = False,
+                flush_bytes: int = FLUSH_BYTES) -> RecordWriter:
+    """
+    Return a writer for 'output-[kind].json', or 'output-[kind].ndjson' with
+    one record per line.
+    """
+    if ndjson:
+        return NdjsonWriter(output_path(f"output-{kind}.ndjson"), compress, flush_bytes)
+    return JsonArrayWriter(output_path(f"output-{kind}.json"), compress, flush_bytes)
 
 
-def output_json():
-    """ Parse and output to JSON """
-    peaks, passes, regions = do_peaks_passes_regions()
-    write_json(peaks, "peaks")
-    write_json(passes, "passes")
-    write_json(regions, "regions")
+def write_json(i: Iterable, kind: str, ndjson: bool = False, compress: bool = False,
+               flush_bytes: int = FLUSH_BYTES):
+    """Write out json to a set of files."""
+    with json_writer(kind, ndjson, compress, flush_bytes) as writer:
+        for e in i:
+            writer.write(e)
+
+
+def output_json(workers: int = 1, use_cache: bool = True, ndjson: bool = False,
+                compress: bool = False, flush_bytes: int = FLUSH_BYTES, engine: str = "tree",
+                dedupe: bool = False):
+    """ Parse and output to JSON, one chapter at a time. """
+    hashes, candidates = BuildHashes(), [] if dedupe else None
+    with json_writer("peaks", ndjson, compress, flush_bytes) as peak_writer, json_writer(
+        "passes", ndjson, compress, flush_bytes
+    ) as pass_writer, json_writer("regions", ndjson, compress, flush_bytes) as region_writer:
+        chapters = iter_chapters(workers, use_cache, engine, dedupe, hashes, candidates)
+        for peaks, passes, region in chapters:
+            with PROFILER.timer("json.write"):
+                for peak in peaks:
+                    peak_writer.write(peak)
+                for mountain_pass in passes:
+                    pass_writer.write(mountain_pass)
+                region_writer.write(region)
+    write_build_outputs(hashes, candidates)
     click.echo("JSON files written to the current directory.")
 
-def output_sqlite():
-    """ Parse output to SQLite """
-
-    # Set up database.
-    engine = DB(dbtype=DBTYPE, dbname=DBNAME).create_db_engine()
-    Base.metadata.create_all(engine)
-    Session = sessionmaker(bind=engine)
-    session = Session()
-
-    # Get the peak, passes, and regions, though in a way just the regions are
-    # used.
-    peaks, passes, regions = do_peaks_passes_regions()
-
-    # For each region, process all peaks and passes.
-    for region in regions:
-        r = RegionModel(
-            name=region.name,
-            slug=region.slug,
-            region_id=region.region_id,
-            created=datetime.now(),
-            last_modified=datetime.now(),
-        )
 
-        # Process each peak in the region.
-        for peak in region.peaks:
-            p = PeakModel(
-                created=datetime.now(),
-                last_modified=datetime.now(),
-                peak_id=peak.peak_id,
-                name=peak.name,
-                aka=peak.aka,
-                elevations=peak.elevations,
-                description=peak.description,
-                location_description=peak.location_description,
-                gps_coordinates=peak.gps_coordinates,
-                utm_coordinates=peak.utm_coordinates,
-                slug=peak.slug,
-                # This probably needs to get the already created specific region
-                # and then to work with that.
-                # region_id=r,
-                # region_slug=peak.region_slug,
-            )
+def output_merge_candidates(workers: int = 1, use_cache: bool = True, engine: str = "tree"):
+    """ Parse the book and just write the merge candidates --dedupe finds. """
+    hashes, candidates = BuildHashes(), []
+    do_peaks_passes_regions(workers, use_cache, engine, True, hashes, candidates)
+    write_build_outputs(hashes, candidates)
 
-            # Append this peak to its region.
-            r.peaks.append(p)
-
-            # For each route on the peak, add it to the list via the peak's
-            # routes, so that the relation between the two is set.
-            for route in peak.routes:
-                rte = RouteModel(
-                    name=route.name,
-                    aka=route.aka,
-                    class_rating=route.class_rating,
-                    description=route.description,
-                    route_id=route.route_id
-                )
-                # Add the route to the peak.
-                p.routes.append(rte)
-
-            # With Peak constructed and the routes added, add the peak.
-            session.add(p)
-
-        # Process each pass in the region.
-        for mountain_pass in region.passes:
-            p = PassModel(
-                created=datetime.now(),
-                last_modified=datetime.now(),
-                pass_id=mountain_pass.pass_id,
-                class_rating=mountain_pass.class_rating,
-                description=mountain_pass.description,
-                name=mountain_pass.name,
-                slug=mountain_pass.slug,
+
+def output_load_stats():
+    """ Report how long each chapter takes to load, and its peak memory. """
+    for stats in get_load_stats(INPUT_FILES):
+        click.echo(f"{stats.file}: {stats.seconds:.3f}s, {stats.peak_bytes / 1024:.0f} KiB peak")
+
+
+def run_profiled(action: Callable, profile_path: Optional[str] = None,
+                 pstats_path: Optional[str] = None):
+    """
+    Run action, writing the stage timings and counters to profile_path as
+    JSON and a cProfile dump to pstats_path, if given.
+    """
+    if not profile_path and not pstats_path:
+        return action()
+
+    PROFILER.reset()
+    PROFILER.enabled = bool(profile_path)
+    profile = cProfile.Profile() if pstats_path else None
+    try:
+        if profile:
+            profile.enable()
+        return action()
+    finally:
+        if profile:
+            profile.disable()
+            profile.dump_stats(pstats_path)
+        if profile_path:
+            report = PROFILER.report(extra=dict(input_files=len(INPUT_FILES)))
+            with open(profile_path, "w") as outfile:
+                json.dump(report, outfile, indent=4)
+        PROFILER.enabled = False
+
+
+def shard_option(ctx, param, value):
+    if value is None:
+        return None
+    try:
+        return parse_shard(value)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+
+def pragma_option(ctx, param, values) -> dict:
+    """Parse each NAME=VALUE given to --pragma into {NAME: VALUE}."""
+    pragmas = {}
+    for value in values:
+        match = PRAGMA_PATTERN.match(value)
+        if not match:
+            raise click.BadParameter(
+                f"{value!r} is not a pragma: expected NAME=VALUE, e.g. synchronous=OFF"
             )
-            r.passes.append(p)
-            session.add(p)
-
-        # Add the region
-        print(f"Processing {region.name}\n")
-        session.add(r)
-    # Save the database changes.
-    session.commit()
-
-    first_peak = session.query(PeakModel).first()
-    last_peak = session.query(PeakModel).order_by(PeakModel.id.desc())[2]
-    print(f"Fetching the first peak:\n{first_peak}")
-    print(f"Fetching the third from the last peak:\n{last_peak}")
-    print(f"\nShowing more data about {last_peak.name}\n \
-          id: {last_peak.id}\n \
-          created: {last_peak.created}\n \
-          last_modified: {last_peak.last_modified}\n \
-          peak_id: {last_peak.peak_id}\n \
-          aka: {last_peak.aka}\n \
-          elevations: {last_peak.elevations}\n \
-          description: {last_peak.description}\n \
-          location_description: {last_peak.location_description}\n \
-          gps_coordinates: {last_peak.gps_coordinates}\n \
-          utm_coordinates: {last_peak.utm_coordinates}\n \
-          slug: {last_peak.slug}\n \
-          region: {last_peak.region}\n \
-          routes: {last_peak.routes}\n \
-          ")
-
-    regions_db = session.query(RegionModel).all()
-    print(f"Regions are: {regions_db}\n")
-    print(f"First region and peak are: {regions_db[0].peaks[0]}\n")
-    print(f"First region and pass are: {regions_db[0].passes[0]}\n")
-
-
-@click.command(no_args_is_help=True)
+        pragmas[match[1]] = match[2]
+    return pragmas
+
+
+@click.group(invoke_without_command=True, no_args_is_help=True)
 @click.option("-j", "--json", is_flag=True, help="Write to 'output-[kind].json'")
+@click.option("--ndjson", is_flag=True, help="Write one record per line to 'output-[kind].ndjson'")
+@click.option("--gzip", "compress", is_flag=True, help="Gzip the JSON output")
+@click.option("--parquet", is_flag=True, help="Write tables to 'output-[table].parquet'")
+@click.option("--arrow", is_flag=True, help="Write tables to 'output-[table].arrow' (Arrow IPC)")
+@click.option("--snapshot", is_flag=True, help=f"Write a binary snapshot to '{SNAPSHOT_NAME}'")
+@click.option(
+    "--flush-size", default=FLUSH_BYTES, show_default=True, help="Bytes buffered per JSON write"
+)
 # @click.option("-s", "--sqlite", type=click.File(), help="Write to SQLite DB at path")
 @click.option("-s", "--sqlite", is_flag=True, help="Write to SQLite DB at path")
-def main(json, sqlite):
+@click.option("--fts", is_flag=True, help="Build a full-text search index with --sqlite")
+@click.option(
+    "--dedupe", is_flag=True, help="Link peaks and passes repeated across chapters through aka"
+)
+@click.option(
+    "--watch", is_flag=True, help="Keep the JSON or SQLite output current as chapters are edited"
+)
+@click.option("--load-stats", is_flag=True, help="Report per-chapter parse time and peak memory")
+@click.option("-w", "--workers", default=1, show_default=True, help="Parse chapters in N processes")
+@click.option("--no-cache", is_flag=True, help="Reparse every chapter, ignoring the parse cache")
+@click.option(
+    "--batch-size", default=SQLITE_BATCH_SIZE, show_default=True, help="Rows per SQLite insert batch"
+)
+@click.option(
+    "--pragma", "pragmas", multiple=True, callback=pragma_option, metavar="NAME=VALUE",
+    help="Run PRAGMA NAME=VALUE on each SQLite connection, over the defaults; repeatable",
+)
+@click.option(
+    "--engine",
+    type=click.Choice(["tree", "stream"]),
+    default="tree",
+    show_default=True,
+    help="Parse with the tree functions or in a single traversal",
+)
+@click.option(
+    "--input", "input_path", type=click.Path(exists=True),
+    help="Parse the .html files under this directory, or listed in this manifest",
+)
+@click.option(
+    "--shard", callback=shard_option, metavar="I/N",
+    help="Parse only shard I of N, writing outputs named for it; see merge",
+)
+@click.option(
+    "--batch", is_flag=True,
+    help="Checkpoint chapters as they're parsed, so a rerun resumes, and report what fails"
+    f" to parse in '{ERRORS_NAME}' rather than stopping",
+)
+@click.option(
+    "--gc-threshold", type=click.IntRange(min=0),
+    help="Allocations between young garbage collections while parsing; 0 turns them off",
+)
+@click.option(
+    "--gc-freeze", is_flag=True, help="Exempt objects created at start-up from garbage collection"
+)
+@click.option(
+    "--profile", type=click.Path(),
+    help="Write stage timings, peak RSS and GC counts as JSON to this file",
+)
+@click.option("--pstats", type=click.Path(), help="Write a cProfile dump to this file")
+@click.pass_context
+def main(ctx, json, ndjson, compress, parquet, arrow, snapshot, flush_size, sqlite, fts,
+         dedupe, watch, load_stats, workers, no_cache, batch_size, pragmas, engine, input_path,
+         shard, batch, gc_threshold, gc_freeze, profile, pstats):
     """ Parse A Climber's Guide to the High Sierra HTML files and output them
     as desired. """
-    if json:
-        return output_json()
+    global INPUT_FILES, INPUT_ROOT, OUTPUT_SUFFIX, SQLITE_PRAGMAS
+    if ctx.invoked_subcommand is not None:
+        return None
+    if pragmas:
+        SQLITE_PRAGMAS = dict(SQLITE_PRAGMAS, **pragmas)
+    if input_path:
+        INPUT_FILES = discover_inputs(input_path)
+    # Before --shard picks some of the files, so each shard scopes IDs alike.
+    INPUT_ROOT = input_root(INPUT_FILES, input_path)
+    OUTPUT_SUFFIX = ''
+    if shard:
+        if watch or dedupe:
+            raise click.UsageError("--shard can't be used with --watch or --dedupe")
+        INPUT_FILES = select_shard(INPUT_FILES, *shard, root=INPUT_ROOT)
+        OUTPUT_SUFFIX = shard_suffix(*shard)
+    if watch:
+        if batch:
+            raise click.UsageError("--watch can't be used with --batch")
+        if not (json or ndjson or sqlite):
+            raise click.UsageError("--watch needs -j, --ndjson or --sqlite")
+        if dedupe:
+            raise click.UsageError("--watch can't be used with --dedupe")
+        from .watch import watch_outputs
+
+        action = partial(
+            watch_outputs, workers, not no_cache, engine, json, ndjson, compress, flush_size,
+            sqlite, batch_size,
+        )
+    elif json or ndjson:
+        action = partial(
+            load_backend("json"), workers, not no_cache, ndjson, compress, flush_size, engine,
+            dedupe,
+        )
+    elif parquet or arrow:
+        fmt = "parquet" if parquet else "arrow"
+        action = partial(load_backend(fmt), workers, not no_cache, fmt, engine, dedupe)
+    elif snapshot:
+        action = partial(load_backend("snapshot"), workers, not no_cache, engine, dedupe)
     elif sqlite:
-        return output_sqlite()
+        action = partial(
+            load_backend("sqlite"), workers, not no_cache, batch_size, engine, fts, dedupe
+        )
+    elif load_stats:
+        action = output_load_stats
+    elif dedupe:
+        # Just report the merge candidates.
+        action = partial(output_merge_candidates, workers, not no_cache, engine)
+    else:
+        return None
+    with gc_tuning(gc_threshold, gc_freeze), batch_run(batch):
+        return run_profiled(action, profile, pstats)
+
+
+@main.command("search")
+@click.argument("query")
+@click.option("--kind", type=click.Choice(["peak", "route", "pass"]), help="Only search one kind")
+@click.option("-n", "--limit", default=20, show_default=True, help="Number of hits to show")
+@click.option("--db", default=DBNAME, show_default=True, type=click.Path(), help="SQLite DB path")
+def search_command(query, kind, limit, db):
+    """ Search peak, route and pass names and descriptions, best match first.
+    QUERY takes FTS5 syntax: words, "a phrase", prefix* and OR. Build the
+    index first with --sqlite --fts. """
+    from sqlalchemy import create_engine  # type: ignore
+    from sqlalchemy.exc import OperationalError  # type: ignore
+
+    from .search import fts_table_exists, search
+
+    if not os.path.exists(db):
+        raise click.ClickException(f"No database at {db}; run with --sqlite --fts first.")
+    db_engine = create_engine(f"sqlite:///{db}")
+    start = time.perf_counter()
+    with db_engine.connect() as connection:
+        if not fts_table_exists(connection, "peaks"):
+            raise click.ClickException(f"{db} has no search index; run with --sqlite --fts.")
+        try:
+            hits = search(connection, query, kind, limit)
+        except OperationalError as e:
+            raise click.BadParameter(str(e.orig), param_hint="QUERY")
+    seconds = time.perf_counter() - start
+
+    for hit in hits:
+        click.echo(f"{hit.kind:>5}  {hit.name}\n       {hit.snippet}")
+    click.echo(f"{len(hits)} hits in {seconds * 1000:.1f} ms")
+
+
+@main.command("elevations")
+@click.option("--min", "low", type=int, help="Lowest elevation in feet")
+@click.option("--max", "high", type=int, help="Highest elevation in feet")
+@click.option("--kind", type=click.Choice(["peak", "pass"]), default="peak", show_default=True)
+@click.option("--exact", is_flag=True, help="Leave out lower-bound elevations such as 13,900+")
+@click.option("-n", "--limit", type=int, help="Number of results to show")
+@click.option("--stats", is_flag=True, help="Summarize every elevation instead of listing a range")
+@click.option("--db", default=DBNAME, show_default=True, type=click.Path(), help="SQLite DB path")
+def elevations_command(low, high, kind, exact, limit, stats, db):
+    """ List peaks or passes in an elevation range, lowest first, or with
+    --stats summarize the elevations. Reads the database written by --sqlite. """
+    from sqlalchemy import create_engine, select  # type: ignore
+
+    from .elevations import ELEVATION_TABLES, elevation_stats, in_elevation_range
+
+    if not os.path.exists(db):
+        raise click.ClickException(f"No database at {db}; run with --sqlite first.")
+    db_engine = create_engine(f"sqlite:///{db}")
+    with db_engine.connect() as connection:
+        if stats:
+            table, _ = ELEVATION_TABLES[kind]
+            rows = connection.execute(
+                select(
+                    table.c.elevation_feet,
+                    table.c.elevation_lower_bound,
+                    table.c.elevation_map_derived,
+                )
+            )
+            click.echo(json.dumps(elevation_stats(rows), indent=4))
+            return
+        rows = in_elevation_range(connection, low, high, kind, not exact, limit)
+
+    for row in rows:
+        flags = ("+" if row["elevation_lower_bound"] else "") + (
+            "n" if row["elevation_map_derived"] else ""
+        )
+        click.echo(f"{row['elevation_feet']:>6,}{flags:<2} {row['name']}")
+    click.echo(f"{len(rows)} found")
+
+
+@main.command("serve")
+@click.option("--db", default=DBNAME, show_default=True, type=click.Path(), help="SQLite DB path")
+@click.option("--host", default="127.0.0.1", show_default=True)
+@click.option("--port", default=8000, show_default=True)
+@click.option("--pool-size", default=8, show_default=True, help="Pooled read connections")
+@click.option("--access-log", is_flag=True, help="Log each request to stderr")
+def serve_command(db, host, port, pool_size, access_log):
+    """ Serve regions, peaks, routes and passes as JSON over HTTP, read-only,
+    from the database written by --sqlite. """
+    from .server import make_server
+
+    if not os.path.exists(db):
+        raise click.ClickException(f"No database at {db}; run with --sqlite first.")
+    server = make_server(db, host, port, pool_size, access_log=access_log)
+    click.echo(f"Serving {db} on http://{host}:{server.server_port}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+@main.command("merge")
+@click.option("--shards", "count", type=click.IntRange(min=1), required=True,
+              help="The number of shards the build was split into")
+@click.option("-j", "--json", is_flag=True, help="Merge 'output-[kind].shard-I-of-N.json'")
+@click.option("--ndjson", is_flag=True, help="Merge 'output-[kind].shard-I-of-N.ndjson'")
+@click.option("--gzip", "compress", is_flag=True, help="The JSON outputs are gzipped")
+@click.option("-s", "--sqlite", is_flag=True, help=f"Merge the shards' SQLite DBs into {DBNAME}")
+@click.option("--fts", is_flag=True, help="Build a full-text search index with --sqlite")
+@click.option(
+    "--batch-size", default=SQLITE_BATCH_SIZE, show_default=True, help="Rows per SQLite insert batch"
+)
+@click.option(
+    "--pragma", "pragmas", multiple=True, callback=pragma_option, metavar="NAME=VALUE",
+    help="Run PRAGMA NAME=VALUE on each SQLite connection, over the defaults; repeatable",
+)
+@click.option("--dir", "directory", default=".", show_default=True,
+              type=click.Path(exists=True, file_okay=False), help="Where the shard outputs are")
+def merge_command(count, json, ndjson, compress, sqlite, fts, batch_size, pragmas, directory):
+    """ Combine the outputs of a build run with --shard I/N for every I. """
+    if not (json or ndjson or sqlite):
+        raise click.UsageError("merge needs -j, --ndjson or --sqlite")
+    try:
+        hashes = merge_hashes(directory, HASHES_NAME, count)
+        if json or ndjson:
+            counts = merge_json(directory, count, ndjson, compress)
+            click.echo("Merged " + ", ".join(f"{n} {kind}" for kind, n in counts.items()) + ".")
+        if sqlite:
+            from .sqlite_output import merge_sqlite, open_database
+
+            paths = shard_paths(directory, DBNAME, count)
+            db_engine = open_database(
+                os.path.join(directory, DBNAME), dict(SQLITE_PRAGMAS, **pragmas)
+            )
+            sync = merge_sqlite(paths, db_engine, batch_size, fts)
+            click.echo(f"Merged {count} databases: {sync.summary()}")
+    except (FileNotFoundError, ValueError) as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Book hash: {hashes.book_hash}")
+
+
+def read_hashes(path: str) -> BuildHashes:
+    """Read the hash manifest at path, or HASHES_NAME in the directory path."""
+    if os.path.isdir(path):
+        path = os.path.join(path, HASHES_NAME)
+    try:
+        return BuildHashes.read(path)
+    except (OSError, ValueError) as e:
+        raise click.ClickException(str(e))
+
+
+@main.command("diff")
+@click.argument("old", type=click.Path(exists=True))
+@click.argument("new", type=click.Path(exists=True))
+@click.option("--json", "as_json", is_flag=True, help="Print the changes as JSON")
+def diff_command(old, new, as_json):
+    """ List the peaks, routes, passes and regions that differ between two
+    builds. OLD and NEW are hash manifests, or directories holding
+    'output-hashes.json'. """
+    changes = diff_manifests(read_hashes(old), read_hashes(new))
+    if as_json:
+        click.echo(json.dumps([asdict(change) for change in changes], indent=4))
+        return
+    symbols = dict(added="+", removed="-", changed="~")
+    for change in changes:
+        click.echo(f"{symbols[change.action]} {change.kind:<6} {change.name} ({change.region})")
+    counts = {action: sum(c.action == action for c in changes) for action in symbols}
+    click.echo(", ".join(f"{n} {action}" for action, n in counts.items()))
+
+
+@main.command("lookup")
+@click.argument("slug")
+@click.option(
+    "--snapshot", "path", default=SNAPSHOT_NAME, show_default=True, type=click.Path(exists=True)
+)
+def lookup_command(slug, path):
+    """ Print the record with SLUG from a snapshot written by --snapshot. """
+    from .snapshot import Snapshot
+
+    with Snapshot(path) as snapshot:
+        record = snapshot.get(slug)
+    if record is None:
+        raise click.ClickException(f"No record with slug {slug!r}")
+    click.echo(json.dumps(record, indent=4, ensure_ascii=False))
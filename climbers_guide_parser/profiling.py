@@ -0,0 +1,178 @@
+import gc
+import sys
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from typing import Any, Optional
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None  # type: ignore
+
+# Returned by timer() while profiling is off, so an untimed stage costs one
+# attribute check and an empty with block.
+NULL_TIMER = nullcontext()
+
+
+def reset_peak_rss():
+    """
+    Reset the kernel's peak RSS mark, so the next reading covers only what
+    follows. Only Linux supports this; elsewhere peaks are since start-up.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss() -> Optional[int]:
+    """Return this process's peak resident set size in bytes, if known."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return rusage_maxrss("RUSAGE_SELF")
+
+
+def rusage_maxrss(who: str) -> Optional[int]:
+    """Return getrusage()'s peak RSS for RUSAGE_SELF or RUSAGE_CHILDREN, in bytes."""
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(getattr(resource, who)).ru_maxrss
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+def gc_collections() -> list[int]:
+    """The number of collections of each generation so far."""
+    return [generation["collections"] for generation in gc.get_stats()]
+
+
+@contextmanager
+def gc_tuning(threshold: Optional[int] = None, freeze: bool = False):
+    """
+    Tune the cyclic garbage collector for a bulk run, restoring it after.
+
+    threshold replaces the allocations between young collections (700 by
+    default); 0 turns automatic collection off. Parsing allocates a great
+    many objects that live until their chapter is written, each of which
+    would otherwise be scanned by several collections on its way to the
+    oldest generation. With freeze, everything allocated so far (modules,
+    classes, the parser's patterns) is moved out of the collector's sight
+    first; worker processes forked later inherit that too.
+    """
+    thresholds = gc.get_threshold()
+    if freeze:
+        gc.collect()
+        gc.freeze()
+    if threshold is not None:
+        gc.set_threshold(threshold, *thresholds[1:])
+    try:
+        yield
+    finally:
+        gc.set_threshold(*thresholds)
+        if freeze:
+            gc.unfreeze()
+
+
+class Timer:
+    """Context manager adding its elapsed time to a Profiler stage."""
+
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler: "Profiler", name: str):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.add_time(self.name, time.perf_counter() - self.start)
+
+
+class Profiler:
+    """
+    Timers and counters for the pipeline stages and chapters. Everything is
+    a no-op until enabled, so the instrumentation can stay in place.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.reset()
+
+    def reset(self):
+        self.started = time.perf_counter()
+        self.gc_started = gc_collections()
+        self.calls: Counter = Counter()
+        self.seconds: Counter = Counter()
+        self.counters: Counter = Counter()
+        self.chapters: list[dict[str, Any]] = []
+
+    def timer(self, name: str):
+        """Return a context manager timing the named stage."""
+        if not self.enabled:
+            return NULL_TIMER
+        return Timer(self, name)
+
+    def add_time(self, name: str, seconds: float):
+        self.calls[name] += 1
+        self.seconds[name] += seconds
+
+    def count(self, name: str, n: int = 1):
+        if self.enabled:
+            self.counters[name] += n
+
+    def chapter(self, file: str, seconds: float, **counts):
+        """Record the time taken and record counts for one chapter."""
+        if self.enabled:
+            self.chapters.append(dict(file=file, seconds=seconds, **counts))
+
+    def snapshot(self) -> dict[str, Any]:
+        """Return the collected data, for merging across processes."""
+        return dict(
+            calls=dict(self.calls),
+            seconds=dict(self.seconds),
+            counters=dict(self.counters),
+            chapters=self.chapters,
+        )
+
+    def merge(self, snapshot: dict[str, Any]):
+        """Add in a snapshot taken in a worker process."""
+        self.calls.update(snapshot["calls"])
+        self.seconds.update(snapshot["seconds"])
+        self.counters.update(snapshot["counters"])
+        self.chapters.extend(snapshot["chapters"])
+
+    def report(self, extra: Optional[dict] = None) -> dict[str, Any]:
+        """Return a JSON-serializable report of everything collected."""
+        return dict(
+            wall_seconds=time.perf_counter() - self.started,
+            stages={
+                name: dict(calls=self.calls[name], seconds=self.seconds[name])
+                for name in sorted(self.calls)
+            },
+            counters=dict(sorted(self.counters.items())),
+            chapters=self.chapters,
+            memory=self.memory(),
+            **(extra or {}),
+        )
+
+    def memory(self) -> dict[str, Any]:
+        """
+        Peak RSS of this process and of its largest worker, and the garbage
+        collections of each generation since reset().
+        """
+        return dict(
+            peak_rss_bytes=peak_rss(),
+            worker_peak_rss_bytes=rusage_maxrss("RUSAGE_CHILDREN") or None,
+            gc_collections=[n - m for n, m in zip(gc_collections(), self.gc_started)],
+        )
+
+
+PROFILER = Profiler()
@@ -0,0 +1,125 @@
+from dataclasses import dataclass
+from typing import List, Optional
+
+from sqlalchemy import text  # type: ignore
+
+# Base tables with an FTS5 index, the column holding each row's stable ID,
+# and the kind reported for their hits.
+FTS_TABLES = [
+    ("peaks", "peak_id", "peak"),
+    ("routes", "route_id", "route"),
+    ("passes", "pass_id", "pass"),
+]
+
+# Indexed columns, in order, and their bm25() weights: a match in a name
+# ranks above one in a description.
+FTS_COLUMNS = ("name", "aka", "description")
+FTS_WEIGHTS = (10.0, 5.0, 1.0)
+
+# remove_diacritics lets "arete" find "arête".
+FTS_TOKENIZER = "unicode61 remove_diacritics 2"
+
+SNIPPET_TOKENS = 12
+
+
+@dataclass
+class SearchHit:
+    """One ranked search result. Lower ranks are better matches."""
+
+    kind: str
+    key: str
+    name: str
+    snippet: str
+    rank: float
+
+
+def fts_table_exists(connection, table: str) -> bool:
+    return (
+        connection.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+            dict(name=f"{table}_fts"),
+        ).first()
+        is not None
+    )
+
+
+def create_fts(connection) -> List[str]:
+    """
+    Create an external-content FTS5 table over name, aka and description for
+    each of peaks, routes and passes, with triggers keeping it in step with
+    every insert, update and delete on the base table. A newly created index
+    is filled from the rows already there. Returns the tables created.
+    """
+    created = []
+    columns = ", ".join(FTS_COLUMNS)
+    new = ", ".join(f"new.{c}" for c in FTS_COLUMNS)
+    old = ", ".join(f"old.{c}" for c in FTS_COLUMNS)
+    for table, _, _ in FTS_TABLES:
+        if fts_table_exists(connection, table):
+            continue
+        fts = f"{table}_fts"
+        connection.execute(
+            text(
+                f"CREATE VIRTUAL TABLE {fts} USING fts5({columns}, content='{table}',"
+                f" content_rowid='id', tokenize='{FTS_TOKENIZER}')"
+            )
+        )
+        connection.execute(
+            text(
+                f"CREATE TRIGGER {fts}_ai AFTER INSERT ON {table} BEGIN"
+                f" INSERT INTO {fts}(rowid, {columns}) VALUES (new.id, {new}); END"
+            )
+        )
+        connection.execute(
+            text(
+                f"CREATE TRIGGER {fts}_ad AFTER DELETE ON {table} BEGIN"
+                f" INSERT INTO {fts}({fts}, rowid, {columns}) VALUES ('delete', old.id, {old});"
+                " END"
+            )
+        )
+        connection.execute(
+            text(
+                f"CREATE TRIGGER {fts}_au AFTER UPDATE ON {table} BEGIN"
+                f" INSERT INTO {fts}({fts}, rowid, {columns}) VALUES ('delete', old.id, {old});"
+                f" INSERT INTO {fts}(rowid, {columns}) VALUES (new.id, {new}); END"
+            )
+        )
+        connection.execute(text(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')"))
+        created.append(fts)
+
+    return created
+
+
+def search(connection, query: str, kind: Optional[str] = None, limit: int = 20) -> List[SearchHit]:
+    """
+    Return the best limit hits for an FTS5 query across peaks, routes and
+    passes, or only the given kind. The query takes FTS5 syntax: words,
+    "quoted phrases", prefix* and OR. Route names are given with their peak.
+    """
+    weights = ", ".join(str(w) for w in FTS_WEIGHTS)
+    selects = []
+    for table, key, table_kind in FTS_TABLES:
+        if kind is not None and kind != table_kind:
+            continue
+        if not fts_table_exists(connection, table):
+            continue
+        fts = f"{table}_fts"
+        name = "t.name"
+        join = ""
+        if table == "routes":
+            name = "coalesce(p.name || ': ', '') || coalesce(t.name, '')"
+            join = "LEFT JOIN peaks AS p ON p.id = t.peak_id"
+        selects.append(
+            f"SELECT '{table_kind}' AS kind, t.{key} AS key, {name} AS name,"
+            f" snippet({fts}, -1, '[', ']', '...', {SNIPPET_TOKENS}) AS snippet,"
+            f" bm25({fts}, {weights}) AS rank"
+            f" FROM {fts} JOIN {table} AS t ON t.id = {fts}.rowid {join}"
+            f" WHERE {fts} MATCH :query"
+        )
+    if not selects:
+        return []
+
+    statement = text(" UNION ALL ".join(selects) + " ORDER BY rank LIMIT :limit")
+    rows = connection.execute(statement, dict(query=query, limit=limit))
+
+    return [SearchHit(**row) for row in rows.mappings()]
@@ -0,0 +1,227 @@
+"""
+Read-only HTTP JSON service over the database written by --sqlite.
+
+    climbers-guide-parser serve --port 8000
+
+    GET /regions                     every region, with peak and pass counts
+    GET /regions/<slug>              one region's summary
+    GET /regions/<slug>/peaks        its peaks, with routes (paged)
+    GET /regions/<slug>/passes       its passes (paged)
+    GET /regions/<slug>/stats        its counts, routes per class, hardest and easiest routes
+    GET /peaks, /passes              every peak or pass (paged)
+    GET /peaks/<slug>                one peak, with its routes
+    GET /peaks/<slug>/routes         its routes
+    GET /routes/<slug>, /passes/<slug>
+
+Paged lists take ?offset=0&limit=100 and return {"items", "offset",
+"limit", "total", "next"}. Every response has an ETag derived from a hash of
+its body, and a request whose If-None-Match matches gets an empty 304.
+Bodies are cached until the database file changes.
+"""
+import hashlib
+import json
+import re
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+from .cache import LRUCache
+from .json_writer import encode_default
+from .store import GuideStore
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+RESPONSE_CACHE_SIZE = 4096
+
+
+class NotFound(Exception):
+    pass
+
+
+class BadRequest(Exception):
+    pass
+
+
+def found(record):
+    if record is None:
+        raise NotFound()
+    return record
+
+
+def matches(etag: str, if_none_match: Optional[str]) -> bool:
+    """Return true if an If-None-Match header lists etag, or is "*"."""
+    if not if_none_match:
+        return False
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return etag in tags or "*" in tags
+
+
+class GuideService:
+    """
+    The request handling behind the HTTP server: maps a path and query to a
+    status, JSON body and ETag, caching the encoded bodies.
+    """
+
+    def __init__(self, store: GuideStore, cache_size: int = RESPONSE_CACHE_SIZE):
+        self.store = store
+        self.responses = LRUCache(cache_size)
+        self.routes = [
+            (re.compile(pattern), handler)
+            for pattern, handler in [
+                (r"/regions", self.list_regions),
+                (r"/regions/([^/]+)", self.region),
+                (r"/regions/([^/]+)/peaks", self.region_peaks),
+                (r"/regions/([^/]+)/passes", self.region_passes),
+                (r"/regions/([^/]+)/stats", self.region_stats),
+                (r"/peaks", self.list_peaks),
+                (r"/peaks/([^/]+)", self.peak),
+                (r"/peaks/([^/]+)/routes", self.peak_routes),
+                (r"/routes/([^/]+)", self.route),
+                (r"/passes", self.list_passes),
+                (r"/passes/([^/]+)", self.mountain_pass),
+            ]
+        ]
+
+    def get(self, target: str) -> tuple[int, bytes, Optional[str]]:
+        """Return the status, body and ETag for a GET of target."""
+        if self.store.refresh():
+            self.responses.clear()
+        return self.responses.get_or_load(target, lambda: self.respond(target))
+
+    def respond(self, target: str) -> tuple[int, bytes, Optional[str]]:
+        url = urlsplit(target)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        path = url.path.rstrip("/") or "/"
+        try:
+            for pattern, handler in self.routes:
+                match = pattern.fullmatch(path)
+                if match:
+                    data = handler(path, query, *match.groups())
+                    break
+            else:
+                raise NotFound()
+        except NotFound:
+            return self.error(HTTPStatus.NOT_FOUND, f"Nothing at {path}")
+        except BadRequest as e:
+            return self.error(HTTPStatus.BAD_REQUEST, str(e))
+
+        body = json.dumps(data, default=encode_default, ensure_ascii=False).encode()
+        etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+        return HTTPStatus.OK, body, etag
+
+    @staticmethod
+    def error(status: HTTPStatus, message: str) -> tuple[int, bytes, Optional[str]]:
+        return status, json.dumps(dict(error=message)).encode(), None
+
+    @staticmethod
+    def paging(query: dict) -> tuple[int, int]:
+        try:
+            offset = int(query.get("offset", 0))
+            limit = int(query.get("limit", DEFAULT_LIMIT))
+        except ValueError:
+            raise BadRequest("offset and limit must be integers")
+        if offset < 0 or not 0 < limit <= MAX_LIMIT:
+            raise BadRequest(f"offset must be 0 or more and limit from 1 to {MAX_LIMIT}")
+        return offset, limit
+
+    def paged(self, path: str, query: dict, kind: str, region_slug: Optional[str] = None):
+        offset, limit = self.paging(query)
+        if region_slug is not None:
+            self.region(path, query, region_slug)
+        items, total = self.store.page(kind, offset, limit, region_slug)
+        next_page = None
+        if offset + limit < total:
+            next_page = f"{path}?{urlencode(dict(offset=offset + limit, limit=limit))}"
+        return dict(items=items, offset=offset, limit=limit, total=total, next=next_page)
+
+    def list_regions(self, path, query):
+        return self.store.regions()
+
+    def region(self, path, query, slug):
+        return found(next((r for r in self.store.regions() if r["slug"] == slug), None))
+
+    def region_peaks(self, path, query, slug):
+        return self.paged(path, query, "peak", slug)
+
+    def region_passes(self, path, query, slug):
+        return self.paged(path, query, "pass", slug)
+
+    def region_stats(self, path, query, slug):
+        return found(self.store.region_stats(slug))
+
+    def list_peaks(self, path, query):
+        return self.paged(path, query, "peak")
+
+    def list_passes(self, path, query):
+        return self.paged(path, query, "pass")
+
+    def peak(self, path, query, slug):
+        return found(self.store.get_by_slug(slug, "peak"))
+
+    def peak_routes(self, path, query, slug):
+        return found(self.store.get_by_slug(slug, "peak")).routes
+
+    def route(self, path, query, slug):
+        return found(self.store.get_by_slug(slug, "route"))
+
+    def mountain_pass(self, path, query, slug):
+        return found(self.store.get_by_slug(slug, "pass"))
+
+
+class GuideRequestHandler(BaseHTTPRequestHandler):
+    """Serves GET and HEAD from the server's GuideService, with keep-alive."""
+
+    protocol_version = "HTTP/1.1"
+    # Headers and body are separate writes; with Nagle's algorithm on, the
+    # body waits on the client's delayed ACK, adding ~40 ms per response.
+    disable_nagle_algorithm = True
+    server: "GuideServer"
+
+    def do_GET(self, head: bool = False):
+        status, body, etag = self.server.service.get(self.path)
+        if etag is not None and matches(etag, self.headers.get("If-None-Match")):
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        if etag is not None:
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def do_HEAD(self):
+        self.do_GET(head=True)
+
+    def log_message(self, format, *args):
+        if self.server.access_log:
+            super().log_message(format, *args)
+
+
+class GuideServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, service: GuideService, access_log: bool = False):
+        super().__init__(address, GuideRequestHandler)
+        self.service = service
+        self.access_log = access_log
+
+
+def make_server(
+    db: str,
+    host: str = "127.0.0.1",
+    port: int = 8000,
+    pool_size: int = 8,
+    cache_size: int = RESPONSE_CACHE_SIZE,
+    access_log: bool = False,
+) -> GuideServer:
+    """Return a server for the database at db; port 0 picks a free port."""
+    store = GuideStore.open(db, cache_size, pool_size)
+    return GuideServer((host, port), GuideService(store, cache_size), access_log)
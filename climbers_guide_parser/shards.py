@@ -0,0 +1,163 @@
+"""
+Input discovery and sharded builds.
+
+Chapters can be listed in a manifest, or found in a directory, instead of
+in INPUT_FILES. A build can then be split across machines with --shard i/n:
+each shard parses its own chapters and writes outputs named for it, e.g.
+'output-peaks.shard-1-of-4.json', and the merge command combines them. The
+records' keys are stable IDs derived from their names, not from the order
+they were parsed in, so they are the same however the book was split.
+"""
+import glob
+import gzip
+import hashlib
+import json
+import os
+import re
+from typing import Iterator, Optional
+
+from .hashing import BuildHashes
+from .json_writer import JsonArrayWriter, NdjsonWriter
+
+SHARD_PATTERN = re.compile(r"^(\d+)/(\d+)$")
+
+# The JSON outputs, with the field naming each record's region.
+JSON_KINDS = {"peaks": "region", "passes": "region", "regions": "name"}
+
+
+def discover_inputs(path: str) -> list[str]:
+    """
+    Return the chapter files at path: every .html file under a directory,
+    in sorted order, or the files listed in a manifest, one per line.
+    Manifest paths are relative to the manifest, and blank lines and lines
+    starting with "#" are skipped.
+    """
+    if os.path.isdir(path):
+        return sorted(glob.glob(os.path.join(path, "**", "*.html"), recursive=True))
+
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path) as manifest:
+        lines = (line.strip() for line in manifest)
+        return [os.path.join(base, line) for line in lines if line and not line.startswith("#")]
+
+
+def input_root(files: list[str], path: Optional[str] = None) -> str:
+    """
+    Return the directory the chapters' sources are relative to: path, as
+    given to discover_inputs(), if it's a directory, the manifest's if it's
+    a file, or else the deepest directory holding every file. A directory
+    given as the input stays the root as chapters are added under it.
+    """
+    if path is not None:
+        path = os.path.abspath(path)
+        return path if os.path.isdir(path) else os.path.dirname(path)
+    if not files:
+        return os.getcwd()
+    return os.path.commonpath([os.path.dirname(os.path.abspath(file)) for file in files])
+
+
+def chapter_source(file: str, root: str) -> str:
+    """
+    Return file's path relative to root, with "/" separators. It scopes the
+    chapter's IDs, so two chapters with the same title, e.g. two editions
+    of one chapter, don't share their records' IDs.
+    """
+    return os.path.relpath(os.path.abspath(file), root).replace(os.sep, "/")
+
+
+def parse_shard(spec: str) -> tuple[int, int]:
+    """Parse "i/n", with 1 <= i <= n, into (i, n)."""
+    match = SHARD_PATTERN.match(spec)
+    if not match or not 1 <= int(match[1]) <= int(match[2]):
+        raise ValueError(f"{spec!r} is not a shard: expected i/n with 1 <= i <= n, e.g. 1/4")
+    return int(match[1]), int(match[2])
+
+
+def assign_shards(files: list[str], count: int, root: Optional[str] = None) -> dict[str, int]:
+    """
+    Assign each file to one of count shards, numbered from 1, by a hash of
+    its source, its path relative to root (see input_root()). A chapter
+    stays in its shard however it's edited and whatever chapters are added
+    or removed, and every node given the same chapters makes the same
+    assignment. Shards get about as many chapters as each other, not bytes.
+    """
+    root = root if root is not None else input_root(files)
+    shards = {}
+    for file in files:
+        digest = hashlib.sha256(chapter_source(file, root).encode()).digest()
+        shards[file] = int.from_bytes(digest[:8], "big") % count + 1
+    return shards
+
+
+def select_shard(files: list[str], index: int, count: int, root: Optional[str] = None) -> list[str]:
+    """Return the files in shard index of count, keeping their order."""
+    shards = assign_shards(files, count, root)
+    return [file for file in files if shards[file] == index]
+
+
+def shard_suffix(index: int, count: int) -> str:
+    return f".shard-{index}-of-{count}"
+
+
+def with_suffix(name: str, suffix: str) -> str:
+    """Insert suffix before the extension of name: 'a.json' -> 'a{suffix}.json'."""
+    root, ext = os.path.splitext(name)
+    return root + suffix + ext
+
+
+def read_records(path: str, ndjson: bool) -> Iterator[dict]:
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt") as f:
+        if ndjson:
+            yield from (json.loads(line) for line in f if line.strip())
+        else:
+            yield from json.load(f)
+
+
+def shard_paths(directory: str, name: str, count: int, compress: bool = False) -> list[str]:
+    """
+    Return the path of name in directory for each of count shards, with
+    '.gz' if compressed, raising FileNotFoundError if any is missing.
+    """
+    gz = ".gz" if compress else ""
+    paths = [
+        os.path.join(directory, with_suffix(name, shard_suffix(i, count)) + gz)
+        for i in range(1, count + 1)
+    ]
+    missing = [path for path in paths if not os.path.exists(path)]
+    if missing:
+        raise FileNotFoundError(f"Missing shard outputs: {', '.join(missing)}")
+    return paths
+
+
+def merge_json(
+    directory: str, count: int, ndjson: bool = False, compress: bool = False
+) -> dict[str, int]:
+    """
+    Merge the JSON outputs of count shards in directory into the unsharded
+    names there, and return the records in each. Records are ordered by
+    region name, keeping their order within a region, so the result is the
+    same however the chapters were split between shards.
+    """
+    writer_class = NdjsonWriter if ndjson else JsonArrayWriter
+    counts = {}
+    for kind, region_field in JSON_KINDS.items():
+        name = f"output-{kind}" + (".ndjson" if ndjson else ".json")
+        records: list[dict] = []
+        for path in shard_paths(directory, name, count, compress):
+            records += read_records(path, ndjson)
+        records.sort(key=lambda record: record[region_field])
+        with writer_class(os.path.join(directory, name), compress) as writer:
+            for record in records:
+                writer.write(record)
+        counts[kind] = writer.count
+    return counts
+
+
+def merge_hashes(directory: str, name: str, count: int) -> BuildHashes:
+    """Merge the hash manifests of count shards in directory into name there."""
+    hashes = BuildHashes()
+    for path in shard_paths(directory, name, count):
+        hashes.update(BuildHashes.read(path))
+    hashes.write(os.path.join(directory, name))
+    return hashes
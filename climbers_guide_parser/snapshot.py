@@ -0,0 +1,268 @@
+"""
+Binary snapshot of the whole guide, read through mmap.
+
+Layout, all integers little-endian:
+
+    header    magic, version, record count, slug area offset, record area offset
+    index     one fixed-size entry per record, sorted by slug: the slug's
+              offset and length in the slug area, the record's offset and
+              length in the record area
+    slugs     the slugs, UTF-8, back to back
+    records   per record: kind (u8), u32-length-prefixed JSON of its fields
+              other than the description, then the u32-length-prefixed
+              UTF-8 description
+
+Opening a snapshot reads only the header, so it takes the same time however
+large the guide is. A lookup binary searches the index in the mapped file
+and decodes just the one record. The file is mapped read-only, so every
+process reading it shares the same pages of the page cache.
+
+Records reference each other by slug: a peak lists its routes' slugs, a
+route names its peak's, and a region lists its peaks' and passes'.
+"""
+import json
+import mmap
+import os
+import struct
+import tempfile
+from typing import Iterable, Iterator, Optional
+
+import click  # type: ignore
+
+from . import parser
+from .hashing import BuildHashes
+from .json_writer import atomic_write
+from .parser import Region
+from .profiling import PROFILER
+
+MAGIC = b"CGSNAPSH"
+VERSION = 1
+
+HEADER = struct.Struct("<8sIIQQ")  # magic, version, count, slugs offset, records offset
+ENTRY = struct.Struct("<IIQI")  # slug offset, slug length, record offset, record length
+LENGTH = struct.Struct("<I")
+
+KINDS = ["region", "peak", "route", "pass"]
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def encode_record(kind: str, fields: dict, description: str) -> bytes:
+    meta = json.dumps(fields, ensure_ascii=False, separators=(",", ":")).encode()
+    text = description.encode()
+    return b"".join(
+        [bytes([KINDS.index(kind)]), LENGTH.pack(len(meta)), meta, LENGTH.pack(len(text)), text]
+    )
+
+
+def iter_records(regions: Iterable[Region]) -> Iterator[tuple[str, str, dict, str]]:
+    """Yield (slug, kind, fields, description) for every record in regions."""
+    for region in regions:
+        yield region.slug, "region", dict(
+            region_id=region.region_id,
+            name=region.name,
+            content_hash=region.content_hash,
+            created=region.created,
+            last_modified=region.last_modified,
+            peaks=[peak.slug for peak in region.peaks],
+            passes=[mountain_pass.slug for mountain_pass in region.passes],
+        ), ""
+        for peak in region.peaks:
+            yield peak.slug, "peak", dict(
+                peak_id=peak.peak_id,
+                name=peak.name,
+                aka=peak.aka,
+                elevations=peak.elevations,
+                elevation_feet=peak.elevation_feet,
+                elevation_lower_bound=peak.elevation_lower_bound,
+                elevation_map_derived=peak.elevation_map_derived,
+                location_description=peak.location_description,
+                gps_coordinates=peak.gps_coordinates,
+                utm_coordinates=peak.utm_coordinates,
+                region=peak.region,
+                region_slug=peak.region_slug,
+                content_hash=peak.content_hash,
+                created=peak.created,
+                last_modified=peak.last_modified,
+                routes=[route.slug for route in peak.routes],
+            ), peak.description
+            for route in peak.routes:
+                yield route.slug, "route", dict(
+                    route_id=route.route_id,
+                    name=route.name,
+                    aka=route.aka,
+                    class_rating=route.class_rating,
+                    class_grade=route.class_grade,
+                    peak=peak.slug,
+                    content_hash=route.content_hash,
+                    created=route.created,
+                    last_modified=route.last_modified,
+                ), route.description
+        for mountain_pass in region.passes:
+            yield mountain_pass.slug, "pass", dict(
+                pass_id=mountain_pass.pass_id,
+                name=mountain_pass.name,
+                aka=mountain_pass.aka,
+                class_rating=mountain_pass.class_rating,
+                class_grade=mountain_pass.class_grade,
+                elevations=mountain_pass.elevations,
+                elevation_feet=mountain_pass.elevation_feet,
+                elevation_lower_bound=mountain_pass.elevation_lower_bound,
+                elevation_map_derived=mountain_pass.elevation_map_derived,
+                location_description=mountain_pass.location_description,
+                region=mountain_pass.region,
+                region_slug=mountain_pass.region_slug,
+                content_hash=mountain_pass.content_hash,
+                created=mountain_pass.created,
+                last_modified=mountain_pass.last_modified,
+            ), mountain_pass.description
+
+
+def write_snapshot(regions: Iterable[Region], path: str) -> int:
+    """
+    Write every record in regions to a snapshot at path, replacing it
+    atomically, and return the number of records. Records are spooled to a
+    temporary file as they come, so only the slugs and offsets are held in
+    memory until the index is written.
+    """
+    entries: list[tuple[bytes, int, int]] = []
+    directory = os.path.dirname(os.path.abspath(path))
+    with tempfile.TemporaryFile(dir=directory) as spool:
+        offset = 0
+        for slug, kind, fields, description in iter_records(regions):
+            record = encode_record(kind, fields, description)
+            spool.write(record)
+            entries.append((slug.encode(), offset, len(record)))
+            offset += len(record)
+
+        entries.sort()
+        for (a, _, _), (b, _, _) in zip(entries, entries[1:]):
+            if a == b:
+                raise SnapshotError(f"Two records share the slug {a.decode()!r}")
+
+        slugs_offset = HEADER.size + ENTRY.size * len(entries)
+        records_offset = slugs_offset + sum(len(slug) for slug, _, _ in entries)
+
+        with atomic_write(path, "wb") as out:
+            out.write(HEADER.pack(MAGIC, VERSION, len(entries), slugs_offset, records_offset))
+            slug_offset = 0
+            for slug, record_offset, length in entries:
+                out.write(ENTRY.pack(slug_offset, len(slug), record_offset, length))
+                slug_offset += len(slug)
+            for slug, _, _ in entries:
+                out.write(slug)
+            spool.seek(0)
+            while chunk := spool.read(1024 * 1024):
+                out.write(chunk)
+
+    return len(entries)
+
+
+def output_snapshot(
+    workers: int = 1, use_cache: bool = True, engine: str = "tree", dedupe: bool = False
+):
+    """Parse and write every record to a binary snapshot for mmap lookups."""
+    hashes, candidates = BuildHashes(), [] if dedupe else None
+    regions = parser.iter_regions(workers, use_cache, engine, dedupe, hashes, candidates)
+    path = parser.output_path(parser.SNAPSHOT_NAME)
+    with PROFILER.timer("snapshot.write"):
+        count = write_snapshot(regions, path)
+    parser.write_build_outputs(hashes, candidates)
+    click.echo(f"Wrote {count} records to {path}.")
+
+
+class Snapshot:
+    """
+    A snapshot file mapped read-only. get(slug) returns a record's fields as
+    a dict, with its kind, slug and description; description(slug) reads
+    only the description.
+    """
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size < HEADER.size:
+                raise SnapshotError(f"{path} is too short to be a snapshot")
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.count, self.slugs_offset, self.records_offset = HEADER.unpack_from(
+            self.mm
+        )
+        if magic != MAGIC or version != VERSION:
+            self.mm.close()
+            raise SnapshotError(f"{path} is not a version {VERSION} snapshot")
+
+    def close(self):
+        self.mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __contains__(self, slug: str) -> bool:
+        return self.find(slug) is not None
+
+    def entry(self, i: int) -> tuple[int, int, int, int]:
+        return ENTRY.unpack_from(self.mm, HEADER.size + i * ENTRY.size)
+
+    def slug_at(self, i: int) -> bytes:
+        slug_offset, slug_length, _, _ = self.entry(i)
+        start = self.slugs_offset + slug_offset
+        return self.mm[start : start + slug_length]
+
+    def find(self, slug: str) -> Optional[int]:
+        """Return the index position of slug, by binary search, or None."""
+        target = slug.encode()
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.slug_at(mid) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.count and self.slug_at(lo) == target:
+            return lo
+        return None
+
+    def record_at(self, i: int) -> tuple[str, int, int]:
+        """Return a record's kind and the offset and length of its fields."""
+        _, _, record_offset, _ = self.entry(i)
+        start = self.records_offset + record_offset
+        (meta_length,) = LENGTH.unpack_from(self.mm, start + 1)
+        return KINDS[self.mm[start]], start + 1 + LENGTH.size, meta_length
+
+    def description_at(self, meta_start: int, meta_length: int) -> str:
+        start = meta_start + meta_length
+        (length,) = LENGTH.unpack_from(self.mm, start)
+        start += LENGTH.size
+        return self.mm[start : start + length].decode()
+
+    def get(self, slug: str) -> Optional[dict]:
+        """Return the record with slug, or None."""
+        i = self.find(slug)
+        if i is None:
+            return None
+        kind, meta_start, meta_length = self.record_at(i)
+        record = json.loads(self.mm[meta_start : meta_start + meta_length])
+        record.update(
+            kind=kind, slug=slug, description=self.description_at(meta_start, meta_length)
+        )
+        return record
+
+    def description(self, slug: str) -> Optional[str]:
+        """Return just the description of the record with slug, or None."""
+        i = self.find(slug)
+        if i is None:
+            return None
+        _, meta_start, meta_length = self.record_at(i)
+        return self.description_at(meta_start, meta_length)
+
+    def slugs(self) -> Iterator[str]:
+        """Yield every slug, in sorted order."""
+        for i in range(self.count):
+            yield self.slug_at(i).decode()
@@ -0,0 +1,220 @@
+"""
+The SQLite output: sync the parsed book into the database at parser.DBNAME.
+
+Kept out of parser.py so that SQLAlchemy and the models are only imported
+when this output is chosen.
+"""
+from collections import defaultdict
+from typing import Optional
+
+from sqlalchemy import JSON, create_engine, select  # type: ignore
+from sqlalchemy.orm import sessionmaker  # type: ignore
+
+from . import parser
+from .database import DB, Base, add_missing_columns, set_sqlite_pragmas  # type: ignore
+from .hashing import BuildHashes
+from .models import PeakModel, RegionModel  # type: ignore
+from .profiling import PROFILER
+from .search import create_fts
+from .stats import has_region_stats, refresh_region_stats
+from .sync import TABLES, SqliteSync
+
+# Columns each database sets for itself rather than copying on merge.
+OWN_COLUMNS = ("id", "created", "last_modified")
+
+
+def open_database(path: Optional[str] = None, pragmas: Optional[dict] = None):
+    """
+    Return an engine for the database at path, by default parser.DBNAME
+    with the output suffix, creating or updating its tables. Each
+    connection runs pragmas, by default parser.SQLITE_PRAGMAS.
+    """
+    path = path or parser.output_path(parser.DBNAME)
+    db_engine = DB(dbtype=parser.DBTYPE, dbname=path).create_db_engine()
+    set_sqlite_pragmas(db_engine, parser.SQLITE_PRAGMAS if pragmas is None else pragmas)
+    Base.metadata.create_all(db_engine)
+    for column in add_missing_columns(db_engine, Base.metadata):
+        print(f"Added column {column}\n")
+
+    return db_engine
+
+
+def output_sqlite(
+    workers: int = 1,
+    use_cache: bool = True,
+    batch_size: int = parser.SQLITE_BATCH_SIZE,
+    engine: str = "tree",
+    fts: bool = False,
+    dedupe: bool = False,
+):
+    """
+    Parse and sync to SQLite, only writing rows that changed. With fts, also
+    build the full-text search index if the database doesn't have it yet.
+    """
+
+    # Set up database.
+    db_engine = open_database()
+
+    # For each region, sync all peaks, routes and passes against the rows
+    # already in the database, matching on their stable IDs. Rows are written
+    # in batches as regions are parsed, so only one chapter is held in memory,
+    # and everything is committed in one transaction.
+    with db_engine.connect() as connection:
+        transaction = connection.begin()
+        with PROFILER.timer("sqlite.load_existing"):
+            sync = SqliteSync(connection, batch_size)
+        hashes, candidates = BuildHashes(), [] if dedupe else None
+        for region in parser.iter_regions(workers, use_cache, engine, dedupe, hashes, candidates):
+            print(f"Processing {region.name}\n")
+            with PROFILER.timer("sqlite.sync"):
+                sync.sync_region(region)
+
+        # Anything not seen in this run has been removed from the book.
+        with PROFILER.timer("sqlite.delete_stale"):
+            sync.delete_stale()
+
+        # Rebuilt only when something changed, so an unchanged book leaves
+        # the database untouched.
+        if sync.changed or not has_region_stats(connection):
+            with PROFILER.timer("sqlite.stats"):
+                refresh_region_stats(connection)
+
+        # Built after the sync, so a new index is filled in one pass rather
+        # than row by row. Its triggers keep it current on later runs.
+        if fts:
+            with PROFILER.timer("sqlite.fts"):
+                created = create_fts(connection)
+            if created:
+                print(f"Built full-text indexes: {', '.join(created)}\n")
+        with PROFILER.timer("sqlite.commit"):
+            transaction.commit()
+    parser.write_build_outputs(hashes, candidates)
+    print(f"Synced: {sync.summary()}\n")
+    for name, n in sync.counts.items():
+        PROFILER.count(f"sqlite.{name}", n)
+
+    with PROFILER.timer("sqlite.diagnostics"):
+        print_sqlite_diagnostics(db_engine)
+
+
+def print_sqlite_diagnostics(engine):
+    """
+    Print a few peaks and regions read back from the database, as far as it
+    has them: a shard's may hold few peaks, or none.
+    """
+    Session = sessionmaker(bind=engine)
+    session = Session()
+
+    first_peak = session.query(PeakModel).first()
+    if first_peak is None:
+        print("The database has no peaks.\n")
+    else:
+        print_peak_diagnostics(session, first_peak)
+
+    regions_db = session.query(RegionModel).all()
+    print(f"Regions are: {regions_db}\n")
+    if regions_db and regions_db[0].peaks:
+        print(f"First region and peak are: {regions_db[0].peaks[0]}\n")
+    if regions_db and regions_db[0].passes:
+        print(f"First region and pass are: {regions_db[0].passes[0]}\n")
+    session.close()
+
+
+def print_peak_diagnostics(session, first_peak):
+    """Print the first peak, and the third from the last, or the last if there are fewer."""
+    latest = session.query(PeakModel).order_by(PeakModel.id.desc())
+    last_peak = latest.offset(2).first() or latest.first()
+    print(f"Fetching the first peak:\n{first_peak}")
+    print(f"Fetching the third from the last peak:\n{last_peak}")
+    print(
+        f"\nShowing more data about {last_peak.name}\n           id: {last_peak.id}\n          "
+        f" created: {last_peak.created}\n           last_modified: {last_peak.last_modified}\n     "
+        f"      peak_id: {last_peak.peak_id}\n           aka: {last_peak.aka}\n          "
+        f" elevations: {last_peak.elevations}\n           description: {last_peak.description}\n   "
+        f"        location_description: {last_peak.location_description}\n          "
+        f" gps_coordinates: {last_peak.gps_coordinates}\n           utm_coordinates:"
+        f" {last_peak.utm_coordinates}\n           slug: {last_peak.slug}\n           region:"
+        f" {last_peak.region}\n           routes: {last_peak.routes}\n           "
+    )
+
+
+def read_shard(path: str) -> dict:
+    """Read every row of a shard's database, grouped under their parent's id."""
+    shard_engine = create_engine(f"sqlite:///{path}")
+    regions, peaks, routes, passes = (table for table, _ in TABLES)
+    rows: dict = dict(regions=[], peaks=defaultdict(list), routes=defaultdict(list))
+    rows["passes"] = defaultdict(list)
+    with shard_engine.connect() as connection:
+        for row in connection.execute(select(regions).order_by(regions.c.id)).mappings():
+            rows["regions"].append(dict(row))
+        for name, table, parent in (
+            ("peaks", peaks, "region_id"),
+            ("routes", routes, "peak_id"),
+            ("passes", passes, "region_id"),
+        ):
+            for row in connection.execute(select(table).order_by(table.c.id)).mappings():
+                rows[name][row[parent]].append(dict(row))
+    shard_engine.dispose()
+    return rows
+
+
+def copied(table, row: dict, **foreign_keys) -> dict:
+    """
+    Return the columns of a shard's row to write to the merged database. A
+    JSON column that's NULL in the shard, e.g. a pass's aka from before it
+    was written, is copied as the empty list a fresh build writes, rather
+    than as the JSON 'null'.
+    """
+    columns = {k: v for k, v in row.items() if k not in OWN_COLUMNS}
+    for column in table.columns:
+        if isinstance(column.type, JSON) and columns.get(column.name, []) is None:
+            columns[column.name] = []
+    columns.update(foreign_keys)
+    return columns
+
+
+def merge_sqlite(
+    paths: list[str], db_engine, batch_size: int = parser.SQLITE_BATCH_SIZE, fts: bool = False
+) -> SqliteSync:
+    """
+    Sync the rows of the shard databases at paths into db_engine, as one
+    unsharded run would. Rows are matched on their stable IDs, and the
+    shards' own row ids are remapped to the merged ones. Regions are
+    written in name order, so the result doesn't depend on the split.
+    """
+    regions, peaks, routes, passes = (table for table, _ in TABLES)
+    shards = [read_shard(path) for path in paths]
+    ordered = sorted(
+        ((i, region) for i, shard in enumerate(shards) for region in shard["regions"]),
+        key=lambda item: (item[1]["name"], item[1]["region_id"], item[0]),
+    )
+
+    with db_engine.connect() as connection:
+        transaction = connection.begin()
+        sync = SqliteSync(connection, batch_size)
+        for i, region in ordered:
+            shard = shards[i]
+            row_id = sync.upsert(regions, region["region_id"], copied(regions, region))
+            for peak in shard["peaks"][region["id"]]:
+                peak_row_id = sync.upsert(
+                    peaks, peak["peak_id"], copied(peaks, peak, region_id=row_id)
+                )
+                for route in shard["routes"][peak["id"]]:
+                    sync.upsert(
+                        routes, route["route_id"], copied(routes, route, peak_id=peak_row_id)
+                    )
+            for mountain_pass in shard["passes"][region["id"]]:
+                sync.upsert(
+                    passes,
+                    mountain_pass["pass_id"],
+                    copied(passes, mountain_pass, region_id=row_id),
+                )
+        sync.delete_stale()
+        if sync.changed or not has_region_stats(connection):
+            refresh_region_stats(connection)
+        if fts:
+            created = create_fts(connection)
+            if created:
+                print(f"Built full-text indexes: {', '.join(created)}\n")
+        transaction.commit()
+    return sync
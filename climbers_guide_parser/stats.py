@@ -0,0 +1,193 @@
+"""
+Per-region statistics, kept in the region_stats table.
+
+The table is rebuilt from the peaks, routes and passes tables with a few
+INSERT ... SELECT statements after they are synced, so a dashboard reads a
+region's class histogram, counts and each peak's hardest and easiest route
+with one indexed query instead of scanning its routes.
+"""
+from typing import Iterable, Optional
+
+from sqlalchemy import func, literal, or_, select  # type: ignore
+
+from .models import (  # type: ignore
+    PassModel,
+    PeakModel,
+    RegionModel,
+    RegionStatModel,
+    RouteModel,
+)
+
+STATS = RegionStatModel.__table__
+REGIONS = RegionModel.__table__
+PEAKS = PeakModel.__table__
+ROUTES = RouteModel.__table__
+PASSES = PassModel.__table__
+
+
+def count_statements(region_rows) -> list:
+    """
+    INSERT ... SELECT statements counting the peaks, passes and routes of
+    the regions in region_rows, and their routes per class_grade.
+    """
+    routes = ROUTES.join(PEAKS, ROUTES.c.peak_id == PEAKS.c.id)
+    count = func.count()
+    statements = [
+        STATS.insert().from_select(["region_id", "stat", "count"], statement)
+        for statement in (
+            select(PEAKS.c.region_id, literal("peaks"), count)
+            .where(PEAKS.c.region_id.in_(region_rows))
+            .group_by(PEAKS.c.region_id),
+            select(PASSES.c.region_id, literal("passes"), count)
+            .where(PASSES.c.region_id.in_(region_rows))
+            .group_by(PASSES.c.region_id),
+            select(PEAKS.c.region_id, literal("routes"), count)
+            .select_from(routes)
+            .where(PEAKS.c.region_id.in_(region_rows))
+            .group_by(PEAKS.c.region_id),
+        )
+    ]
+    by_class = (
+        select(PEAKS.c.region_id, literal("routes_by_class"), ROUTES.c.class_grade, count)
+        .select_from(routes)
+        .where(PEAKS.c.region_id.in_(region_rows))
+        .group_by(PEAKS.c.region_id, ROUTES.c.class_grade)
+    )
+    statements.append(
+        STATS.insert().from_select(["region_id", "stat", "class_grade", "count"], by_class)
+    )
+    return statements
+
+
+def route_statements(region_rows) -> list:
+    """
+    INSERT ... SELECT statements for the hardest and easiest rated route of
+    each peak in the regions in region_rows. Ties go to the earlier route.
+    """
+    grade = ROUTES.c.class_grade
+    ranked = (
+        select(
+            PEAKS.c.region_id,
+            ROUTES.c.peak_id,
+            ROUTES.c.id.label("route_id"),
+            grade,
+            func.row_number()
+            .over(partition_by=ROUTES.c.peak_id, order_by=(grade.desc(), ROUTES.c.id))
+            .label("hardest"),
+            func.row_number()
+            .over(partition_by=ROUTES.c.peak_id, order_by=(grade, ROUTES.c.id))
+            .label("easiest"),
+        )
+        .select_from(ROUTES.join(PEAKS, ROUTES.c.peak_id == PEAKS.c.id))
+        .where(PEAKS.c.region_id.in_(region_rows), grade.is_not(None))
+        .subquery()
+    )
+    columns = ["region_id", "stat", "class_grade", "peak_id", "route_id"]
+    return [
+        STATS.insert().from_select(
+            columns,
+            select(
+                ranked.c.region_id,
+                literal(f"{stat}_route"),
+                ranked.c.class_grade,
+                ranked.c.peak_id,
+                ranked.c.route_id,
+            ).where(ranked.c[stat] == 1),
+        )
+        for stat in ("hardest", "easiest")
+    ]
+
+
+def refresh_region_stats(connection, region_ids: Optional[Iterable[str]] = None) -> int:
+    """
+    Rebuild the stats of the regions with the given stable IDs, or of every
+    region, dropping those of regions no longer in the database. Returns the
+    number of rows written.
+    """
+    region_rows = select(REGIONS.c.id)
+    if region_ids is not None:
+        region_rows = region_rows.where(REGIONS.c.region_id.in_(list(region_ids)))
+    connection.execute(
+        STATS.delete().where(
+            or_(STATS.c.region_id.in_(region_rows), STATS.c.region_id.not_in(select(REGIONS.c.id)))
+        )
+    )
+    written = 0
+    for statement in count_statements(region_rows) + route_statements(region_rows):
+        written += connection.execute(statement).rowcount
+
+    return written
+
+
+def has_region_stats(connection) -> bool:
+    return connection.execute(select(STATS.c.id).limit(1)).first() is not None
+
+
+def region_stats(connection, region_slug: str) -> Optional[dict]:
+    """
+    Return the stats of the region with region_slug, or None if there's no
+    such region: its peak, pass and route counts, routes per class (None
+    for those whose rating names no class), and each peak's hardest and
+    easiest rated route. They are read in one query, through the slug and
+    region_id, stat indexes.
+    """
+    statement = (
+        select(
+            REGIONS.c.region_id,
+            REGIONS.c.name,
+            REGIONS.c.slug,
+            STATS.c.stat,
+            STATS.c.class_grade,
+            STATS.c.count,
+            PEAKS.c.name.label("peak"),
+            PEAKS.c.slug.label("peak_slug"),
+            ROUTES.c.name.label("route"),
+            ROUTES.c.slug.label("route_slug"),
+            ROUTES.c.class_rating,
+        )
+        .select_from(
+            REGIONS.outerjoin(STATS, STATS.c.region_id == REGIONS.c.id)
+            .outerjoin(PEAKS, STATS.c.peak_id == PEAKS.c.id)
+            .outerjoin(ROUTES, STATS.c.route_id == ROUTES.c.id)
+        )
+        .where(REGIONS.c.slug == region_slug)
+        .order_by(REGIONS.c.id, STATS.c.stat, STATS.c.class_grade, STATS.c.peak_id)
+    )
+    rows = connection.execute(statement).mappings().all()
+    if not rows:
+        return None
+
+    region_id = rows[0]["region_id"]
+    stats: dict = dict(
+        region_id=region_id,
+        name=rows[0]["name"],
+        slug=rows[0]["slug"],
+        peaks=0,
+        passes=0,
+        routes=0,
+        routes_by_class=[],
+        hardest_routes=[],
+        easiest_routes=[],
+    )
+    for row in rows:
+        if row["region_id"] != region_id or row["stat"] is None:
+            continue
+        if row["stat"] in ("peaks", "passes", "routes"):
+            stats[row["stat"]] = row["count"]
+        elif row["stat"] == "routes_by_class":
+            stats["routes_by_class"].append(
+                dict(class_grade=row["class_grade"], routes=row["count"])
+            )
+        else:
+            stats[f"{row['stat']}s"].append(
+                dict(
+                    peak=row["peak"],
+                    peak_slug=row["peak_slug"],
+                    route=row["route"],
+                    route_slug=row["route_slug"],
+                    class_rating=row["class_rating"],
+                    class_grade=row["class_grade"],
+                )
+            )
+
+    return stats
@@ -0,0 +1,367 @@
+"""
+Read API over the database written by --sqlite.
+
+    store = GuideStore.open("babble.sqlite")
+    peak = store.get_by_slug("mount-sill-1a2b3c4d5e6f")
+    for route in store.routes_for_peak(peak.slug):
+        ...
+
+Rows are returned as the parser's own Peak, Route, Pass and Region
+dataclasses. Each lookup is one indexed query plus one select-in query per
+level of children, never one per row, and the results are kept in a bounded
+LRU cache. Records are shared between callers, so treat them as read-only.
+"""
+import os
+from typing import Any, Hashable, List, Optional, Union
+
+from sqlalchemy import create_engine, func, select, text  # type: ignore
+from sqlalchemy.orm import (  # type: ignore
+    Session,
+    configure_mappers,
+    joinedload,
+    selectinload,
+)
+from sqlalchemy.pool import QueuePool  # type: ignore
+
+from .cache import LRUCache
+from .models import PassModel, PeakModel, RegionModel, RouteModel  # type: ignore
+from .parser import DBNAME, TIMESTAMP_FORMAT, Pass, Peak, Region, Route
+from .stats import region_stats
+
+Record = Union[Peak, Route, Pass, Region]
+
+MODELS = {
+    "peak": PeakModel,
+    "route": RouteModel,
+    "pass": PassModel,
+    "region": RegionModel,
+}
+
+CACHE_SIZE = 1024
+
+
+def load_options(kind: str) -> tuple:
+    """
+    Eager loading for each kind, so a record's children and parent arrive in
+    a fixed number of queries. The backref attributes only exist once the
+    mappers are configured.
+    """
+    configure_mappers()
+    if kind == "peak":
+        return selectinload(PeakModel.routes), joinedload(PeakModel.region)
+    if kind == "route":
+        return (joinedload(RouteModel.peaks),)
+    if kind == "pass":
+        return (joinedload(PassModel.region),)
+    return (
+        selectinload(RegionModel.peaks).selectinload(PeakModel.routes),
+        selectinload(RegionModel.peaks).joinedload(PeakModel.region),
+        selectinload(RegionModel.passes).joinedload(PassModel.region),
+    )
+
+
+def read_only_engine(path: str, pool_size: int = 8):
+    """
+    Return an engine opening path read-only, keeping up to pool_size
+    connections open for reuse across threads.
+    """
+    return create_engine(
+        f"sqlite:///file:{path}?mode=ro&uri=true",
+        poolclass=QueuePool,
+        pool_size=pool_size,
+        max_overflow=0,
+        connect_args=dict(check_same_thread=False),
+    )
+
+
+def timestamp(value) -> str:
+    return value.strftime(TIMESTAMP_FORMAT) if value else ""
+
+
+def to_peak(row: PeakModel) -> Peak:
+    region = row.region
+    peak = Peak(
+        created=timestamp(row.created),
+        last_modified=timestamp(row.last_modified),
+        peak_id=row.peak_id,
+        name=row.name,
+        aka=row.aka or [],
+        elevations=row.elevations or [],
+        elevation_feet=row.elevation_feet,
+        elevation_lower_bound=bool(row.elevation_lower_bound),
+        elevation_map_derived=bool(row.elevation_map_derived),
+        description=row.description or "",
+        location_description=row.location_description or "",
+        gps_coordinates=row.gps_coordinates or "",
+        utm_coordinates=row.utm_coordinates or "",
+        slug=row.slug or "",
+        content_hash=row.content_hash or "",
+        region=region.name if region else "",
+        region_slug=region.slug if region else "",
+    )
+    peak.routes = [to_route(route, row.peak_id) for route in sorted(row.routes, key=lambda r: r.id)]
+
+    return peak
+
+
+def to_route(row: RouteModel, peak_id: str) -> Route:
+    return Route(
+        created=timestamp(row.created),
+        last_modified=timestamp(row.last_modified),
+        route_id=row.route_id,
+        name=row.name or "",
+        aka=row.aka or [],
+        peak_id=peak_id,
+        class_rating=row.class_rating or "",
+        class_grade=row.class_grade,
+        description=row.description or "",
+        slug=row.slug or "",
+        content_hash=row.content_hash or "",
+    )
+
+
+def to_pass(row: PassModel) -> Pass:
+    region = row.region
+    return Pass(
+        created=timestamp(row.created),
+        last_modified=timestamp(row.last_modified),
+        pass_id=row.pass_id,
+        name=row.name,
+        aka=row.aka or [],
+        class_rating=row.class_rating or "",
+        class_grade=row.class_grade,
+        elevations=row.elevations or [],
+        elevation_feet=row.elevation_feet,
+        elevation_lower_bound=bool(row.elevation_lower_bound),
+        elevation_map_derived=bool(row.elevation_map_derived),
+        description=row.description or "",
+        slug=row.slug or "",
+        content_hash=row.content_hash or "",
+        region=region.name if region else "",
+        region_slug=region.slug if region else "",
+    )
+
+
+def to_region(row: RegionModel) -> Region:
+    region = Region(
+        created=timestamp(row.created),
+        last_modified=timestamp(row.last_modified),
+        region_id=row.region_id,
+        name=row.name,
+        slug=row.slug or "",
+        content_hash=row.content_hash or "",
+    )
+    region.peaks = [to_peak(peak) for peak in sorted(row.peaks, key=lambda p: p.id)]
+    region.passes = [to_pass(p) for p in sorted(row.passes, key=lambda p: p.id)]
+
+    return region
+
+
+def to_record(kind: str, row) -> Record:
+    """Convert a row of the given kind, with its relationships loaded, to a record."""
+    if kind == "route":
+        return to_route(row, row.peaks.peak_id)
+    return {"peak": to_peak, "pass": to_pass, "region": to_region}[kind](row)
+
+
+class GuideStore:
+    """
+    Look up peaks, routes, passes and regions by slug or name, with a bounded
+    LRU cache of the records already built.
+    """
+
+    def __init__(self, engine, cache_size: int = CACHE_SIZE, path: Optional[str] = None):
+        self.engine = engine
+        self.cache = LRUCache(cache_size)
+        self.path = path
+        self.version = self.database_version()
+
+    @classmethod
+    def open(
+        cls, path: str = DBNAME, cache_size: int = CACHE_SIZE, pool_size: int = 0
+    ) -> "GuideStore":
+        """
+        Open the SQLite database at path. With a pool_size, it is opened
+        read-only with that many pooled connections, for use across threads.
+        """
+        if pool_size:
+            return cls(read_only_engine(path, pool_size), cache_size, path)
+        return cls(create_engine(f"sqlite:///{path}"), cache_size, path)
+
+    def database_version(self) -> Optional[tuple]:
+        """The size and mtime of the database file and its write-ahead log."""
+        if self.path is None:
+            return None
+        version = []
+        for path in (self.path, self.path + "-wal"):
+            try:
+                stat = os.stat(path)
+                version.append((stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                version.append(None)
+        return tuple(version)
+
+    def refresh(self) -> bool:
+        """Empty the cache if the database has been written since it was filled."""
+        version = self.database_version()
+        if version == self.version:
+            return False
+        self.cache.clear()
+        self.version = version
+        return True
+
+    def close(self):
+        self.cache.clear()
+        self.engine.dispose()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def cached(self, key: Hashable, load) -> Any:
+        value = self.cache.get_or_load(key, load)
+        # Lists are copied so a caller can't change what's cached.
+        return list(value) if isinstance(value, list) else value
+
+    def fetch(self, kind: str, statement) -> List[Record]:
+        """Run a select of MODELS[kind] with its eager loading, returning records."""
+        statement = statement.options(*load_options(kind))
+        with Session(self.engine) as session:
+            rows = session.execute(statement).unique().scalars().all()
+            return [to_record(kind, row) for row in rows]
+
+    def get_by_slug(self, slug: str, kind: str = "peak") -> Optional[Record]:
+        """Return the record of the given kind with slug, or None."""
+        model = MODELS[kind]
+
+        def load():
+            records = self.fetch(kind, select(model).where(model.slug == slug).limit(1))
+            return records[0] if records else None
+
+        return self.cached(("slug", kind, slug), load)
+
+    def get_by_name(self, name: str, kind: str = "peak") -> List[Record]:
+        """
+        Return the records of the given kind named name, or with name among
+        their aka names. Names are matched through their index; aka lists are
+        JSON, so matching them reads each non-empty list.
+        """
+        model = MODELS[kind]
+
+        def load():
+            statement = select(model).where(model.name == name).order_by(model.id)
+            records = self.fetch(kind, statement)
+            if hasattr(model, "aka"):
+                table = model.__tablename__
+                alias = text(
+                    f"{table}.aka != '[]' AND EXISTS (SELECT 1 FROM json_each({table}.aka)"
+                    " WHERE json_each.value = :name)"
+                ).bindparams(name=name)
+                statement = select(model).where(model.name != name, alias).order_by(model.id)
+                records += self.fetch(kind, statement)
+            return records
+
+        return self.cached(("name", kind, name), load)
+
+    def peaks_in_region(self, region_slug: str) -> List[Peak]:
+        """Return the peaks in the region with region_slug, with their routes."""
+
+        def load():
+            statement = (
+                select(PeakModel)
+                .join(RegionModel, PeakModel.region_id == RegionModel.id)
+                .where(RegionModel.slug == region_slug)
+                .order_by(PeakModel.id)
+            )
+            return self.fetch("peak", statement)
+
+        return self.cached(("peaks_in_region", region_slug), load)
+
+    def routes_for_peak(self, peak_slug: str) -> List[Route]:
+        """Return the routes up the peak with peak_slug."""
+        peak = self.get_by_slug(peak_slug, "peak")
+        return list(peak.routes) if peak else []
+
+    def page_statement(self, kind: str, region_slug: Optional[str]):
+        model = MODELS[kind]
+        statement = select(model)
+        if region_slug is not None:
+            statement = statement.join(RegionModel, model.region_id == RegionModel.id).where(
+                RegionModel.slug == region_slug
+            )
+        return statement
+
+    def page(
+        self, kind: str, offset: int = 0, limit: int = 100, region_slug: Optional[str] = None
+    ) -> tuple[List[Record], int]:
+        """
+        Return one page of the peaks or passes, optionally only those in the
+        region with region_slug, in book order, and how many there are in all.
+        """
+        model = MODELS[kind]
+
+        def load():
+            statement = self.page_statement(kind, region_slug)
+            records = self.fetch(kind, statement.order_by(model.id).offset(offset).limit(limit))
+            with self.engine.connect() as connection:
+                total = connection.execute(
+                    select(func.count()).select_from(statement.subquery())
+                ).scalar()
+            return records, total
+
+        records, total = self.cache.get_or_load(("page", kind, region_slug, offset, limit), load)
+        return list(records), total
+
+    def regions(self) -> List[dict]:
+        """Return each region's ID, name, slug, timestamps and peak and pass counts."""
+
+        def load():
+            peaks = (
+                select(PeakModel.region_id, func.count().label("n"))
+                .group_by(PeakModel.region_id)
+                .subquery()
+            )
+            passes = (
+                select(PassModel.region_id, func.count().label("n"))
+                .group_by(PassModel.region_id)
+                .subquery()
+            )
+            statement = (
+                select(
+                    RegionModel,
+                    func.coalesce(peaks.c.n, 0).label("peaks"),
+                    func.coalesce(passes.c.n, 0).label("passes"),
+                )
+                .outerjoin(peaks, peaks.c.region_id == RegionModel.id)
+                .outerjoin(passes, passes.c.region_id == RegionModel.id)
+                .order_by(RegionModel.id)
+            )
+            with Session(self.engine) as session:
+                return [
+                    dict(
+                        created=timestamp(region.created),
+                        last_modified=timestamp(region.last_modified),
+                        region_id=region.region_id,
+                        name=region.name,
+                        slug=region.slug,
+                        peaks=n_peaks,
+                        passes=n_passes,
+                    )
+                    for region, n_peaks, n_passes in session.execute(statement)
+                ]
+
+        return self.cached(("regions",), load)
+
+    def region_stats(self, region_slug: str) -> Optional[dict]:
+        """
+        Return the precomputed stats of the region with region_slug, or None:
+        counts, routes per class, and each peak's hardest and easiest route.
+        """
+
+        def load():
+            with self.engine.connect() as connection:
+                return region_stats(connection, region_slug)
+
+        return self.cached(("region_stats", region_slug), load)
@@ -0,0 +1,276 @@
+"""
+Single-traversal chapter parser.
+
+get_peaks() finds every peak and then walks each one's following siblings,
+get_passes() makes another scan from the "Passes" <h4>, and a paragraph's
+text is recomputed for its first word, its description and each split on
+".". This engine instead walks the children of the chapter body once, as a
+stream of events, computing each paragraph's text a single time. It gives
+the same records as the tree functions, including the IDs, which depend on
+the order names are seen in.
+
+Like the tree functions' sibling walks, it expects a flat chapter, with the
+peak, route and pass paragraphs directly inside <body>.
+"""
+import re
+import sys
+from typing import Iterator, Optional, Union
+
+from bs4 import BeautifulSoup, CData, NavigableString, Tag  # type: ignore
+
+from .parser import (
+    PARSE_ERRORS,
+    UNPREFIXED_ROUTE_PATTERN,
+    Pass,
+    Peak,
+    Region,
+    Route,
+    get_region,
+    make_slug,
+    parse_class_rating,
+)
+from .parser import quarantine as quarantine_record
+from .parser import (
+    run_timestamp,
+    set_numeric_elevation,
+    split_name_elevation_and_description,
+    stable_id,
+)
+
+# The string types get_text() includes.
+TEXT_TYPES = (NavigableString, CData)
+PASSES_HEADING = re.compile(r"passes", re.IGNORECASE)
+
+Event = tuple[str, Union[Region, Peak, Route, Pass]]
+
+
+class Paragraph:
+    """
+    A tag's text, computed once: the whole text, as tag.text gives it, and
+    the text of the first <i> (tag.i) and of everything else, as tag.text
+    gives it once tag.i is extracted.
+    """
+
+    __slots__ = ("tag", "i", "text", "i_text", "rest")
+
+    def __init__(self, tag: Tag):
+        self.tag = tag
+        self.i: Optional[Tag] = None
+        text: list[str] = []
+        i_text: list[str] = []
+        rest: list[str] = []
+        self.collect(tag, text, i_text, rest, False)
+        self.text = "".join(text)
+        self.i_text = "".join(i_text)
+        self.rest = "".join(rest)
+
+    def collect(self, node: Tag, text: list, i_text: list, rest: list, in_i: bool):
+        for child in node.children:
+            if isinstance(child, Tag):
+                if self.i is None and child.name == "i":
+                    self.i = child
+                    self.collect(child, text, i_text, rest, True)
+                else:
+                    self.collect(child, text, i_text, rest, in_i)
+            elif type(child) in TEXT_TYPES:
+                text.append(child)
+                (i_text if in_i else rest).append(child)
+
+
+def is_skipped(name: str) -> bool:
+    """Returns true for the References and Photographs entries that aren't records."""
+    return "References" in name or "Photographs" in name
+
+
+def start_peak(para: Paragraph, region: Region) -> Peak:
+    """parse_peak() up to the sibling walk."""
+    name, elevations, location_description = split_name_elevation_and_description(para.text)
+    uid = stable_id(region.issued_ids, region.region_id, "peaks", name)
+    peak = Peak(peak_id=uid, created=run_timestamp(), last_modified=run_timestamp())
+    peak.name = name
+    peak.elevations = elevations
+    set_numeric_elevation(peak, elevations)
+    peak.location_description = location_description
+    peak.slug = make_slug(f'{peak.name} {peak.peak_id.split("-")[-1]}')
+    peak.region = region.name
+    peak.region_slug = region.slug
+
+    return peak
+
+
+def make_route(para: Paragraph, peak: Peak, kind: str) -> Route:
+    """
+    parse_route() on a computed paragraph. A "Route" with an <i> has the
+    <i> extracted from the tree, as parse_route() does.
+    """
+    route = Route(route_id="", created=run_timestamp(), last_modified=run_timestamp())
+
+    text = para.text
+    if kind == "Route" and para.i is not None:
+        name_tag = para.i.extract()
+        parsed_route_name = name_tag.string
+        if parsed_route_name:
+            route.name = parsed_route_name.strip(" .,")
+        name_tag.decompose()
+        text = para.rest
+    elif kind == "Class":
+        route.name = "Route 1"
+
+    parts = text.split(".", 1)
+    route.class_rating = sys.intern(parts[0].strip())
+    route.class_grade = parse_class_rating(route.class_rating)
+    route.description = parts[1].strip()
+    route.route_id = stable_id({r.route_id for r in peak.routes}, peak.peak_id, route.name)
+    route.slug = make_slug(f'{route.name} {route.route_id.split("-")[-1]}')
+    route.peak_id = peak.peak_id
+
+    return route
+
+
+def make_pass(para: Paragraph, region: Region) -> Pass:
+    """
+    pass_parser() on a computed paragraph, decomposing its <i> from the tree
+    as pass_parser() does.
+    """
+    mountain_pass = Pass(pass_id="", created=run_timestamp(), last_modified=run_timestamp())
+    location_description = ""
+
+    text = para.text
+    if para.i is not None:
+        name, elevations, location_description = split_name_elevation_and_description(para.i_text)
+        para.i.decompose()
+        mountain_pass.elevations = elevations
+        set_numeric_elevation(mountain_pass, elevations)
+        mountain_pass.name = name
+        text = para.rest
+
+    parts = text.split(".", 1)
+    mountain_pass.class_rating = sys.intern(parts[0].strip())
+    mountain_pass.class_grade = parse_class_rating(mountain_pass.class_rating)
+    mountain_pass.description = parts[1].strip()
+    mountain_pass.location_description = location_description
+    mountain_pass.pass_id = stable_id(
+        region.issued_ids, region.region_id, "passes", mountain_pass.name
+    )
+    mountain_pass.slug = make_slug(f'{mountain_pass.name} {mountain_pass.pass_id.split("-")[-1]}')
+    mountain_pass.region = region.name
+    mountain_pass.region_slug = region.slug
+
+    region.passes.append(mountain_pass)
+
+    return mountain_pass
+
+
+def iter_events(soup: BeautifulSoup, source: str = "", quarantine: bool = False) -> Iterator[Event]:
+    """
+    Walk the chapter once, yielding ("region", Region) first, then
+    ("route", Route) as each route is parsed, ("peak", Peak) once a peak's
+    routes and description are complete, and ("pass", Pass) as each pass is
+    parsed. References and Photographs entries are parsed, as they are by
+    the tree functions, but not yielded. source scopes the IDs, as for
+    get_region(). With quarantine, records that fail to parse are listed in
+    the region's quarantined rather than raising.
+    """
+    region = get_region(soup, source)
+    if quarantine:
+        region.quarantined = []
+    yield "region", region
+
+    peak: Optional[Peak] = None
+    description: list[str] = []
+    in_passes = False
+    passes_done = False
+
+    def finish_peak() -> Optional[Peak]:
+        if peak is None or is_skipped(peak.name):
+            return None
+        peak.description += "".join(description)
+        region.peaks.append(peak)
+        return peak
+
+    for child in (soup.body or soup).children:
+        if not isinstance(child, Tag):
+            continue
+        para: Optional[Paragraph] = None
+
+        # The peak walk, as in parse_peak(): a new peak or the end of the
+        # chapter finishes the current one.
+        classes = child.attrs.get("class")
+        if classes is not None and "peak" in classes:
+            done = finish_peak()
+            if done:
+                yield "peak", done
+            para = Paragraph(child)
+            description = []
+            try:
+                peak = start_peak(para, region)
+            except PARSE_ERRORS as e:
+                quarantine_record(region, "peak", child, e)
+                peak = None  # Its routes are left out with it, as by parse_peak().
+        elif classes is None and child.attrs.get("clear") == "all":
+            done = finish_peak()
+            if done:
+                yield "peak", done
+            peak = None
+        elif peak is not None:
+            para = Paragraph(child)
+            first_word = para.text.strip().split(" ")[0].strip()
+            kind = first_word if first_word in ("Route", "Class") else None
+            if kind is None and para.i is not None:
+                i_string = para.i.string
+                if i_string is not None and UNPREFIXED_ROUTE_PATTERN.match(i_string):
+                    kind = "Route"
+
+            if kind is None:
+                description.append(para.text.strip() + "\n")
+            else:
+                try:
+                    route = make_route(para, peak, kind)
+                except PARSE_ERRORS as e:
+                    quarantine_record(region, "route", child, e, peak.name)
+                else:
+                    peak.routes.append(route)
+                    if not is_skipped(peak.name):
+                        yield "route", route
+                if kind == "Route" and para.i is not None:
+                    para = None  # Its <i> is gone, so compute it afresh.
+
+        # The passes section, as in iter_passes(): the first "Passes" <h4>
+        # up to the next <h4>.
+        if child.name == "h4":
+            if in_passes:
+                in_passes, passes_done = False, True
+            elif not passes_done and child.string and PASSES_HEADING.search(child.string):
+                in_passes = True
+        elif in_passes and child.name == "p":
+            try:
+                mountain_pass = make_pass(para or Paragraph(child), region)
+            except PARSE_ERRORS as e:
+                quarantine_record(region, "pass", child, e)
+                continue
+            if not is_skipped(mountain_pass.name):
+                yield "pass", mountain_pass
+
+    done = finish_peak()
+    if done:
+        yield "peak", done
+
+
+def parse_soup(
+    soup: BeautifulSoup, source: str = "", quarantine: bool = False
+) -> tuple[list[Peak], list[Pass], Region]:
+    """
+    Parse a chapter's soup in one pass and return its peaks, passes and
+    region, as get_region(), get_peaks() and get_passes() would.
+    """
+    peaks: list[Peak] = []
+    passes: list[Pass] = []
+    for kind, record in iter_events(soup, source, quarantine):
+        if kind == "region":
+            region = record
+        elif kind == "peak":
+            peaks.append(record)
+        elif kind == "pass":
+            passes.append(record)
+
+    return peaks, passes, region
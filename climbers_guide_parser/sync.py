@@ -0,0 +1,211 @@
+from collections import Counter
+from datetime import datetime
+from typing import Iterable, Optional
+
+from sqlalchemy import bindparam, func, select  # type: ignore
+
+from .models import PassModel, PeakModel, RegionModel, RouteModel  # type: ignore
+
+# Tables in foreign key order, with the column holding each row's stable ID.
+TABLES = [
+    (RegionModel.__table__, "region_id"),
+    (PeakModel.__table__, "peak_id"),
+    (RouteModel.__table__, "route_id"),
+    (PassModel.__table__, "pass_id"),
+]
+
+# SQLite's default limit on bound parameters is 999.
+MAX_DELETE_PARAMS = 500
+
+
+def region_scopes(region_ids: list[str]) -> dict:
+    """Return, for each table, a condition selecting the rows of the given regions."""
+    regions, peaks, routes, passes = (table for table, _ in TABLES)
+    region_rows = select(regions.c.id).where(regions.c.region_id.in_(region_ids))
+    peak_rows = select(peaks.c.id).where(peaks.c.region_id.in_(region_rows))
+    return {
+        regions: regions.c.region_id.in_(region_ids),
+        peaks: peaks.c.region_id.in_(region_rows),
+        routes: routes.c.peak_id.in_(peak_rows),
+        passes: passes.c.region_id.in_(region_rows),
+    }
+
+
+class SqliteSync:
+    """
+    Bring the database in line with freshly parsed regions, touching only the
+    rows that changed. Rows are matched on their stable IDs (region_id,
+    peak_id, route_id, pass_id): new records are inserted, records whose
+    columns differ are updated, and rows that were not seen in this run are
+    deleted by delete_stale().
+
+    Writes go through SQLAlchemy Core executemany batches of batch_size rows
+    rather than the ORM unit of work. Primary keys for new rows are assigned
+    here, so peaks and routes can point at their region and peak before
+    those have been written.
+
+    With region_ids, only the rows of those regions and their peaks, routes
+    and passes are loaded, and so only they can be deleted as stale. That is
+    how one reparsed chapter is patched in without touching the others.
+    """
+
+    def __init__(
+        self, connection, batch_size: int = 1000, region_ids: Optional[Iterable[str]] = None
+    ):
+        self.connection = connection
+        self.batch_size = batch_size
+        self.existing: dict = {}
+        self.next_id: dict = {}
+        self.seen: dict = {}
+        self.inserts: dict = {}
+        self.updates: dict = {}
+        self.pending = 0
+        self.counts: Counter = Counter()
+
+        scopes = region_scopes(list(region_ids)) if region_ids is not None else {}
+        for table, key in TABLES:
+            query = select(table)
+            if table in scopes:
+                query = query.where(scopes[table])
+            rows = connection.execute(query).mappings()
+            self.existing[table] = {row[key]: dict(row) for row in rows}
+            max_id = connection.execute(select(func.max(table.c.id))).scalar()
+            self.next_id[table] = (max_id or 0) + 1
+            self.seen[table] = set()
+            self.inserts[table] = []
+            self.updates[table] = []
+
+    def upsert(self, table, key: str, columns: dict) -> int:
+        """Queue an insert or update of the row for key, and return its id."""
+        now = datetime.now()
+        row = self.existing[table].get(key)
+        if row is None:
+            row_id = self.next_id[table]
+            self.next_id[table] += 1
+            self.inserts[table].append(dict(columns, id=row_id, created=now, last_modified=now))
+            # A repeated key later in this run then updates the row just queued.
+            self.existing[table][key] = dict(columns, id=row_id)
+            self.counts["inserted"] += 1
+            self.pending += 1
+        else:
+            row_id = row["id"]
+            if any(row[k] != v for k, v in columns.items()):
+                self.updates[table].append(dict(columns, row_id=row_id, last_modified=now))
+                self.counts["updated"] += 1
+                self.pending += 1
+            else:
+                self.counts["unchanged"] += 1
+        self.seen[table].add(key)
+
+        if self.pending >= self.batch_size:
+            self.flush()
+
+        return row_id
+
+    def sync_region(self, region):
+        """Upsert a parsed region along with its peaks, routes and passes."""
+        regions, peaks, routes, passes = (table for table, _ in TABLES)
+        region_id = self.upsert(
+            regions,
+            region.region_id,
+            dict(
+                name=region.name,
+                slug=region.slug,
+                region_id=region.region_id,
+                content_hash=region.content_hash,
+            ),
+        )
+
+        for peak in region.peaks:
+            peak_id = self.upsert(
+                peaks,
+                peak.peak_id,
+                dict(
+                    peak_id=peak.peak_id,
+                    name=peak.name,
+                    aka=peak.aka,
+                    elevations=peak.elevations,
+                    elevation_feet=peak.elevation_feet,
+                    elevation_lower_bound=peak.elevation_lower_bound,
+                    elevation_map_derived=peak.elevation_map_derived,
+                    description=peak.description,
+                    location_description=peak.location_description,
+                    gps_coordinates=peak.gps_coordinates,
+                    utm_coordinates=peak.utm_coordinates,
+                    slug=peak.slug,
+                    content_hash=peak.content_hash,
+                    region_id=region_id,
+                ),
+            )
+
+            for route in peak.routes:
+                self.upsert(
+                    routes,
+                    route.route_id,
+                    dict(
+                        name=route.name,
+                        aka=route.aka,
+                        class_rating=route.class_rating,
+                        class_grade=route.class_grade,
+                        description=route.description,
+                        route_id=route.route_id,
+                        slug=route.slug,
+                        content_hash=route.content_hash,
+                        peak_id=peak_id,
+                    ),
+                )
+
+        for mountain_pass in region.passes:
+            self.upsert(
+                passes,
+                mountain_pass.pass_id,
+                dict(
+                    pass_id=mountain_pass.pass_id,
+                    class_rating=mountain_pass.class_rating,
+                    class_grade=mountain_pass.class_grade,
+                    description=mountain_pass.description,
+                    elevations=mountain_pass.elevations,
+                    elevation_feet=mountain_pass.elevation_feet,
+                    elevation_lower_bound=mountain_pass.elevation_lower_bound,
+                    elevation_map_derived=mountain_pass.elevation_map_derived,
+                    name=mountain_pass.name,
+                    aka=mountain_pass.aka,
+                    slug=mountain_pass.slug,
+                    content_hash=mountain_pass.content_hash,
+                    region_id=region_id,
+                ),
+            )
+
+    def flush(self):
+        """Write the queued inserts and updates, parents first."""
+        for table, _ in TABLES:
+            if self.inserts[table]:
+                self.connection.execute(table.insert(), self.inserts[table])
+                self.inserts[table] = []
+            if self.updates[table]:
+                stmt = table.update().where(table.c.id == bindparam("row_id"))
+                self.connection.execute(stmt, self.updates[table])
+                self.updates[table] = []
+        self.pending = 0
+
+    def delete_stale(self):
+        """Flush, then delete every row that was not seen while syncing."""
+        self.flush()
+        for table, _ in reversed(TABLES):
+            stale = [
+                row["id"] for k, row in self.existing[table].items() if k not in self.seen[table]
+            ]
+            for i in range(0, len(stale), MAX_DELETE_PARAMS):
+                batch = stale[i : i + MAX_DELETE_PARAMS]
+                self.connection.execute(table.delete().where(table.c.id.in_(batch)))
+            self.counts["deleted"] += len(stale)
+
+    @property
+    def changed(self) -> bool:
+        """Whether any row was inserted, updated or deleted."""
+        return any(self.counts[k] for k in ("inserted", "updated", "deleted"))
+
+    def summary(self) -> str:
+        return ", ".join(
+            f"{self.counts[k]} {k}" for k in ("inserted", "updated", "deleted", "unchanged")
+        )
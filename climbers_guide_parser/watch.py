@@ -0,0 +1,229 @@
+"""
+Watch the chapter files and patch the outputs as chapters are edited.
+
+The files are polled for a change in size or modification time, so nothing
+beyond the standard library is needed. An editor may write a file several
+times in one save, so a change is acted on once the file has been quiet
+for DEBOUNCE_SECONDS. Only the changed chapter is reparsed: its region's
+rows are synced into SQLite, scoped so no other region is read or written,
+and the JSON files are rewritten from the other chapters' records as they
+were encoded before.
+"""
+import os
+import threading
+import time
+from typing import Iterable, Iterator, Optional
+
+import click  # type: ignore
+
+from . import parser
+from .hashing import BuildHashes
+from .json_writer import FLUSH_BYTES, JsonArrayWriter, NdjsonWriter
+from .parser import Pass, Peak, Region, json_writer
+from .sqlite_output import open_database
+from .stats import refresh_region_stats
+from .sync import SqliteSync
+
+POLL_SECONDS = 0.1
+DEBOUNCE_SECONDS = 0.25
+
+JSON_KINDS = ("peaks", "passes", "regions")
+
+
+class ChapterWatcher:
+    """Polls files, reporting each change once its writes have settled."""
+
+    def __init__(
+        self,
+        files: Iterable[str],
+        poll_seconds: float = POLL_SECONDS,
+        debounce_seconds: float = DEBOUNCE_SECONDS,
+    ):
+        self.files = list(files)
+        self.poll_seconds = poll_seconds
+        self.debounce_seconds = debounce_seconds
+        self.stats = {file: self.stat(file) for file in self.files}
+
+    @staticmethod
+    def stat(file: str) -> Optional[tuple[int, int]]:
+        try:
+            st = os.stat(file)
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def poll(self) -> list[str]:
+        """Return the files that changed since the last poll."""
+        changed = []
+        for file in self.files:
+            stat = self.stat(file)
+            if stat != self.stats[file]:
+                self.stats[file] = stat
+                changed.append(file)
+        return changed
+
+    def changes(self, stop: Optional[threading.Event] = None) -> Iterator[list[str]]:
+        """
+        Yield lists of changed files, each once it has not changed for
+        debounce_seconds, until stop is set. A file that is missing then,
+        as while an editor replaces it, is left until it is back.
+        """
+        stop = stop or threading.Event()
+        changed_at: dict[str, float] = {}
+        while not stop.is_set():
+            now = time.monotonic()
+            for file in self.poll():
+                changed_at[file] = now
+            settled = [
+                file
+                for file in self.files
+                if file in changed_at and now - changed_at[file] >= self.debounce_seconds
+            ]
+            for file in settled:
+                del changed_at[file]
+            settled = [file for file in settled if self.stats[file] is not None]
+            if settled:
+                yield settled
+            stop.wait(self.poll_seconds)
+
+
+class JsonPatcher:
+    """
+    Keeps each chapter's records encoded, so when one chapter changes only
+    it is encoded again before the JSON files are rewritten.
+    """
+
+    def __init__(
+        self,
+        files: Iterable[str],
+        ndjson: bool = False,
+        compress: bool = False,
+        flush_bytes: int = FLUSH_BYTES,
+    ):
+        self.files = list(files)
+        self.ndjson = ndjson
+        self.compress = compress
+        self.flush_bytes = flush_bytes
+        self.encode = (NdjsonWriter if ndjson else JsonArrayWriter).encode
+        self.encoded: dict[str, dict[str, list[str]]] = {}
+
+    def update(self, file: str, chapter: tuple[list[Peak], list[Pass], Region]):
+        peaks, passes, region = chapter
+        self.encoded[file] = dict(
+            peaks=[self.encode(peak) for peak in peaks],
+            passes=[self.encode(mountain_pass) for mountain_pass in passes],
+            regions=[self.encode(region)],
+        )
+
+    def write(self):
+        for kind in JSON_KINDS:
+            with json_writer(kind, self.ndjson, self.compress, self.flush_bytes) as writer:
+                for file in self.files:
+                    for text in self.encoded.get(file, {}).get(kind, ()):
+                        writer.write_encoded(text)
+
+
+class SqlitePatcher:
+    """Syncs regions into the database, each call in its own transaction."""
+
+    def __init__(self, engine, batch_size: int):
+        self.engine = engine
+        self.batch_size = batch_size
+
+    def sync(
+        self, regions: Iterable[Region], region_ids: Optional[Iterable[str]] = None
+    ) -> SqliteSync:
+        """
+        Sync regions and delete what they no longer contain, then rebuild
+        their stats. With region_ids, only rows of those regions are
+        considered, so a region renamed by the edit can be replaced by
+        passing its old and new IDs.
+        """
+        with self.engine.connect() as connection:
+            transaction = connection.begin()
+            sync = SqliteSync(connection, self.batch_size, region_ids)
+            for region in regions:
+                sync.sync_region(region)
+            sync.delete_stale()
+            if sync.changed:
+                refresh_region_stats(connection, region_ids)
+            transaction.commit()
+        return sync
+
+
+def watch_outputs(
+    workers: int = 1,
+    use_cache: bool = True,
+    engine: str = "tree",
+    json: bool = False,
+    ndjson: bool = False,
+    compress: bool = False,
+    flush_bytes: int = FLUSH_BYTES,
+    sqlite: bool = False,
+    batch_size: int = parser.SQLITE_BATCH_SIZE,
+    stop=None,
+):
+    """
+    Write the JSON and/or SQLite outputs, then watch the input files and,
+    as each chapter is edited, reparse just that chapter and patch its
+    region into the outputs. Runs until interrupted, or stop is set.
+    """
+    json_patcher = None
+    if json or ndjson:
+        json_patcher = JsonPatcher(parser.INPUT_FILES, ndjson, compress, flush_bytes)
+    sqlite_patcher = None
+    if sqlite:
+        sqlite_patcher = SqlitePatcher(open_database(), batch_size)
+
+    # Stat the files first, so an edit made while parsing is still seen.
+    watcher = ChapterWatcher(parser.INPUT_FILES)
+    sources = dict(zip(parser.INPUT_FILES, parser.chapter_sources(parser.INPUT_FILES)))
+    region_ids = {}
+    regions = []
+    hashes = BuildHashes()
+    hashes_path = parser.output_path(parser.HASHES_NAME)
+    chapters = parser.iter_parsed_chapters(workers, use_cache, engine)
+    for file, chapter in zip(parser.INPUT_FILES, chapters):
+        region_ids[file] = chapter[2].region_id
+        regions.append(chapter[2])
+        hashes.add(chapter[2])
+        if json_patcher:
+            json_patcher.update(file, chapter)
+    hashes.write(hashes_path)
+    if json_patcher:
+        json_patcher.write()
+    if sqlite_patcher:
+        click.echo(f"Synced: {sqlite_patcher.sync(regions).summary()}")
+    del regions
+    click.echo(f"Watching {len(parser.INPUT_FILES)} chapters for changes. Press Ctrl-C to stop.")
+
+    try:
+        for files in watcher.changes(stop):
+            for file in files:
+                start = time.perf_counter()
+                try:
+                    peaks, passes, region = chapter = parser.parse_chapter(
+                        file, use_cache, engine, source=sources[file]
+                    )
+                except Exception as e:
+                    # Likely a half-finished edit; the next save tries again.
+                    click.echo(f"Couldn't parse {file}: {e!r}")
+                    continue
+                hashes.remove(region_ids[file])
+                hashes.add(region)
+                hashes.write(hashes_path)
+                summary = ""
+                if sqlite_patcher:
+                    ids = {region_ids[file], region.region_id}
+                    summary = f" ({sqlite_patcher.sync([region], ids).summary()})"
+                region_ids[file] = region.region_id
+                if json_patcher:
+                    json_patcher.update(file, chapter)
+                    json_patcher.write()
+                milliseconds = (time.perf_counter() - start) * 1000
+                click.echo(
+                    f"Updated {region.name}: {len(peaks)} peaks, {len(passes)} passes"
+                    f" in {milliseconds:.0f} ms{summary}"
+                )
+    except KeyboardInterrupt:
+        pass
@@ -1,14 +1,80 @@
+import contextlib
+import copy
+import gc
+import http.client
+import io
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
+from dataclasses import asdict
+from functools import partial
+from unittest import mock
 
 import bs4
+import click
+from sqlalchemy import create_engine, event, select, text
 
+from benchmarks.loader import reparse_soup
+from benchmarks.synthetic import write_corpus
 from climbers_guide_parser import (
     __version__,
     get_passes,
     get_peaks,
     get_region,
     get_soup,
+    parser,
 )
+from climbers_guide_parser.batch import BatchRun, Checkpoint, QuarantinedRecord
+from climbers_guide_parser.cache import ChapterCache
+from climbers_guide_parser.database import Base
+from climbers_guide_parser.dedupe import (
+    find_candidates,
+    link_duplicates,
+    normalize_name,
+)
+from climbers_guide_parser.elevations import elevation_stats, in_elevation_range
+from climbers_guide_parser.hashing import BuildHashes, diff_manifests
+from climbers_guide_parser.json_writer import FLUSH_BYTES, JsonArrayWriter, NdjsonWriter
+from climbers_guide_parser.parser import (
+    ParseError,
+    Peak,
+    iter_batch_chapters,
+    parse_chapter,
+    parse_chapter_uncached,
+    parse_class_rating,
+    parse_elevation,
+    stable_id,
+)
+from climbers_guide_parser.profiling import Profiler, gc_tuning
+from climbers_guide_parser.search import create_fts, search
+from climbers_guide_parser.server import GuideServer, GuideService
+from climbers_guide_parser.shards import (
+    assign_shards,
+    discover_inputs,
+    merge_json,
+    read_records,
+    select_shard,
+    shard_suffix,
+)
+from climbers_guide_parser.snapshot import Snapshot, SnapshotError, write_snapshot
+from climbers_guide_parser.sqlite_output import (
+    OWN_COLUMNS,
+    merge_sqlite,
+    open_database,
+    output_sqlite,
+)
+from climbers_guide_parser.stats import refresh_region_stats, region_stats
+from climbers_guide_parser.store import GuideStore
+from climbers_guide_parser.stream import parse_soup
+from climbers_guide_parser.sync import TABLES, SqliteSync
+from climbers_guide_parser.watch import ChapterWatcher, SqlitePatcher
 
 # Constants
 PREFIX = "/home/scott/Documents/A_Climbers_Guide/"
@@ -17,6 +83,37 @@ KAWEAHS = PREFIX + "kaweahs_great_western_divide.html"
 YOSEMITE = PREFIX + "yosemite_valley.html"
 
 
+def dump_tables(engine) -> dict:
+    """
+    Every table's rows by stable ID, without the columns each database sets
+    for itself, and with row ids replaced by the stable IDs they point at.
+    """
+    stable_ids: dict = {}
+    tables = {}
+    with engine.connect() as connection:
+        for table, key in TABLES:
+            rows = connection.execute(select(table)).mappings().all()
+            stable_ids[table.name] = {row["id"]: row[key] for row in rows}
+            parents = {
+                column.name: next(iter(column.foreign_keys)).column.table.name
+                for column in table.columns
+                if column.foreign_keys
+            }
+            tables[table.name] = sorted(
+                (
+                    {
+                        k: stable_ids[parents[k]][v] if k in parents else v
+                        for k, v in row.items()
+                        if k not in OWN_COLUMNS
+                    }
+                    for row in rows
+                ),
+                key=lambda row: row[key],
+            )
+    engine.dispose()
+    return tables
+
+
 class TestVersion(unittest.TestCase):
     def test_version(self):
         assert __version__ == "0.2.0"
@@ -150,5 +247,1312 @@ class TestRegions(unittest.TestCase):
         self.assertTrue(self.region.passes[1].name == "Jigsaw Pass")
 
 
+class TestSyntheticChapter(unittest.TestCase):
+    """Parse a generated chapter, so these run without the book's files."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.TemporaryDirectory()
+        (cls.chapter,) = write_corpus(cls.tmpdir.name, n_peaks=50, n_chapters=1)
+        cls.soup = get_soup(cls.chapter)
+        cls.region = get_region(cls.soup)
+        cls.peaks, cls.region = get_peaks(cls.soup, cls.region)
+        cls.passes = get_passes(cls.soup, cls.region)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmpdir.cleanup()
+
+    def test_region_name(self):
+        self.assertEqual(self.region.name, "The Palisades 0")
+
+    def test_all_peaks_found(self):
+        """Every peak is parsed, and References is left out."""
+        self.assertEqual(len(self.peaks), 50)
+        self.assertFalse(any("References" in p.name for p in self.peaks))
+
+    def test_every_peak_has_routes(self):
+        self.assertTrue(all(p.routes for p in self.peaks))
+
+    def test_class_ratings(self):
+        """Routes and passes all have a "Class N" rating."""
+        ratings = [r.class_rating for p in self.peaks for r in p.routes]
+        ratings += [p.class_rating for p in self.passes]
+        self.assertTrue(all(r.startswith("Class ") for r in ratings))
+
+    def test_passes(self):
+        self.assertEqual(len(self.passes), 5)
+        self.assertTrue(all("Pass" in p.name for p in self.passes))
+
+    def test_links_removed(self):
+        self.assertIsNone(self.soup.find("a"))
+
+    def test_same_markup_as_reparse(self):
+        """Loading in one parse gives the tree the old two-parse loader did."""
+        self.assertEqual(str(get_soup(self.chapter)), str(reparse_soup(self.chapter)))
+
+
+class TestStreamEngine(unittest.TestCase):
+    """The single-traversal engine gives the same records as the tree functions."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.TemporaryDirectory()
+        cls.chapters = write_corpus(cls.tmpdir.name, n_peaks=120, n_chapters=3, seed=7)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmpdir.cleanup()
+
+    def test_same_records(self):
+        for chapter in self.chapters:
+            with self.subTest(chapter=chapter):
+                tree_soup = get_soup(chapter)
+                region = get_region(tree_soup)
+                peaks, region = get_peaks(tree_soup, region)
+                passes = get_passes(tree_soup, region)
+
+                stream_soup = get_soup(chapter)
+                stream_peaks, stream_passes, stream_region = parse_soup(stream_soup)
+
+                self.assertEqual([asdict(p) for p in stream_peaks], [asdict(p) for p in peaks])
+                self.assertEqual([asdict(p) for p in stream_passes], [asdict(p) for p in passes])
+                self.assertEqual(asdict(stream_region), asdict(region))
+                # Both take the route and pass names out of the tree alike.
+                self.assertEqual(str(stream_soup), str(tree_soup))
+
+
+class TestWorkers(unittest.TestCase):
+    """Parsing in several processes yields what one process does, in the same order."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.TemporaryDirectory()
+        cls.files = write_corpus(cls.tmpdir.name, n_peaks=120, n_chapters=6, seed=11)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmpdir.cleanup()
+
+    def records(self, workers, engine):
+        """The regions' names and IDs, and their peaks', routes' and passes' IDs, in order."""
+        with mock.patch.object(parser, "INPUT_FILES", self.files), mock.patch.object(
+            parser, "INPUT_ROOT", self.tmpdir.name
+        ):
+            return [
+                (
+                    region.name,
+                    region.region_id,
+                    [
+                        (peak.peak_id, [route.route_id for route in peak.routes])
+                        for peak in region.peaks
+                    ],
+                    [mountain_pass.pass_id for mountain_pass in region.passes],
+                )
+                for region in parser.iter_regions(workers, use_cache=False, engine=engine)
+            ]
+
+    def test_same_order_and_ids(self):
+        for engine in ("tree", "stream"):
+            with self.subTest(engine=engine):
+                expected = self.records(1, engine)
+                self.assertEqual(len(expected), len(self.files))
+                self.assertEqual(self.records(3, engine), expected)
+
+    def test_no_files_written(self):
+        """The library only collects the manifest and merge candidates; the CLI writes them."""
+        with tempfile.TemporaryDirectory() as workdir:
+            cwd = os.getcwd()
+            os.chdir(workdir)
+            self.addCleanup(os.chdir, cwd)
+            hashes, candidates = BuildHashes(), []
+            with mock.patch.object(parser, "INPUT_FILES", self.files), mock.patch.object(
+                parser, "INPUT_ROOT", self.tmpdir.name
+            ), contextlib.redirect_stdout(io.StringIO()):
+                regions = list(
+                    parser.iter_regions(1, False, dedupe=True, hashes=hashes, candidates=candidates)
+                )
+                self.assertEqual(os.listdir(workdir), [])
+                self.assertEqual(set(hashes.regions), {region.region_id for region in regions})
+
+                parser.write_build_outputs(hashes, candidates)
+            self.assertEqual(
+                sorted(os.listdir(workdir)),
+                sorted([parser.HASHES_NAME, parser.MERGE_CANDIDATES_NAME]),
+            )
+            os.chdir(cwd)
+
+
+class TestChapterCache(unittest.TestCase):
+    """Test the parsed chapter cache."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cache = ChapterCache(self.tmpdir.name, max_bytes=250, fingerprint="v1")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_round_trip(self):
+        """A stored object comes back out, and a missing key is None."""
+        self.cache.put("a", {"peaks": ["Mount Sill"]})
+        self.assertEqual(self.cache.get("a"), {"peaks": ["Mount Sill"]})
+        self.assertIsNone(self.cache.get("b"))
+
+    def test_key_changes_with_fingerprint(self):
+        """The same chapter gets a new key when the parser changes."""
+        chapter = os.path.join(self.tmpdir.name, "chapter.html")
+        with open(chapter, "wb") as f:
+            f.write(b"<p><i>Mount Sill (14,162)</i></p>")
+        other = ChapterCache(self.tmpdir.name, max_bytes=250, fingerprint="v2")
+        self.assertNotEqual(self.cache.key(chapter), other.key(chapter))
+
+    def test_fingerprint_covers_cached_types(self):
+        """Every module defining a type stored in a cached chapter is fingerprinted."""
+        for cls in (parser.Peak, parser.Route, parser.Pass, parser.Region, QuarantinedRecord):
+            module = sys.modules[cls.__module__]
+            self.assertIn(os.path.basename(module.__file__), parser.FINGERPRINT_MODULES)
+
+    def test_unloadable_entry_is_miss(self):
+        """An entry naming a class that no longer exists is a miss, not an error."""
+        with open(self.cache.path("a"), "wb") as f:
+            f.write(b"cclimbers_guide_parser.batch\nNoSuchRecord\n.")
+        self.assertIsNone(self.cache.get("a"))
+
+    def test_evicts_least_recently_used(self):
+        """Going over max_bytes evicts the least recently used entry."""
+        self.cache.put("a", b"a" * 100)
+        self.cache.put("b", b"b" * 100)
+        os.utime(self.cache.path("a"), (0, 0))
+        os.utime(self.cache.path("b"), (1, 1))
+        self.cache.get("a")  # Now the most recently used.
+        self.cache.put("c", b"c" * 100)
+        self.assertIsNone(self.cache.get("b"))
+        self.assertIsNotNone(self.cache.get("a"))
+
+
+class TestJsonWriters(unittest.TestCase):
+    """The JSON writers stream records, and only ever replace the whole file."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.TemporaryDirectory()
+        (chapter,) = write_corpus(cls.tmpdir.name, n_peaks=20, n_chapters=1)
+        cls.peaks = parse_chapter(chapter)[0]
+        # What each record reads back as, with datetimes as strings.
+        cls.expected = [json.loads(json.dumps(asdict(p), default=str)) for p in cls.peaks]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmpdir.cleanup()
+
+    def setUp(self):
+        self.outdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.outdir.name, "output-peaks.json")
+
+    def tearDown(self):
+        self.outdir.cleanup()
+
+    def write(self, writer_class, records, **kwargs):
+        with writer_class(self.path, **kwargs) as writer:
+            for record in records:
+                writer.write(record)
+        return writer
+
+    def test_json_array(self):
+        """Records are written as one array, in small flushes or large."""
+        for flush_bytes in (1, FLUSH_BYTES):
+            writer = self.write(JsonArrayWriter, self.peaks, flush_bytes=flush_bytes)
+            self.assertEqual(writer.count, len(self.peaks))
+            with open(self.path) as f:
+                self.assertEqual(json.load(f), self.expected)
+        self.write(JsonArrayWriter, [])
+        with open(self.path) as f:
+            self.assertEqual(json.load(f), [])
+
+    def test_ndjson(self):
+        """One compact record per line."""
+        self.write(NdjsonWriter, self.peaks, flush_bytes=1)
+        with open(self.path) as f:
+            lines = f.read().splitlines()
+        self.assertEqual([json.loads(line) for line in lines], self.expected)
+        compact = json.dumps(self.expected[0], sort_keys=True, separators=(",", ":"))
+        self.assertEqual(lines[0], compact)
+
+    def test_gzip(self):
+        """With compress, the output is gzipped under path + '.gz'."""
+        for writer_class in (JsonArrayWriter, NdjsonWriter):
+            writer = self.write(writer_class, self.peaks, compress=True)
+            self.assertEqual(writer.path, self.path + ".gz")
+            self.assertFalse(os.path.exists(self.path))
+            records = list(read_records(writer.path, writer_class is NdjsonWriter))
+            self.assertEqual(records, self.expected)
+
+    def test_rerun_replaces(self):
+        """A second run replaces the file rather than appending to it."""
+        for writer_class, ndjson in ((JsonArrayWriter, False), (NdjsonWriter, True)):
+            self.write(writer_class, self.peaks)
+            self.write(writer_class, self.peaks[:1])
+            self.assertEqual(list(read_records(self.path, ndjson)), self.expected[:1])
+
+    def test_atomic_replace(self):
+        """Readers see the old file until the new one is complete, and a failed run keeps it."""
+        self.write(NdjsonWriter, self.peaks[:2])
+        with open(self.path) as f:
+            old = f.read()
+
+        with self.assertRaises(RuntimeError):
+            with NdjsonWriter(self.path, flush_bytes=1) as writer:
+                writer.write(self.peaks[2])
+                with open(self.path) as f:
+                    self.assertEqual(f.read(), old)
+                raise RuntimeError("Interrupted")
+        with open(self.path) as f:
+            self.assertEqual(f.read(), old)
+        self.assertEqual(os.listdir(self.outdir.name), ["output-peaks.json"])
+
+        # The file gets the permissions of any other, not mkstemp()'s.
+        plain = os.path.join(self.outdir.name, "plain.json")
+        open(plain, "w").close()
+        self.assertEqual(os.stat(self.path).st_mode, os.stat(plain).st_mode)
+
+
+class TestStableIds(unittest.TestCase):
+    """IDs are derived from names, so reruns produce the same ones."""
+
+    def test_same_name_same_id(self):
+        """The same parts always give the same ID."""
+        self.assertEqual(
+            stable_id(set(), "The Palisades", "peaks", "Mount Sill"),
+            stable_id(set(), "The Palisades", "peaks", "Mount Sill"),
+        )
+
+    def test_repeated_name_is_unique(self):
+        """A name repeated under the same parent still gets a unique ID."""
+        issued: set[str] = set()
+        first = stable_id(issued, "The Palisades", "peaks", "Peak 12,135")
+        second = stable_id(issued, "The Palisades", "peaks", "Peak 12,135")
+        self.assertNotEqual(first, second)
+        self.assertEqual(second, stable_id({first}, "The Palisades", "peaks", "Peak 12,135"))
+
+    def test_same_title_in_two_chapters(self):
+        """Two copies of a chapter, e.g. two editions, don't share any IDs."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            (chapter,) = write_corpus(tmpdir, n_peaks=20, n_chapters=1)
+            files = []
+            for edition in ("1954", "1965"):
+                os.mkdir(os.path.join(tmpdir, edition))
+                files.append(os.path.join(tmpdir, edition, os.path.basename(chapter)))
+                shutil.copy(chapter, files[-1])
+            sources = parser.chapter_sources(files)
+            regions = [parse_chapter(f, source=source)[2] for f, source in zip(files, sources)]
+            again = parse_chapter(files[1], source=sources[1])[2]
+
+        self.assertEqual(regions[0].name, regions[1].name)
+        ids = []
+        for region in regions:
+            ids.append({region.region_id})
+            for peak in region.peaks:
+                ids[-1].add(peak.peak_id)
+                ids[-1].update(route.route_id for route in peak.routes)
+            ids[-1].update(mountain_pass.pass_id for mountain_pass in region.passes)
+        self.assertFalse(ids[0] & ids[1])
+        self.assertEqual(again.region_id, regions[1].region_id)
+
+        engine = create_engine("sqlite://")
+        Base.metadata.create_all(engine)
+        with engine.connect() as connection:
+            sync = SqliteSync(connection)
+            for region in regions:
+                sync.sync_region(region)
+            self.assertEqual(sync.counts["inserted"], len(ids[0]) + len(ids[1]))
+        engine.dispose()
+
+
+class TestSqliteSync(unittest.TestCase):
+    """Batched writes match row-by-row ones, and pragmas apply on every connection."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.TemporaryDirectory()
+        files = write_corpus(cls.tmpdir.name, n_peaks=60, n_chapters=3)
+        cls.regions = [parse_chapter(f)[2] for f in files]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmpdir.cleanup()
+
+    def sync(self, engine, batch_size):
+        Base.metadata.create_all(engine)
+        with engine.begin() as connection:
+            sync = SqliteSync(connection, batch_size)
+            for region in self.regions:
+                sync.sync_region(region)
+            sync.delete_stale()
+        return sync.counts
+
+    def test_batch_sizes_agree(self):
+        """Any batch size writes the same rows as one row at a time."""
+        single = create_engine("sqlite://")
+        self.sync(single, batch_size=1)
+        expected = dump_tables(single)
+        self.assertTrue(all(expected.values()))
+        for batch_size in (7, 1000):
+            engine = create_engine("sqlite://")
+            self.sync(engine, batch_size)
+            self.assertEqual(dump_tables(engine), expected)
+
+        # Resyncing in other batches changes nothing.
+        with tempfile.TemporaryDirectory() as tmpdir:
+            engine = create_engine(f"sqlite:///{os.path.join(tmpdir, 'guide.sqlite')}")
+            inserted = self.sync(engine, batch_size=1)["inserted"]
+            counts = self.sync(engine, batch_size=7)
+            self.assertEqual(counts["unchanged"], inserted)
+            self.assertEqual(counts["inserted"] + counts["updated"] + counts["deleted"], 0)
+            engine.dispose()
+
+    def pragma(self, engine, name):
+        with engine.connect() as connection:
+            return connection.exec_driver_sql(f"PRAGMA {name}").scalar()
+
+    def test_pragmas_on_connect(self):
+        """The default pragmas, or those given, are set on each new connection."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            engine = open_database(os.path.join(tmpdir, "guide.sqlite"))
+            for _ in range(2):
+                self.assertEqual(self.pragma(engine, "journal_mode"), "wal")
+                self.assertEqual(self.pragma(engine, "synchronous"), 1)  # NORMAL
+                self.assertEqual(self.pragma(engine, "cache_size"), -64000)
+                engine.dispose()  # So the next check gets a new connection.
+
+            pragmas = dict(parser.SQLITE_PRAGMAS, synchronous="OFF", cache_size="-2000")
+            engine = open_database(os.path.join(tmpdir, "other.sqlite"), pragmas)
+            self.assertEqual(self.pragma(engine, "synchronous"), 0)
+            self.assertEqual(self.pragma(engine, "cache_size"), -2000)
+            self.assertEqual(self.pragma(engine, "journal_mode"), "wal")
+            engine.dispose()
+
+    def test_pragma_option(self):
+        args = ["--pragma", "synchronous=OFF", "--pragma", "cache_size=-2000", "-s"]
+        with parser.main.make_context("main", args) as ctx:
+            self.assertEqual(ctx.params["pragmas"], {"synchronous": "OFF", "cache_size": "-2000"})
+        for bad in ("synchronous", "synchronous=OFF; DROP TABLE peaks"):
+            with self.assertRaises(click.BadParameter):
+                parser.main.make_context("main", ["--pragma", bad])
+
+
+class TestSearch(unittest.TestCase):
+    """The full-text index follows the rows it covers."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        (chapter,) = write_corpus(self.tmpdir.name, n_peaks=30, n_chapters=1)
+        soup = get_soup(chapter)
+        self.region = get_region(soup)
+        get_peaks(soup, self.region)
+        get_passes(soup, self.region)
+
+        self.engine = create_engine("sqlite://")
+        Base.metadata.create_all(self.engine)
+        with self.engine.begin() as connection:
+            sync = SqliteSync(connection)
+            sync.sync_region(self.region)
+            sync.flush()
+            self.assertEqual(create_fts(connection), ["peaks_fts", "routes_fts", "passes_fts"])
+            self.assertEqual(create_fts(connection), [])
+
+    def tearDown(self):
+        self.engine.dispose()
+        self.tmpdir.cleanup()
+
+    def sync(self):
+        with self.engine.begin() as connection:
+            sync = SqliteSync(connection)
+            sync.sync_region(self.region)
+            sync.delete_stale()
+
+    def search(self, query, kind=None):
+        with self.engine.connect() as connection:
+            return search(connection, query, kind)
+
+    def test_finds_existing_rows(self):
+        """A new index is filled from the rows already in the database."""
+        peak = self.region.peaks[0]
+        hits = self.search(f'"{peak.name}"', "peak")
+        self.assertEqual(hits[0].key, peak.peak_id)
+
+    def test_diacritics_ignored(self):
+        route = self.region.peaks[0].routes[0]
+        route.description += " Traverse the arête."
+        self.sync()
+        self.assertIn(route.route_id, [hit.key for hit in self.search("arete", "route")])
+
+    def test_updates_and_deletes(self):
+        route = self.region.peaks[0].routes[0]
+        route.description = "Squeeze up the zyzzyva chimney."
+        self.sync()
+        (hit,) = self.search("zyzzyva")
+        self.assertEqual((hit.kind, hit.key), ("route", route.route_id))
+        self.assertIn("[zyzzyva]", hit.snippet)
+
+        self.region.peaks[0].routes.remove(route)
+        self.sync()
+        self.assertEqual(self.search("zyzzyva"), [])
+        with self.engine.connect() as connection:
+            connection.execute(
+                text("INSERT INTO routes_fts(routes_fts, rank) VALUES ('integrity-check', 1)")
+            )
+
+
+class TestElevations(unittest.TestCase):
+    """Elevation strings become numbers that can be queried by range."""
+
+    def test_parse_elevation(self):
+        self.assertEqual(parse_elevation("13,882"), (13882, False, False))
+        self.assertEqual(parse_elevation("13,900+"), (13900, True, False))
+        self.assertEqual(parse_elevation("13,917n"), (13917, False, True))
+        self.assertIsNone(parse_elevation("1 NW of Recess Peak"))
+
+    def test_first_elevation_used(self):
+        """The surveyed figure is used over a later map-derived one."""
+        soup = bs4.BeautifulSoup(
+            "<body><p><i>Mount Agassiz (13,882; 13,891n)</i></p><p>Class 2. Easy.</p></body>",
+            "lxml",
+        )
+        soup.p["class"] = ["peak"]
+        region = get_region(soup)
+        (peak,), _ = get_peaks(soup, region)
+        self.assertEqual(peak.elevations, ["13,882", "13,891n"])
+        self.assertEqual(peak.elevation_feet, 13882)
+        self.assertFalse(peak.elevation_map_derived)
+
+    def test_range_query_and_stats(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            (chapter,) = write_corpus(tmpdir, n_peaks=40, n_chapters=1)
+            soup = get_soup(chapter)
+            region = get_region(soup)
+            peaks, region = get_peaks(soup, region)
+
+        engine = create_engine("sqlite://")
+        Base.metadata.create_all(engine)
+        with engine.begin() as connection:
+            sync = SqliteSync(connection)
+            sync.sync_region(region)
+            sync.flush()
+            rows = in_elevation_range(connection, 11000, 13000)
+            exact = in_elevation_range(connection, 11000, 13000, include_lower_bounds=False)
+        engine.dispose()
+
+        expected = sorted(
+            (p.elevation_feet, p.peak_id) for p in peaks if 11000 <= p.elevation_feet <= 13000
+        )
+        self.assertEqual([(r["elevation_feet"], r["key"]) for r in rows], expected)
+        self.assertFalse(any(r["elevation_lower_bound"] for r in exact))
+
+        stats = elevation_stats(peaks)
+        self.assertEqual(stats["count"], 40)
+        self.assertEqual(stats["min"], min(p.elevation_feet for p in peaks))
+        self.assertEqual(sum(stats["bands"].values()), 40)
+
+
+class TestClassRatings(unittest.TestCase):
+    """Class ratings get a numeric grade, aggregated per region in region_stats."""
+
+    def test_parse_class_rating(self):
+        self.assertEqual(parse_class_rating("Class 3"), 3)
+        self.assertEqual(parse_class_rating("Class 3-4"), 4)
+        self.assertEqual(parse_class_rating("Class 2 or 3"), 3)
+        self.assertEqual(parse_class_rating("Maximum class 5"), 5)
+        self.assertEqual(parse_class_rating("Easy class 3"), 3)
+        self.assertEqual(parse_class_rating("Classes 3 and 4"), 4)
+        self.assertIsNone(parse_class_rating("Easy scramble"))
+        self.assertIsNone(parse_class_rating("First-class views"))
+
+    def test_region_stats(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            files = write_corpus(tmpdir, n_peaks=40, n_chapters=2)
+            regions = [parse_chapter(f, use_cache=False)[2] for f in files]
+
+        engine = create_engine("sqlite://")
+        Base.metadata.create_all(engine)
+        with engine.begin() as connection:
+            sync = SqliteSync(connection)
+            for region in regions:
+                sync.sync_region(region)
+            sync.flush()
+            refresh_region_stats(connection)
+            stats = region_stats(connection, regions[0].slug)
+            self.assertIsNone(region_stats(connection, "no-such-region"))
+
+            # Rebuilding one region leaves the other's stats alone.
+            before = region_stats(connection, regions[1].slug)
+            refresh_region_stats(connection, [regions[0].region_id])
+            self.assertEqual(region_stats(connection, regions[1].slug), before)
+        engine.dispose()
+
+        region = regions[0]
+        routes = [route for peak in region.peaks for route in peak.routes]
+        self.assertEqual(stats["peaks"], len(region.peaks))
+        self.assertEqual(stats["routes"], len(routes))
+        by_class = {row["class_grade"]: row["routes"] for row in stats["routes_by_class"]}
+        self.assertEqual(sum(by_class.values()), len(routes))
+        self.assertEqual(by_class.get(3), sum(route.class_grade == 3 for route in routes))
+
+        rated = [peak for peak in region.peaks if any(r.class_grade for r in peak.routes)]
+        self.assertEqual(len(stats["hardest_routes"]), len(rated))
+        hardest = {row["peak_slug"]: row["class_grade"] for row in stats["hardest_routes"]}
+        easiest = {row["peak_slug"]: row["class_grade"] for row in stats["easiest_routes"]}
+        for peak in rated:
+            grades = [r.class_grade for r in peak.routes if r.class_grade is not None]
+            self.assertEqual(hardest[peak.slug], max(grades))
+            self.assertEqual(easiest[peak.slug], min(grades))
+
+
+class TestGuideStore(unittest.TestCase):
+    """Records read back through GuideStore match what was parsed."""
+
+    @classmethod
+    def setUpClass(cls):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            (chapter,) = write_corpus(tmpdir, n_peaks=30, n_chapters=1)
+            soup = get_soup(chapter)
+            cls.region = get_region(soup)
+            cls.peaks, cls.region = get_peaks(soup, cls.region)
+            get_passes(soup, cls.region)
+        cls.region.peaks[1].aka = ["The Thumb"]
+        cls.region.passes[0].aka = ["Mono Col"]
+
+        cls.engine = create_engine("sqlite://")
+        Base.metadata.create_all(cls.engine)
+        with cls.engine.begin() as connection:
+            sync = SqliteSync(connection)
+            sync.sync_region(cls.region)
+            sync.flush()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.engine.dispose()
+
+    def setUp(self):
+        self.store = GuideStore(self.engine, cache_size=8)
+        self.queries = 0
+        event.listen(self.engine, "before_cursor_execute", self.count_query)
+
+    def tearDown(self):
+        event.remove(self.engine, "before_cursor_execute", self.count_query)
+
+    def count_query(self, *args):
+        self.queries += 1
+
+    @staticmethod
+    def fields(record):
+        # Timestamps are rewritten by the sync, so leave them out.
+        d = asdict(record)
+        for k in ("created", "last_modified"):
+            d.pop(k)
+        for route in d.get("routes", []):
+            route.pop("created")
+            route.pop("last_modified")
+        return d
+
+    def test_pass_aka(self):
+        """A pass's aka, as --dedupe links, is written and matched by name."""
+        mountain_pass = self.region.passes[0]
+        with self.engine.connect() as connection:
+            aka = connection.execute(
+                text("SELECT aka FROM passes WHERE pass_id = :pass_id"),
+                dict(pass_id=mountain_pass.pass_id),
+            ).scalar()
+        self.assertEqual(json.loads(aka), ["Mono Col"])
+        found = self.store.get_by_name("Mono Col", "pass")
+        self.assertEqual([p.pass_id for p in found], [mountain_pass.pass_id])
+        self.assertEqual(found[0].aka, ["Mono Col"])
+
+    def test_get_by_slug(self):
+        peak = self.peaks[0]
+        found = self.store.get_by_slug(peak.slug)
+        self.assertEqual(self.fields(found), self.fields(peak))
+        self.assertEqual(found.routes[0].peak_id, found.peak_id)
+
+        route = peak.routes[-1]
+        self.assertEqual(self.store.get_by_slug(route.slug, "route").route_id, route.route_id)
+        mountain_pass = self.region.passes[0]
+        found = self.store.get_by_slug(mountain_pass.slug, "pass")
+        self.assertEqual(found.name, mountain_pass.name)
+        self.assertIsNone(self.store.get_by_slug("no-such-peak"))
+
+    def test_get_by_name_and_aka(self):
+        peak = self.peaks[1]
+        self.assertEqual([p.peak_id for p in self.store.get_by_name(peak.name)], [peak.peak_id])
+        self.assertEqual([p.peak_id for p in self.store.get_by_name("The Thumb")], [peak.peak_id])
+
+    def test_no_query_per_peak(self):
+        """A region's peaks and their routes load in a fixed number of queries."""
+        peaks = self.store.peaks_in_region(self.region.slug)
+        self.assertEqual([p.peak_id for p in peaks], [p.peak_id for p in self.peaks])
+        self.assertEqual(sum(len(p.routes) for p in peaks), sum(len(p.routes) for p in self.peaks))
+        self.assertLessEqual(self.queries, 2)
+
+    def test_cache(self):
+        slug = self.peaks[0].slug
+        first = self.store.get_by_slug(slug)
+        queries = self.queries
+        self.assertIs(self.store.get_by_slug(slug), first)
+        self.assertEqual(self.queries, queries)
+        self.assertEqual((self.store.cache.hits, self.store.cache.misses), (1, 1))
+
+        for peak in self.peaks[1:12]:
+            self.store.get_by_slug(peak.slug)
+        self.assertEqual(len(self.store.cache), 8)
+        self.assertIsNot(self.store.get_by_slug(slug), first)
+
+
+class TestServer(unittest.TestCase):
+    """The HTTP service pages results and answers revalidation with 304s."""
+
+    @classmethod
+    def setUpClass(cls):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            (chapter,) = write_corpus(tmpdir, n_peaks=30, n_chapters=1)
+            soup = get_soup(chapter)
+            cls.region = get_region(soup)
+            cls.peaks, cls.region = get_peaks(soup, cls.region)
+            get_passes(soup, cls.region)
+
+        cls.tmpdir = tempfile.TemporaryDirectory()
+        db = os.path.join(cls.tmpdir.name, "guide.sqlite")
+        engine = create_engine(f"sqlite:///{db}")
+        Base.metadata.create_all(engine)
+        with engine.begin() as connection:
+            sync = SqliteSync(connection)
+            sync.sync_region(cls.region)
+            sync.flush()
+        engine.dispose()
+        cls.store = GuideStore.open(db, pool_size=2)
+        cls.service = GuideService(cls.store)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.store.close()
+        cls.tmpdir.cleanup()
+
+    def get(self, path):
+        status, body, etag = self.service.get(path)
+        return status, json.loads(body), etag
+
+    def test_pages(self):
+        status, page, _ = self.get("/peaks?offset=10&limit=10")
+        self.assertEqual(status, 200)
+        self.assertEqual(page["total"], 30)
+        expected = [p.peak_id for p in self.peaks[10:20]]
+        self.assertEqual([p["peak_id"] for p in page["items"]], expected)
+        self.assertEqual(page["next"], "/peaks?offset=20&limit=10")
+        _, last, _ = self.get(f"/regions/{self.region.slug}/peaks?offset=20&limit=10")
+        self.assertIsNone(last["next"])
+
+    def test_records(self):
+        peak = self.peaks[3]
+        _, found, _ = self.get(f"/peaks/{peak.slug}")
+        self.assertEqual(found["name"], peak.name)
+        self.assertEqual(len(found["routes"]), len(peak.routes))
+        _, routes, _ = self.get(f"/peaks/{peak.slug}/routes")
+        self.assertEqual([r["route_id"] for r in routes], [r.route_id for r in peak.routes])
+        _, regions, _ = self.get("/regions")
+        self.assertEqual(regions[0]["peaks"], 30)
+
+    def test_errors(self):
+        self.assertEqual(self.get("/peaks/no-such-peak")[0], 404)
+        self.assertEqual(self.get("/nowhere")[0], 404)
+        self.assertEqual(self.get("/peaks?limit=0")[0], 400)
+        self.assertEqual(self.get("/peaks?offset=x")[0], 400)
+
+    def test_conditional_get(self):
+        server = GuideServer(("127.0.0.1", 0), self.service)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", server.server_port)
+            connection.request("GET", "/regions")
+            response = connection.getresponse()
+            response.read()
+            etag = response.getheader("ETag")
+            self.assertEqual(response.status, 200)
+
+            connection.request("GET", "/regions", headers={"If-None-Match": etag})
+            response = connection.getresponse()
+            self.assertEqual((response.status, response.read()), (304, b""))
+            connection.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+
+try:
+    import pyarrow  # noqa: F401
+except ImportError:
+    pyarrow = None
+
+
+@unittest.skipUnless(pyarrow, "needs pyarrow")
+class TestColumnar(unittest.TestCase):
+    """Parquet and Arrow tables hold every record, joined by stable IDs."""
+
+    def test_tables(self):
+        import pyarrow.ipc as ipc
+        import pyarrow.parquet as pq
+
+        from climbers_guide_parser.columnar import write_columnar
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            files = write_corpus(os.path.join(tmpdir, "corpus"), n_peaks=60, n_chapters=2)
+            regions = []
+            for chapter in files:
+                soup = get_soup(chapter)
+                region = get_region(soup)
+                get_peaks(soup, region)
+                get_passes(soup, region)
+                regions.append(region)
+
+            # Small batches, so dictionaries grow across batches.
+            counts = write_columnar(regions, tmpdir, "parquet", batch_rows=7)
+            write_columnar(regions, tmpdir, "arrow", batch_rows=7)
+            peaks = pq.read_table(os.path.join(tmpdir, "output-peaks.parquet"))
+            routes = pq.read_table(os.path.join(tmpdir, "output-routes.parquet"))
+            arrow_routes = ipc.open_file(os.path.join(tmpdir, "output-routes.arrow")).read_all()
+
+        all_peaks = [p for r in regions for p in r.peaks]
+        all_routes = [route for p in all_peaks for route in p.routes]
+        self.assertEqual(counts["peaks"], len(all_peaks))
+        self.assertEqual(peaks.column("peak_id").to_pylist(), [p.peak_id for p in all_peaks])
+        self.assertEqual(
+            peaks.column("region").to_pylist(), [r.name for r in regions for _ in r.peaks]
+        )
+        self.assertEqual(
+            routes.column("peak_id").to_pylist(), [route.peak_id for route in all_routes]
+        )
+        self.assertEqual(
+            routes.column("class_rating").to_pylist(), [route.class_rating for route in all_routes]
+        )
+        self.assertEqual(routes.schema, arrow_routes.schema)
+        self.assertEqual(routes.to_pylist(), arrow_routes.to_pylist())
+
+
+class TestSnapshot(unittest.TestCase):
+    """Every record can be found in a snapshot by its slug."""
+
+    def test_lookups(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            files = write_corpus(os.path.join(tmpdir, "corpus"), n_peaks=40, n_chapters=2)
+            regions = []
+            for chapter in files:
+                soup = get_soup(chapter)
+                region = get_region(soup)
+                get_peaks(soup, region)
+                get_passes(soup, region)
+                regions.append(region)
+            path = os.path.join(tmpdir, "guide.snapshot")
+            count = write_snapshot(regions, path)
+
+            peaks = [p for r in regions for p in r.peaks]
+            routes = [route for p in peaks for route in p.routes]
+            passes = [p for r in regions for p in r.passes]
+            with Snapshot(path) as snapshot:
+                self.assertEqual(count, len(regions) + len(peaks) + len(routes) + len(passes))
+                self.assertEqual(len(snapshot), count)
+                for peak in peaks:
+                    record = snapshot.get(peak.slug)
+                    self.assertEqual((record["kind"], record["peak_id"]), ("peak", peak.peak_id))
+                    self.assertEqual(record["description"], peak.description)
+                    self.assertEqual(record["routes"], [route.slug for route in peak.routes])
+                slugs = {peak.peak_id: peak.slug for peak in peaks}
+                for route in routes:
+                    self.assertEqual(snapshot.description(route.slug), route.description)
+                    self.assertEqual(snapshot.get(route.slug)["peak"], slugs[route.peak_id])
+                self.assertEqual(snapshot.get(passes[0].slug)["name"], passes[0].name)
+                self.assertEqual(snapshot.get(regions[1].slug)["name"], regions[1].name)
+                self.assertIsNone(snapshot.get("no-such-slug"))
+                self.assertNotIn("zzz", snapshot)
+
+    def test_not_a_snapshot(self):
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(b"x" * 64)
+            f.flush()
+            with self.assertRaises(SnapshotError):
+                Snapshot(f.name)
+
+
+class TestDedupe(unittest.TestCase):
+    """The same peak in two chapters is found without comparing every pair."""
+
+    def peak(self, name, region, feet):
+        return Peak(
+            created="",
+            last_modified="",
+            peak_id=f"{region}/{name}",
+            name=name,
+            region=region,
+            elevation_feet=feet,
+        )
+
+    def test_normalize_name(self):
+        self.assertEqual(normalize_name("Mt. Clarence King"), "mount clarence king")
+        self.assertEqual(normalize_name("Peak 12,135"), "peak 12135")
+        self.assertEqual(normalize_name("Mount Agassíz"), "mount agassiz")
+
+    def test_candidates(self):
+        peaks = [
+            self.peak("Mount Ritter", "Ritter Range", 13157),
+            self.peak("Mt. Ritter", "Minarets", 13143),
+            self.peak("Mount Ritter", "Cathedral Range", 13157),
+            # Too far off in elevation.
+            self.peak("Mount Ritter", "Clark Range", 11500),
+            # Different numbers are different peaks.
+            self.peak("Peak 12,135", "Palisades", 12135),
+            self.peak("Peak 12,150", "Whitney", 12150),
+            self.peak("Mount Morgan", "Palisades", 13150),
+        ]
+        pairs = {(c.id, c.other_id, c.match) for c in find_candidates(peaks)}
+        self.assertEqual(
+            pairs,
+            {
+                ("Ritter Range/Mount Ritter", "Minarets/Mt. Ritter", "alias"),
+                ("Ritter Range/Mount Ritter", "Cathedral Range/Mount Ritter", "duplicate"),
+                ("Minarets/Mt. Ritter", "Cathedral Range/Mount Ritter", "alias"),
+            },
+        )
+
+    def test_same_chapter(self):
+        peaks = [
+            self.peak("Mount Ritter", "Ritter Range", 13157),
+            self.peak("Mt. Ritter", "Ritter Range", 13143),
+        ]
+        self.assertEqual(find_candidates(peaks), [])
+        self.assertEqual(len(find_candidates(peaks, cross_region_only=False)), 1)
+
+    def test_link_duplicates(self):
+        ritter = self.peak("Mount Ritter", "Ritter Range", 13157)
+        alias = self.peak("Mt. Ritter", "Minarets", 13143)
+        candidates = link_duplicates([ritter, alias], [])
+        self.assertEqual(len(candidates), 1)
+        self.assertEqual(ritter.aka, ["Mt. Ritter"])
+        self.assertEqual(alias.aka, ["Mount Ritter"])
+        link_duplicates([ritter, alias], [])
+        self.assertEqual(ritter.aka, ["Mt. Ritter"])
+
+
+class TestWatch(unittest.TestCase):
+    """Edited chapters are noticed once, and patched in alone."""
+
+    def test_debounce(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "chapter.html")
+            with open(path, "w") as f:
+                f.write("<html></html>")
+            watcher = ChapterWatcher([path], poll_seconds=0.01, debounce_seconds=0.1)
+            stop = threading.Event()
+            changes = watcher.changes(stop)
+            start = time.monotonic()
+            for html in ("<html>1</html>", "<html>12</html>"):
+                with open(path, "w") as f:
+                    f.write(html)
+            self.assertEqual(next(changes), [path])
+            self.assertGreaterEqual(time.monotonic() - start, 0.1)
+            stop.set()
+            self.assertEqual(list(changes), [])
+
+    def test_patch_one_region(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            files = write_corpus(tmpdir, n_peaks=20, n_chapters=2)
+            (_, _, first), (_, _, second) = (parse_chapter(f) for f in files)
+
+        engine = create_engine("sqlite://")
+        Base.metadata.create_all(engine)
+        patcher = SqlitePatcher(engine, batch_size=100)
+        patcher.sync([first, second])
+
+        removed = first.peaks.pop()
+        first.peaks[0].description = "Edited."
+        sync = patcher.sync([first], [first.region_id])
+        self.assertEqual(sync.counts["updated"], 1)
+        self.assertEqual(sync.counts["deleted"], 1 + len(removed.routes))
+
+        with engine.connect() as connection:
+            names = {row.name for row in connection.execute(text("SELECT name FROM peaks"))}
+        engine.dispose()
+        expected = {peak.name for peak in first.peaks + second.peaks}
+        self.assertEqual(names, expected)
+
+
+class TestStartup(unittest.TestCase):
+    """Heavy dependencies are only imported by the backends that need them."""
+
+    def imported(self, statement):
+        script = f"import sys; {statement}; print(' '.join(sys.modules))"
+        result = subprocess.run(
+            [sys.executable, "-c", script], capture_output=True, text=True, check=True
+        )
+        return {name.split(".")[0] for name in result.stdout.split()}
+
+    def test_json_without_sqlalchemy(self):
+        modules = self.imported(
+            "import climbers_guide_parser.parser;"
+            " from climbers_guide_parser.backends import load_backend; load_backend('json')"
+        )
+        self.assertNotIn("sqlalchemy", modules)
+        self.assertNotIn("pyarrow", modules)
+
+    def test_sqlite_backend(self):
+        modules = self.imported(
+            "from climbers_guide_parser.backends import load_backend; load_backend('sqlite')"
+        )
+        self.assertIn("sqlalchemy", modules)
+
+
+class TestShards(unittest.TestCase):
+    """Sharded builds cover every chapter once and merge to the unsharded result."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.TemporaryDirectory()
+        cls.files = write_corpus(cls.tmpdir.name, n_peaks=60, n_chapters=5)
+        cls.chapters = [parse_chapter(f, use_cache=False) for f in cls.files]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmpdir.cleanup()
+
+    def test_discover_inputs(self):
+        self.assertEqual(discover_inputs(self.tmpdir.name), sorted(self.files))
+        manifest = os.path.join(self.tmpdir.name, "chapters.txt")
+        with open(manifest, "w") as f:
+            f.write("# Two chapters\n\n")
+            f.write("\n".join(os.path.basename(file) for file in self.files[:2]))
+        self.assertEqual(discover_inputs(manifest), self.files[:2])
+
+    def test_assign_shards(self):
+        shards = assign_shards(self.files, 2)
+        self.assertEqual(shards, assign_shards(list(reversed(self.files)), 2))
+        selected = [select_shard(self.files, i, 2) for i in (1, 2)]
+        self.assertEqual(sorted(selected[0] + selected[1]), sorted(self.files))
+
+    def test_shards_are_stable(self):
+        """Editing or adding chapters doesn't move the others between shards."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            files = write_corpus(tmpdir, n_peaks=60, n_chapters=8)
+            shards = assign_shards(files, 4, tmpdir)
+            with open(files[0], "a") as f:
+                f.write("<p>" + "Edited. " * 10000 + "</p>")
+            added = os.path.join(tmpdir, "added.html")
+            shutil.copy(files[1], added)
+            self.assertEqual(
+                assign_shards(files + [added], 4, tmpdir),
+                dict(shards, **{added: assign_shards([added], 4, tmpdir)[added]}),
+            )
+
+    def test_merge_sqlite(self):
+        def sync(engine, regions):
+            Base.metadata.create_all(engine)
+            with engine.connect() as connection:
+                transaction = connection.begin()
+                sqlite_sync = SqliteSync(connection)
+                for region in regions:
+                    sqlite_sync.sync_region(region)
+                sqlite_sync.delete_stale()
+                transaction.commit()
+
+        regions = copy.deepcopy([region for _, _, region in self.chapters])
+        regions[0].passes[0].aka = ["Mono Col"]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            paths = []
+            for i in (1, 2):
+                paths.append(os.path.join(tmpdir, f"babble{shard_suffix(i, 2)}.sqlite"))
+                selected = select_shard(self.files, i, 2)
+                engine = create_engine(f"sqlite:///{paths[-1]}")
+                sync(engine, [r for r, f in zip(regions, self.files) if f in selected])
+                # As a shard built before passes' aka was written would have it.
+                with engine.begin() as connection:
+                    connection.execute(text("UPDATE passes SET aka = NULL WHERE aka = '[]'"))
+                engine.dispose()
+            merged = create_engine("sqlite://")
+            Base.metadata.create_all(merged)
+            merge_sqlite(paths, merged)
+        unsharded = create_engine("sqlite://")
+        sync(unsharded, regions)
+
+        merged_rows, unsharded_rows = dump_tables(merged), dump_tables(unsharded)
+        self.assertTrue(all(merged_rows.values()))
+        self.assertEqual(merged_rows, unsharded_rows)
+
+    def test_small_shards(self):
+        """A shard with no chapters, or only one peak, builds its database without failing."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            (one_peak,) = write_corpus(os.path.join(tmpdir, "one"), n_peaks=1, n_chapters=1)
+            for name, files, peaks in (("empty", [], 0), ("one-peak", [one_peak], 1)):
+                with self.subTest(shard=name):
+                    outdir = os.path.join(tmpdir, name)
+                    os.makedirs(outdir, exist_ok=True)
+                    with mock.patch.object(parser, "INPUT_FILES", files), mock.patch.object(
+                        parser, "INPUT_ROOT", tmpdir
+                    ), mock.patch.object(
+                        parser, "output_path", partial(os.path.join, outdir)
+                    ), contextlib.redirect_stdout(
+                        io.StringIO()
+                    ):
+                        output_sqlite(use_cache=False)
+                    engine = create_engine(f"sqlite:///{os.path.join(outdir, parser.DBNAME)}")
+                    with engine.connect() as connection:
+                        count = connection.execute(text("SELECT count(*) FROM peaks")).scalar()
+                    engine.dispose()
+                    self.assertEqual(count, peaks)
+
+    def test_merge_json(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for i in (1, 2):
+                selected = select_shard(self.files, i, 2)
+                for kind in ("peaks", "passes", "regions"):
+                    records = []
+                    for file, (peaks, passes, region) in zip(self.files, self.chapters):
+                        if file in selected:
+                            records += dict(peaks=peaks, passes=passes, regions=[region])[kind]
+                    path = os.path.join(tmpdir, f"output-{kind}{shard_suffix(i, 2)}.ndjson")
+                    with open(path, "w") as f:
+                        f.writelines(json.dumps(asdict(r), default=str) + "\n" for r in records)
+            counts = merge_json(tmpdir, 2, ndjson=True)
+            with open(os.path.join(tmpdir, "output-regions.ndjson")) as f:
+                names = [json.loads(line)["name"] for line in f]
+        self.assertEqual(counts["peaks"], sum(len(peaks) for peaks, _, _ in self.chapters))
+        self.assertEqual(names, sorted(region.name for _, _, region in self.chapters))
+
+
+class TestHashing(unittest.TestCase):
+    """Content hashes ignore timestamps, and diffs report only what changed."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.files = write_corpus(self.tmpdir.name, n_peaks=30, n_chapters=2)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def parse(self):
+        return [parse_chapter(f, use_cache=False)[2] for f in self.files]
+
+    def build(self, regions):
+        hashes = BuildHashes()
+        for region in regions:
+            hashes.add(region)
+        return hashes
+
+    def test_timestamps_not_hashed(self):
+        old = self.build(self.parse())
+        regions = self.parse()
+        for region in regions:
+            region.created = region.last_modified = "2000-01-01 00:00:00"
+            for peak in region.peaks:
+                peak.created = "2000-01-01 00:00:00"
+        self.assertEqual(self.build(regions).book_hash, old.book_hash)
+        self.assertEqual(diff_manifests(old, self.build(regions)), [])
+
+    def test_rollup_and_diff(self):
+        old_regions = self.parse()
+        old = self.build(old_regions)
+        regions = self.parse()
+        peak = next(peak for peak in regions[0].peaks if peak.routes)
+        sibling = next(p for p in regions[0].peaks if p is not peak)
+        route = peak.routes[0]
+        route.description = "Edited."
+        removed = regions[1].passes.pop()
+        new = self.build(regions)
+
+        old_peak = next(p for p in old_regions[0].peaks if p.peak_id == peak.peak_id)
+        self.assertNotEqual(peak.content_hash, old_peak.content_hash)
+        self.assertNotEqual(regions[0].content_hash, old_regions[0].content_hash)
+        self.assertEqual(
+            sibling.content_hash,
+            next(p for p in old_regions[0].peaks if p.peak_id == sibling.peak_id).content_hash,
+        )
+
+        changes = {(c.action, c.kind, c.key) for c in diff_manifests(old, new)}
+        self.assertEqual(
+            changes, {("changed", "route", route.route_id), ("removed", "pass", removed.pass_id)}
+        )
+
+        path = os.path.join(self.tmpdir.name, "hashes.json")
+        new.write(path)
+        self.assertEqual(BuildHashes.read(path).book_hash, new.book_hash)
+
+        # Written with the permissions of any other file, not mkstemp()'s.
+        plain = os.path.join(self.tmpdir.name, "plain.json")
+        open(plain, "w").close()
+        self.assertEqual(os.stat(path).st_mode, os.stat(plain).st_mode)
+
+
+class TestBatch(unittest.TestCase):
+    """Records that fail to parse are quarantined, and batch runs resume."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.files = write_corpus(self.tmpdir.name, n_peaks=40, n_chapters=3, seed=3)
+        self.chapters = [parse_chapter(f) for f in self.files]
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def edit(self, file: str, pattern: str, replacement: str):
+        with open(file, encoding="windows-1252") as f:
+            html = f.read()
+        html = re.sub(pattern, replacement, html, count=1)
+        with open(file, "w", encoding="windows-1252") as f:
+            f.write(html)
+
+    def break_records(self, file: str):
+        """Add a route and a pass with no "." after their class ratings."""
+        self.edit(file, r"(<p class=\"peak\">|<p><i>[^<]*</i></p>)", r"\1<p>Class 3 no period</p>")
+        self.edit(file, r"(<h4>Passes</h4>)", r"\1<p>\n<i>Broken Pass (11,000).</i> Class 2\n</p>")
+
+    def test_quarantine(self):
+        file = self.files[0]
+        self.break_records(file)
+        found = []
+        for engine in ("tree", "stream"):
+            # Outside a batch run, a bad record fails the chapter as ever.
+            with self.assertRaises(IndexError):
+                parse_chapter(file, engine=engine)
+            peaks, passes, region = parse_chapter(file, engine=engine, quarantine=True)
+            self.assertEqual(len(peaks), len(self.chapters[0][0]))
+            self.assertEqual(len(passes), len(self.chapters[0][1]))
+            found.append([asdict(record) for record in region.quarantined])
+        self.assertEqual(found[0], found[1])
+        self.assertEqual([record["kind"] for record in found[0]], ["pass", "route"])
+        self.assertTrue(all(record["file"] == file for record in found[0]))
+        self.assertEqual(found[0][1]["text"], "Class 3 no period")
+        self.assertTrue(found[0][1]["peak"])
+
+    def test_cached_quarantine_raises_outside_batch(self):
+        """A chapter cached by a batch run, with records quarantined, fails an ordinary parse."""
+        file = self.files[0]
+        self.break_records(file)
+        cache_dir = os.path.join(self.tmpdir.name, "cache")
+        with mock.patch.object(parser, "CACHE_DIR", cache_dir):
+            region = parse_chapter(file, use_cache=True, quarantine=True)[2]
+            self.assertEqual(len(region.quarantined), 2)
+            with self.assertRaisesRegex(ParseError, r"pass failed with IndexError.*\(and 1 more\)"):
+                parse_chapter(file, use_cache=True)
+
+    def test_quarantine_is_opt_in(self):
+        """The tree functions raise unless the region is quarantining, and bugs always raise."""
+        self.break_records(self.files[0])
+        soup = get_soup(self.files[0])
+        region = get_region(soup)
+        with self.assertRaises(IndexError):
+            get_passes(soup, region)
+
+        region.quarantined = []
+        get_passes(soup, region)
+        self.assertEqual([record.kind for record in region.quarantined], ["pass"])
+        with mock.patch.object(parser, "pass_parser", side_effect=AttributeError("bug")):
+            with self.assertRaises(AttributeError):
+                get_passes(get_soup(self.files[1]), region)
+
+    def test_resume(self):
+        """A rerun parses only the chapters that failed or changed."""
+        self.break_records(self.files[1])
+        with open(self.files[2], "ab") as f:
+            f.write(b"\x81")  # Not windows-1252, so the chapter can't be read.
+        checkpoint = Checkpoint(os.path.join(self.tmpdir.name, "checkpoint"), "v1")
+
+        batch = BatchRun(checkpoint)
+        regions = [region for _, _, region in iter_batch_chapters(batch, self.files)]
+        self.assertEqual(len(regions), 2)
+        self.assertEqual((batch.parsed, batch.resumed), (2, 0))
+        self.assertEqual([failure.file for failure in batch.failed], [self.files[2]])
+        self.assertEqual(len(batch.quarantined), 2)
+
+        with open(self.files[2], "rb") as f:
+            html = f.read()
+        with open(self.files[2], "wb") as f:
+            f.write(html[:-1])
+        batch = BatchRun(checkpoint)
+        regions = [region for _, _, region in iter_batch_chapters(batch, self.files)]
+        self.assertEqual((batch.parsed, batch.resumed), (1, 2))
+        self.assertEqual(len(batch.quarantined), 2)
+        self.assertFalse(batch.clean)
+        expected = [region for _, _, region in self.chapters]
+        self.assertEqual(
+            [region.region_id for region in regions], [region.region_id for region in expected]
+        )
+        peak_ids = [[peak.peak_id for peak in region.peaks] for region in (regions[2], expected[2])]
+        self.assertEqual(peak_ids[0], peak_ids[1])
+
+
+class TestProfiler(unittest.TestCase):
+    """Test the stage timers and counters."""
+
+    def test_disabled_records_nothing(self):
+        profiler = Profiler()
+        with profiler.timer("load"):
+            pass
+        profiler.count("cache.hits")
+        report = profiler.report()
+        self.assertEqual(report["stages"], {})
+        self.assertEqual(report["counters"], {})
+
+    def test_enabled_records_stages(self):
+        profiler = Profiler()
+        profiler.enabled = True
+        for _ in range(3):
+            with profiler.timer("load"):
+                pass
+        profiler.count("cache.hits", 2)
+        report = profiler.report()
+        self.assertEqual(report["stages"]["load"]["calls"], 3)
+        self.assertEqual(report["counters"], {"cache.hits": 2})
+
+    def test_merge_worker_snapshot(self):
+        """Snapshots from worker processes add into the parent's totals."""
+        parent, worker = Profiler(), Profiler()
+        parent.enabled = worker.enabled = True
+        with worker.timer("peaks"):
+            pass
+        worker.chapter("palisades.html", 0.5, peaks=10)
+        parent.merge(worker.snapshot())
+        report = parent.report()
+        self.assertEqual(report["stages"]["peaks"]["calls"], 1)
+        self.assertEqual(report["chapters"][0]["peaks"], 10)
+
+    def test_report_memory(self):
+        profiler = Profiler()
+        profiler.enabled = True
+        memory = profiler.report()["memory"]
+        self.assertEqual(len(memory["gc_collections"]), 3)
+        if sys.platform != "win32":
+            self.assertGreater(memory["peak_rss_bytes"], 0)
+
+    def test_gc_tuning_restores(self):
+        thresholds = gc.get_threshold()
+        with gc_tuning(threshold=50000, freeze=True):
+            self.assertEqual(gc.get_threshold()[0], 50000)
+            self.assertGreater(gc.get_freeze_count(), 0)
+        self.assertEqual(gc.get_threshold(), thresholds)
+        self.assertEqual(gc.get_freeze_count(), 0)
+
+    def test_parsed_chapter_leaves_no_tree(self):
+        """A chapter's soup is freed as it's parsed, not left to the cyclic collector."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            (chapter,) = write_corpus(tmpdir, n_peaks=40, n_chapters=1)
+            for engine in ("tree", "stream"):
+                gc.collect()
+                gc.disable()
+                try:
+                    peaks, passes, region = parse_chapter_uncached(chapter, engine)
+                    self.assertTrue(peaks)
+                    del peaks, passes, region
+                    # Only the few objects of the builder are left, however long the chapter.
+                    self.assertLess(gc.collect(), 100, engine)
+                finally:
+                    gc.enable()
+
+
 if __name__ == "__main__":
     unittest.main()